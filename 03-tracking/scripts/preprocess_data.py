@@ -1,79 +1,171 @@
 
 import os
-import pandas as pd
-from sklearn.feature_extraction import DictVectorizer
-import pickle
-import urllib.request
-
-def download_data(url, filename):
-    """Downloads data from a URL and saves it to a file."""
-    print(f"Downloading {url} to {filename}...")
+import sys
+import tempfile
+import click
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from taxi_common.compression import compress_rows, numeric_columns
+from taxi_common.data_store import DatasetStore
+from taxi_common.features import prepare_trips
+from taxi_common.loader import read_trips
+from taxi_common.matrix_store import load_array, permuted_chunks, save_dataset
+from taxi_common.streaming import (
+    DEFAULT_MEMORY_BUDGET_MB, fit_vectorizer, iter_file_features, iter_trip_chunks, num_rows, rows_per_chunk,
+    stack_features
+)
+from taxi_common.vectorizers import stack_matrices
+
+DATA_URL_PATTERN = "https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet"
+
+# Training rows are saved in a fixed random order, so any prefix is a random
+# sample that training scripts can slice without copying
+SHUFFLE_SEED = 42
+
+def download_data(year, month, store):
+    """Returns the local path of a month of data, downloading it only on a cache miss."""
     try:
-        urllib.request.urlretrieve(url, filename)
-        print(f"✅ Downloaded {filename}")
+        path = store.fetch(year, month, DATA_URL_PATTERN)
+        print(f"✅ {year}-{month:02d} available at {path}")
+        return path
     except Exception as e:
-        print(f"❌ Error downloading {filename}: {e}")
+        print(f"❌ Error getting {year}-{month:02d}: {e}")
         raise
 
-def preprocess_data(data_path, output_path):
+def load_in_memory(train_path, val_path, categorical, numerical):
+    """Builds the feature matrices from fully loaded monthly DataFrames."""
+    # Read only the needed columns; the duration filter runs inside the Arrow scan
+    df_train = read_trips(train_path, categorical, numerical, min_duration=1, max_duration=60)
+    df_val = read_trips(val_path, categorical, numerical, min_duration=1, max_duration=60)
+
+    df_train = prepare_trips(df_train, 1, 60, categorical=categorical, numerical=numerical, route_key=False)
+    df_val = prepare_trips(df_val, 1, 60, categorical=categorical, numerical=numerical, route_key=False)
+
+    # Location IDs stay int16 until this final vectorization step
+    X_train, y_train, dv = stack_features([df_train], categorical + numerical)
+    X_val, y_val, _ = stack_features([df_val], categorical + numerical, dv=dv)
+
+    return X_train, y_train, X_val, y_val, dv
+
+def load_streaming(train_path, val_path, categorical, numerical, memory_budget_mb):
+    """
+    Fits the vectorizer one row group at a time and returns lazy feature chunks.
+
+    Nothing is vectorized here: save_dataset writes each (X, y) chunk straight
+    to the .npy files, so no full matrix is ever held in memory.
+    """
+    chunk_kwargs = dict(
+        categorical=categorical,
+        numerical=numerical,
+        min_duration=1,
+        max_duration=60,
+        memory_budget_mb=memory_budget_mb,
+        route_key=False
+    )
+    features = categorical + numerical
+
+    dv = fit_vectorizer(iter_trip_chunks(train_path, **chunk_kwargs), features)
+    # Every kept trip has at most one entry per feature
+    chunks = {
+        name: (iter_file_features([path], dv, features, **chunk_kwargs), num_rows(path) * len(features))
+        for name, path in (('train', train_path), ('val', val_path))
+    }
+    return chunks, dv
+
+def preprocess_data(data_path, output_path, store=None, streaming=False, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+                    compress=False, distance_resolution=None):
     """Loads, preprocesses, and saves the taxi dataset."""
     # Create directories if they don't exist
-    os.makedirs(data_path, exist_ok=True)
     os.makedirs(output_path, exist_ok=True)
 
-    # Download and load the data
-    jan_url = "https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_2023-01.parquet"
-    feb_url = "https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_2023-02.parquet"
-
-    download_data(jan_url, os.path.join(data_path, "jan.parquet"))
-    download_data(feb_url, os.path.join(data_path, "feb.parquet"))
-
-    df_jan = pd.read_parquet(os.path.join(data_path, "jan.parquet"))
-    df_feb = pd.read_parquet(os.path.join(data_path, "feb.parquet"))
+    # Load the data through the local dataset cache (data_path=None: $TAXI_DATA_CACHE_DIR or ~/.cache/nyc-taxi)
+    if store is None:
+        store = DatasetStore.from_env(cache_dir=data_path)
 
     # For simplicity, we'll just use the January and February data for training and validation
-    df_train = df_jan
-    df_val = df_feb
+    train_path = download_data(2023, 1, store)
+    val_path = download_data(2023, 2, store)
 
     # Preprocessing steps
     categorical = ['PULocationID', 'DOLocationID']
     numerical = ['trip_distance']
 
-    df_train['duration'] = df_train.lpep_dropoff_datetime - df_train.lpep_pickup_datetime
-    df_train.duration = df_train.duration.apply(lambda td: td.total_seconds() / 60)
-    df_train = df_train[(df_train.duration >= 1) & (df_train.duration <= 60)]
-
-    df_val['duration'] = df_val.lpep_dropoff_datetime - df_val.lpep_pickup_datetime
-    df_val.duration = df_val.duration.apply(lambda td: td.total_seconds() / 60)
-    df_val = df_val[(df_val.duration >= 1) & (df_val.duration <= 60)]
-
-    df_train[categorical] = df_train[categorical].astype(str)
-    df_val[categorical] = df_val[categorical].astype(str)
-
-    train_dicts = df_train[categorical + numerical].to_dict(orient='records')
-    val_dicts = df_val[categorical + numerical].to_dict(orient='records')
-
-    dv = DictVectorizer()
-    X_train = dv.fit_transform(train_dicts)
-    X_val = dv.transform(val_dicts)
-
-    target = 'duration'
-    y_train = df_train[target].values
-    y_val = df_val[target].values
-
-    # Save the preprocessed data
-    with open(os.path.join(output_path, "X_train.pkl"), "wb") as f:
-        pickle.dump(X_train, f)
-    with open(os.path.join(output_path, "y_train.pkl"), "wb") as f:
-        pickle.dump(y_train, f)
-    with open(os.path.join(output_path, "X_val.pkl"), "wb") as f:
-        pickle.dump(X_val, f)
-    with open(os.path.join(output_path, "y_val.pkl"), "wb") as f:
-        pickle.dump(y_val, f)
-    with open(os.path.join(output_path, "dv.pkl"), "wb") as f:
-        pickle.dump(dv, f)
+    chunks = {}
+    if streaming:
+        print(f"Streaming mode: memory budget {memory_budget_mb} MB per chunk")
+        chunks, dv = load_streaming(train_path, val_path, categorical, numerical, memory_budget_mb)
+        arrays = {}
+        if compress:
+            # Finding duplicate rows needs the whole training matrix; validation stays streamed
+            train_chunks, _ = chunks.pop('train')
+            X_parts, y_parts = zip(*train_chunks)
+            arrays = dict(X_train=stack_matrices(X_parts), y_train=np.concatenate(y_parts))
+    else:
+        X_train, y_train, X_val, y_val, dv = load_in_memory(train_path, val_path, categorical, numerical)
+        arrays = dict(X_train=X_train, y_train=y_train, X_val=X_val, y_val=y_val)
+
+    if compress:
+        # Identical training rows become one row weighted by its trip count (validation stays per trip)
+        n_rows = arrays['X_train'].shape[0]
+        arrays['X_train'], arrays['y_train'], arrays['w_train'] = compress_rows(
+            arrays['X_train'], arrays['y_train'], resolution=distance_resolution, columns=numeric_columns(dv, numerical)
+        )
+        print(f"Compressed {n_rows:,} training rows to {arrays['X_train'].shape[0]:,} "
+              f"({n_rows / arrays['X_train'].shape[0]:.1f}x)")
+
+    # Save the preprocessed data as raw arrays that training scripts open memory-mapped
+    if 'X_train' in arrays:
+        order = np.random.default_rng(SHUFFLE_SEED).permutation(arrays['X_train'].shape[0])
+        for name in ('X_train', 'y_train', 'w_train'):
+            if name in arrays:
+                arrays[name] = arrays[name][order]
+        save_dataset(output_path, dv, chunks=chunks, shuffle_seed=SHUFFLE_SEED, **arrays)
+    else:
+        # Streamed training rows are written in file order first, then rewritten shuffled block by block
+        with tempfile.TemporaryDirectory(dir=output_path) as unshuffled_path:
+            save_dataset(unshuffled_path, dv, chunks={'train': chunks.pop('train')})
+            X_train, y_train = load_array(unshuffled_path, 'X_train'), load_array(unshuffled_path, 'y_train')
+            order = np.random.default_rng(SHUFFLE_SEED).permutation(X_train.shape[0])
+            chunks['train'] = (permuted_chunks(X_train, y_train, order, rows_per_chunk(memory_budget_mb)), X_train.nnz)
+            save_dataset(output_path, dv, chunks=chunks, shuffle_seed=SHUFFLE_SEED)
+
+@click.command()
+@click.option(
+    "--data_path",
+    default=None,
+    help="Dataset cache directory for the raw NYC taxi months (default: $TAXI_DATA_CACHE_DIR or ~/.cache/nyc-taxi)"
+)
+@click.option(
+    "--output_path",
+    default="data/processed",
+    help="Location where the processed NYC taxi trip data will be saved"
+)
+@click.option(
+    "--streaming",
+    is_flag=True,
+    help="Process the parquet files one row group at a time with bounded memory"
+)
+@click.option(
+    "--memory_budget_mb",
+    default=DEFAULT_MEMORY_BUDGET_MB,
+    help="Memory budget per chunk in streaming mode"
+)
+@click.option(
+    "--compress_rows",
+    is_flag=True,
+    help="Save identical training rows once, with their trip count as sample weight "
+         "(loads the whole training matrix, also in streaming mode)"
+)
+@click.option(
+    "--distance_resolution",
+    type=float,
+    default=None,
+    help="Round trip_distance to this step (miles) before compressing; default keeps it exact"
+)
+def run_preprocess(data_path: str, output_path: str, streaming: bool, memory_budget_mb: int,
+                   compress_rows: bool, distance_resolution: float):
+    preprocess_data(data_path, output_path, streaming=streaming, memory_budget_mb=memory_budget_mb,
+                    compress=compress_rows, distance_resolution=distance_resolution)
 
 if __name__ == '__main__':
-    data_path = "data"
-    output_path = "data/processed"
-    preprocess_data(data_path, output_path)
+    run_preprocess()
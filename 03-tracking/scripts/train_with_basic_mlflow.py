@@ -1,20 +1,19 @@
 
 import os
-import pickle
+import sys
 
 import click
 import mlflow
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from taxi_common.matrix_store import load_dataset, load_weights
 
 # Connect to the MLflow UI server instead of local SQLite
 mlflow.set_tracking_uri("http://127.0.0.1:5000")
 mlflow.set_experiment("nyc-taxi-experiment")
 
-def load_pickle(filename: str):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
 
 @click.command()
 @click.option(
@@ -24,16 +23,19 @@ def load_pickle(filename: str):
 )
 def run_train(data_path: str):
     with mlflow.start_run():
-        X_train, y_train = load_pickle(os.path.join(data_path, "X_train.pkl")), load_pickle(os.path.join(data_path, "y_train.pkl"))
-        X_val, y_val = load_pickle(os.path.join(data_path, "X_val.pkl")), load_pickle(os.path.join(data_path, "y_val.pkl"))
+        # Memory-mapped: nothing is copied into RAM until the arrays are read
+        X_train, y_train, X_val, y_val = load_dataset(data_path)
+        # Trip counts of compressed rows (None if preprocessed without --compress_rows)
+        w_train = load_weights(data_path)
 
         rf = RandomForestRegressor(max_depth=10, random_state=0)
-        rf.fit(X_train, y_train)
+        rf.fit(X_train, y_train, sample_weight=w_train)
         y_pred = rf.predict(X_val)
 
         rmse = np.sqrt(mean_squared_error(y_val, y_pred))
 
         mlflow.log_param("max_depth", 10)
+        mlflow.log_param("row_compression", w_train is not None)
         mlflow.log_metric("rmse", rmse)
 
         print(f"RMSE: {rmse}")
@@ -1,20 +1,133 @@
-
 import os
-import pickle
+import sys
 
 import click
 import mlflow
 import numpy as np
 import optuna
+import scipy.sparse as sp
+from optuna.storages import RDBStorage, RetryFailedTrialCallback
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from taxi_common.matrix_store import load_dataset, load_shuffle_seed, load_weights
 
 mlflow.set_tracking_uri("http://127.0.0.1:5000")
 mlflow.set_experiment("nyc-taxi-experiment-hpo")
 
-def load_pickle(filename: str):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
+# Trees added between two intermediate validation scores (pruning steps)
+TREES_PER_STEP = 10
+
+
+def split_cpu_budget(cpu_budget, parallel_trials):
+    """Splits the CPU budget into (trials running at once, n_jobs per forest)."""
+    parallel_trials = max(1, min(parallel_trials, cpu_budget))
+    return parallel_trials, max(1, cpu_budget // parallel_trials)
+
+
+def fit_forest_with_pruning(trial, params, X_train, y_train, X_val, y_val, w_train=None):
+    """
+    Grows the forest TREES_PER_STEP trees at a time and reports the validation
+    RMSE after each step, so the pruner can stop unpromising trials early.
+
+    With warm_start the new trees draw the same random states as a single fit,
+    so a trial that is not pruned ends with the same forest. `w_train` holds
+    the trip count of each row when the dataset was saved compressed.
+    """
+    n_estimators = params['n_estimators']
+    rf = RandomForestRegressor(**params, warm_start=True)
+    # Trees expect float32 CSR; convert once instead of on every predict
+    X_val = sp.csr_matrix(X_val, dtype=np.float32)
+    prediction_sum = np.zeros(X_val.shape[0])
+
+    for n_trees in range(TREES_PER_STEP, n_estimators + TREES_PER_STEP, TREES_PER_STEP):
+        n_trees = min(n_trees, n_estimators)
+        grown = len(getattr(rf, 'estimators_', []))
+        rf.set_params(n_estimators=n_trees)
+        rf.fit(X_train, y_train, sample_weight=w_train)
+        # Only the new trees are evaluated; the forest prediction is their running mean
+        for tree in rf.estimators_[grown:]:
+            prediction_sum += tree.predict(X_val)
+        rmse = np.sqrt(mean_squared_error(y_val, prediction_sum / n_trees))
+
+        trial.report(rmse, step=n_trees)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    return rmse
+
+
+def rung_resources(n_rungs, reduction_factor):
+    """Resource of each successive-halving rung: 1, r, r^2, ... (the last one is the full data)."""
+    return [reduction_factor ** k for k in range(n_rungs)]
+
+
+def row_prefix(X, n_rows):
+    """First n_rows of a CSR matrix as slices of its arrays (no copy, memory-maps stay mapped)."""
+    nnz = X.indptr[n_rows]
+    prefix = sp.csr_matrix((n_rows, X.shape[1]), dtype=X.dtype)
+    # Set after construction: the constructor copies slices shorter than half their base array
+    prefix.data, prefix.indices, prefix.indptr = X.data[:nnz], X.indices[:nnz], X.indptr[:n_rows + 1]
+    return prefix
+
+
+def nested_row_subsets(X, y, fractions, weight=None, seed=42, shuffled=False):
+    """
+    Deterministic, nested random subsets of the training rows, one per fraction.
+
+    Each subset is the first rows of one fixed random permutation, so a larger
+    rung always contains the smaller ones; the last rung trains on the loaded
+    matrix itself. When preprocess_data already saved the rows shuffled
+    (`shuffled`), that permutation is the stored order and each subset is a
+    prefix sliced from the loaded arrays without copying. Otherwise the rows
+    are gathered once and shared by every trial, which keeps copies of
+    sum(fractions) of the training matrix (48% with the default rungs) in
+    memory for the whole search. With compressed rows a subset keeps the
+    weights of the rows it draws, so its fraction counts unique rows rather
+    than trips.
+    """
+    n_rows = X.shape[0]
+    y = np.asarray(y)
+    sizes = [max(1, int(n_rows * fraction)) for fraction in fractions]
+
+    if shuffled:
+        return [(row_prefix(X, size), y[:size], None if weight is None else weight[:size]) for size in sizes]
+
+    order = np.random.default_rng(seed).permutation(n_rows)
+    subsets = []
+    for size in sizes:
+        rows = np.sort(order[:size])
+        subsets.append((X[rows], y[rows], None if weight is None else np.asarray(weight)[rows]))
+    return subsets
+
+
+def fit_forest_successive_halving(trial, params, rung_data, resources, X_val, y_val):
+    """
+    Trains the forest on growing subsets of the training rows (one per rung,
+    the last one being the full set) and reports the validation RMSE at each
+    rung, so the SuccessiveHalvingPruner only promotes promising configs to more data.
+    """
+    # Trees expect float32 CSR; convert once instead of on every predict
+    X_val = sp.csr_matrix(X_val, dtype=np.float32)
+    trained_fraction = 0.0
+
+    for resource, (X_rung, y_rung, w_rung) in zip(resources, rung_data):
+        rf = RandomForestRegressor(**params)
+        rf.fit(X_rung, y_rung, sample_weight=w_rung)
+        rmse = np.sqrt(mean_squared_error(y_val, rf.predict(X_val)))
+        trained_fraction += resource / resources[-1]
+        # Data used by the trial so far, in full-dataset fits (pruned or not)
+        trial.set_user_attr('trained_fraction', trained_fraction)
+        mlflow.log_metric("rmse", rmse, step=resource)
+
+        trial.report(rmse, step=resource)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    return rmse
+
 
 @click.command()
 @click.option(
@@ -22,33 +135,138 @@ def load_pickle(filename: str):
     default="./data/processed",
     help="Location where the processed NYC taxi trip data was saved"
 )
-def run_optimization(data_path: str):
-    X_train, y_train = load_pickle(os.path.join(data_path, "X_train.pkl")), load_pickle(os.path.join(data_path, "y_train.pkl"))
-    X_val, y_val = load_pickle(os.path.join(data_path, "X_val.pkl")), load_pickle(os.path.join(data_path, "y_val.pkl"))
+@click.option(
+    "--n_trials",
+    default=10,
+    help="Total number of finished (complete or pruned) trials for the study"
+)
+@click.option(
+    "--storage",
+    default="sqlite:///optuna.db",
+    help="Optuna storage URL; a crashed or interrupted search resumes from it"
+)
+@click.option(
+    "--study_name",
+    default="random-forest-hpo",
+    help="Name of the Optuna study inside the storage"
+)
+@click.option(
+    "--cpu_budget",
+    default=os.cpu_count() or 1,
+    help="Total cores to use, split between parallel trials and each forest"
+)
+@click.option(
+    "--parallel_trials",
+    default=4,
+    help="Trials to run at the same time (capped by the CPU budget)"
+)
+@click.option(
+    "--successive_halving",
+    is_flag=True,
+    help="Train trials on growing fractions of the rows and promote only the best (use its own study_name); "
+         "the rungs are zero-copy slices of datasets saved by the current preprocess_data"
+)
+@click.option(
+    "--rungs",
+    default=4,
+    help="Successive-halving rungs; the first uses reduction_factor^-(rungs-1) of the rows"
+)
+@click.option(
+    "--reduction_factor",
+    default=3,
+    help="Growth of the data fraction between rungs (and share of trials promoted)"
+)
+def run_optimization(data_path: str, n_trials: int, storage: str, study_name: str, cpu_budget: int, parallel_trials: int,
+                     successive_halving: bool, rungs: int, reduction_factor: int):
+    # Memory-mapped: nothing is copied into RAM until the arrays are read,
+    # and the parallel trials share the same pages
+    X_train, y_train, X_val, y_val = load_dataset(data_path)
+    # Trip counts of compressed rows (None if preprocessed without --compress_rows)
+    w_train = load_weights(data_path)
+
+    trial_jobs, forest_jobs = split_cpu_budget(cpu_budget, parallel_trials)
+    print(f"Running {trial_jobs} trials at a time with n_jobs={forest_jobs} per forest")
 
     def objective(trial):
         with mlflow.start_run():
             params = {
-                'n_estimators': trial.suggest_int('n_estimators', 10, 50, 1),
-                'max_depth': trial.suggest_int('max_depth', 1, 20, 1),
-                'min_samples_split': trial.suggest_int('min_samples_split', 2, 10, 1),
-                'min_samples_leaf': trial.suggest_int('min_samples_leaf', 1, 4, 1),
+                'n_estimators': trial.suggest_int('n_estimators', 10, 50, step=1),
+                'max_depth': trial.suggest_int('max_depth', 1, 20, step=1),
+                'min_samples_split': trial.suggest_int('min_samples_split', 2, 10, step=1),
+                'min_samples_leaf': trial.suggest_int('min_samples_leaf', 1, 4, step=1),
                 'random_state': 42,
-                'n_jobs': -1
+                'n_jobs': forest_jobs
             }
             mlflow.log_params(params)
+            mlflow.log_param("row_compression", w_train is not None)
+            mlflow.set_tag("optuna_trial", trial.number)
 
-            rf = RandomForestRegressor(**params)
-            rf.fit(X_train, y_train)
-            y_pred = rf.predict(X_val)
-            rmse = np.sqrt(mean_squared_error(y_val, y_pred))
-            mlflow.log_metric("rmse", rmse)
+            try:
+                if successive_halving:
+                    rmse = fit_forest_successive_halving(trial, params, rung_data, resources, X_val, y_val)
+                else:
+                    rmse = fit_forest_with_pruning(trial, params, X_train, y_train, X_val, y_val, w_train)
+            except optuna.TrialPruned:
+                mlflow.set_tag("pruned", True)
+                raise
+            finally:
+                if successive_halving:
+                    mlflow.log_metric("trained_fraction", trial.user_attrs.get('trained_fraction', 0.0))
+            if not successive_halving:
+                # Successive halving already logged the rmse of every rung, the full data one last
+                mlflow.log_metric("rmse", rmse)
 
         return rmse
 
-    sampler = optuna.samplers.TPESampler(seed=42)
-    study = optuna.create_study(direction="minimize", sampler=sampler)
-    study.optimize(objective, n_trials=10)
+    # Trials that were running when the process died are re-enqueued once
+    # their heartbeat expires
+    rdb_storage = RDBStorage(
+        storage,
+        heartbeat_interval=60,
+        grace_period=120,
+        failed_trial_callback=RetryFailedTrialCallback(max_retry=1)
+    )
+    # constant_liar keeps parallel trials from sampling the same point
+    sampler = optuna.samplers.TPESampler(seed=42, constant_liar=True)
+    if successive_halving:
+        # Steps are rung resources (1, r, r^2, ...), not tree counts
+        resources = rung_resources(rungs, reduction_factor)
+        pruner = optuna.pruners.SuccessiveHalvingPruner(min_resource=1, reduction_factor=reduction_factor)
+        fractions = [resource / resources[-1] for resource in resources[:-1]]
+        shuffled = load_shuffle_seed(data_path) is not None
+        rung_data = nested_row_subsets(X_train, y_train, fractions, w_train, shuffled=shuffled)
+        rung_data.append((X_train, y_train, w_train))
+        print(f"Successive halving on {[f'{r}/{resources[-1]}' for r in resources]} of the training rows")
+        if not shuffled:
+            print(f"Rows not shuffled by preprocess_data: the smaller rungs keep a copy of "
+                  f"{sum(fractions):.0%} of the training matrix (rerun preprocess_data to avoid it)")
+    else:
+        pruner = optuna.pruners.MedianPruner(n_startup_trials=3)
+    study = optuna.create_study(
+        direction="minimize",
+        sampler=sampler,
+        pruner=pruner,
+        storage=rdb_storage,
+        study_name=study_name,
+        load_if_exists=True
+    )
+
+    finished = (TrialState.COMPLETE, TrialState.PRUNED)
+    done = len(study.get_trials(deepcopy=False, states=finished))
+    if done:
+        print(f"Resuming study '{study_name}': {done}/{n_trials} trials already finished")
+
+    study.optimize(
+        objective,
+        n_trials=max(0, n_trials - done),
+        n_jobs=trial_jobs,
+        callbacks=[MaxTrialsCallback(n_trials, states=finished)]
+    )
+    print(f"Best RMSE: {study.best_value:.4f} with {study.best_params}")
+    if successive_halving:
+        trials = study.get_trials(deepcopy=False, states=finished)
+        used = sum(t.user_attrs.get('trained_fraction', 0.0) for t in trials)
+        print(f"Data used: {used:.2f} full-dataset fits for {len(trials)} trials")
 
 if __name__ == '__main__':
     run_optimization()
@@ -2,92 +2,243 @@
 # coding: utf-8
 
 import os
+import sys
 import pickle
 import logging
+from dataclasses import dataclass, replace
 from pathlib import Path
-from typing import Tuple, Optional
+from typing import Any, Optional, Union
 
+import numpy as np
 import pandas as pd
 import xgboost as xgb
-from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
 from sklearn.metrics import root_mean_squared_error
 
 import mlflow
 from prefect import task, flow, get_run_logger
 from prefect.artifacts import create_table_artifact, create_markdown_artifact
 
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from taxi_common.compression import compress_rows, numeric_columns
+from taxi_common.data_store import DatasetStore
+from taxi_common.feature_cache import FeatureCache, data_fingerprint
+from taxi_common.features import prepare_trips
+from taxi_common.loader import read_trips
+from taxi_common.periods import add_months
+from taxi_common.route_stats import (
+    DEFAULT_FOLDS, DEFAULT_SMOOTHING, INDEX_FILENAME, RouteStatsIndex, fit_route_stats, iter_out_of_fold
+)
+from taxi_common.streaming import iter_trip_chunks, stream_features, summarize_chunks
+from taxi_common.task_cache import cached_task_options
+from taxi_common.tracking import FALLBACK_TRACKING_URI, Tracker
+from taxi_common.xgb_data import build_dmatrices
+from taxi_common.vectorizers import (
+    DEFAULT_N_FEATURES, OTHER_ROUTE, fit_columnar, hashing_memory_warning, initial_vectorizer, transform_frame,
+    vectorizer_mode
+)
+from taxi_common.warm_start import (
+    DEFAULT_INCREMENTAL_ROUNDS, latest_model_run, load_booster, load_preprocessor, log_lineage
+)
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# MLflow configuration with fallback
+EXPERIMENT_NAME = "nyc-taxi-experiment-prefect"
+
+# MLflow tracking: connects lazily on the first run (with a short probe and a
+# SQLite fallback), batches params/metrics and uploads models in the background
+tracker = Tracker.from_env(EXPERIMENT_NAME)
+
+
 def setup_mlflow():
-    """Setup MLflow with proper error handling and fallback options."""
-    mlflow_uri = os.getenv("MLFLOW_TRACKING_URI", "sqlite:///mlflow.db")
-    
-    try:
-        mlflow.set_tracking_uri(mlflow_uri)
-        # Test connection
-        mlflow.search_experiments()
-        logger.info(f"Connected to MLflow at: {mlflow_uri}")
-    except Exception as e:
-        logger.warning(f"Failed to connect to {mlflow_uri}: {e}")
-        logger.info("Falling back to local SQLite database")
-        mlflow.set_tracking_uri("sqlite:///mlflow.db")
-    
-    try:
-        mlflow.set_experiment("nyc-taxi-experiment-prefect")
-    except Exception as e:
-        logger.error(f"Failed to set MLflow experiment: {e}")
-        raise
+    """Point the tracker at $MLFLOW_TRACKING_URI (the connection is made on first use)."""
+    tracker.configure(os.getenv("MLFLOW_TRACKING_URI", FALLBACK_TRACKING_URI), EXPERIMENT_NAME)
 
-# Initialize MLflow
-setup_mlflow()
 
+DATA_URL_PATTERN = 'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
 
-@task(name="load_data", description="Load NYC taxi data from parquet files", retries=3, retry_delay_seconds=10)
-def read_dataframe(year: int, month: int) -> pd.DataFrame:
+# Hand-picked defaults; hpo_prefect.py searches for better ones
+BEST_PARAMS = {
+    'learning_rate': 0.09585355369315604,
+    'max_depth': 30,
+    'min_child_weight': 1.060597050922164,
+    'objective': 'reg:squarederror',  # Updated from deprecated 'reg:linear'
+    'reg_alpha': 0.018060244040060163,
+    'reg_lambda': 0.011658731377413597,
+    'seed': 42
+}
+
+
+FEATURES = ['PU_DO', 'trip_distance']
+
+# Columns read from the month files and the duration outlier filter (minutes)
+TRIP_FILTER = dict(
+    categorical=['PULocationID', 'DOLocationID'],
+    numerical=['trip_distance'],
+    min_duration=1,
+    max_duration=60
+)
+
+
+def read_month(path) -> pd.DataFrame:
+    """Read a month file with the duration feature, outlier filter and PU_DO route key."""
+    # Only the feature columns are read and the duration filter runs during the scan
+    return prepare_trips(read_trips(path, **TRIP_FILTER), **TRIP_FILTER)
+
+
+@dataclass
+class MonthData:
+    """
+    Prepared trips of one month, passed between tasks.
+
+    The month file is already in the DatasetStore, so the task cache persists
+    only its checksum; a cached result reads the DataFrame again (see `frame`).
+    With a memory budget the month is never read as one DataFrame: tasks walk
+    its chunks instead (see `chunk_kwargs`).
+    """
+    year: int
+    month: int
+    sha256: str
+    df: Optional[pd.DataFrame] = None
+    memory_budget_mb: Optional[int] = None  # Streaming mode: MB per chunk
+
+    def __getstate__(self):
+        return {**self.__dict__, "df": None}
+
+    def cache_fingerprint(self):
+        return {"year": self.year, "month": self.month, "sha256": self.sha256}
+
+    @property
+    def streaming(self) -> bool:
+        return self.memory_budget_mb is not None
+
+    def path(self) -> Path:
+        """The month file in the data store, checked against the loaded checksum."""
+        path = DatasetStore.from_env().fetch(self.year, self.month, DATA_URL_PATTERN)
+        if data_fingerprint(path) != self.sha256:
+            raise RuntimeError(f"{self.year}-{self.month:02d} changed in the data cache since it was loaded")
+        return path
+
+    def chunk_kwargs(self) -> dict:
+        """Arguments for `iter_trip_chunks` in streaming mode."""
+        return dict(TRIP_FILTER, memory_budget_mb=self.memory_budget_mb)
+
+    def frames(self):
+        """Prepared trips as DataFrames: the month's chunks in streaming mode, else the whole month."""
+        if self.streaming:
+            return iter_trip_chunks(self.path(), **self.chunk_kwargs())
+        return [self.frame()]
+
+    def frame(self) -> pd.DataFrame:
+        """The month's DataFrame, read from the data store if this result came from the task cache."""
+        if self.streaming:
+            raise RuntimeError(f"{self.year}-{self.month:02d} is loaded in streaming mode; use frames()")
+        if self.df is None:
+            self.df = read_month(self.path())
+        return self.df
+
+
+@dataclass
+class Features:
+    """
+    Feature matrix and targets, passed between tasks.
+
+    When the matrix is in the feature cache, the task cache persists only its
+    key (`fingerprint`); a cached result opens it again (see `matrices`).
+    """
+    X: Any
+    y: Any
+    dv: Union[DictVectorizer, FeatureHasher, RouteStatsIndex]
+    fingerprint: str
+    num_samples: int
+    weight: Any = None  # Row weights of compressed training rows (None = one row per trip)
+    cached: bool = False  # X and y are in the feature cache under `fingerprint`
+
+    def __getstate__(self):
+        if self.cached:
+            return {**self.__dict__, "X": None, "y": None}
+        return self.__dict__
+
+    def cache_fingerprint(self):
+        return self.fingerprint
+
+    def matrices(self):
+        """(X, y), opened from the feature cache if this result came from the task cache."""
+        if self.X is None:
+            cached = FeatureCache.from_env().load(self.fingerprint)
+            if cached is None:
+                raise RuntimeError(f"Features {self.fingerprint[:12]} are no longer in the feature cache")
+            self.X, self.y, _ = cached
+        return self.X, self.y
+
+
+def in_feature_cache(key: str, use_cache: bool = True) -> Optional[str]:
+    """Cache-policy `stored` value: the feature-cache key, or None if the matrix is not there."""
+    return key if use_cache and key in FeatureCache.from_env() else None
+
+
+# Inputs are fingerprinted and results persisted, so a rerun resumes at the first changed task.
+# Months and matrices are persisted as references to the data store and the feature cache.
+@task(
+    name="load_data",
+    description="Load NYC taxi data from parquet files",
+    retries=3,
+    retry_delay_seconds=10,
+    **cached_task_options(
+        exclude=("offline",),
+        stored=lambda inputs: DatasetStore.from_env().checksum(inputs["year"], inputs["month"], DATA_URL_PATTERN)
+    )
+)
+def read_dataframe(
+    year: int,
+    month: int,
+    offline: bool = False,
+    memory_budget_mb: Optional[int] = None
+) -> MonthData:
     """
     Load NYC taxi data for a specific year and month.
 
     Args:
         year: Year of the data to load
         month: Month of the data to load
+        offline: Only use the local data cache, never download
+        memory_budget_mb: Stream the month in chunks of about this size
+            instead of reading it as one DataFrame
 
     Returns:
-        Processed DataFrame with duration feature
+        MonthData with the processed DataFrame (duration feature included),
+        or only the file reference in streaming mode
     """
     logger = get_run_logger()
     
-    url = f'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
+    url = DATA_URL_PATTERN.format(year=year, month=month)
     logger.info(f"Loading data from: {url}")
     
     try:
-        df = pd.read_parquet(url)
-        logger.info(f"Successfully loaded {len(df)} records")
+        store = DatasetStore.from_env(offline=offline or None)
+        path = store.fetch(year, month, DATA_URL_PATTERN)
+        if memory_budget_mb is not None:
+            # Streaming mode: the month is never materialized, tasks walk its chunks
+            df = None
+            stats = summarize_chunks(iter_trip_chunks(path, memory_budget_mb=memory_budget_mb, **TRIP_FILTER))
+            logger.info(f"Streaming {stats['num_records']} records in {memory_budget_mb} MB chunks")
+        else:
+            df = read_month(path)
+            stats = summarize_chunks([df])
+            logger.info(f"Successfully loaded {len(df)} records")
     except Exception as e:
         logger.error(f"Failed to load data from {url}: {e}")
         raise
 
-    # Feature engineering
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
-
-    # Filter outliers
-    df = df[(df.duration >= 1) & (df.duration <= 60)]
-
-    # Categorical features
-    categorical = ['PULocationID', 'DOLocationID']
-    df[categorical] = df[categorical].astype(str)
-    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
-
     # Create artifact with data summary
     summary_data = [
-        ["Total Records", len(df)],
-        ["Average Duration", f"{df['duration'].mean():.2f} minutes"],
-        ["Min Duration", f"{df['duration'].min():.2f} minutes"],
-        ["Max Duration", f"{df['duration'].max():.2f} minutes"],
-        ["Unique PU_DO combinations", df['PU_DO'].nunique()]
+        ["Total Records", stats['num_records']],
+        ["Average Duration", f"{stats['avg_duration']:.2f} minutes"],
+        ["Min Duration", f"{stats['min_duration']:.2f} minutes"],
+        ["Max Duration", f"{stats['max_duration']:.2f} minutes"],
+        ["Unique PU_DO combinations", stats['unique_routes']]
     ]
 
     create_table_artifact(
@@ -96,41 +247,84 @@ def read_dataframe(year: int, month: int) -> pd.DataFrame:
         description=f"Data summary for {year}-{month:02d}"
     )
 
-    return df
+    return MonthData(year=year, month=month, sha256=data_fingerprint(path), df=df, memory_budget_mb=memory_budget_mb)
+
 
+def feature_key(data: MonthData, dv=None, min_route_frequency: int = 1) -> str:
+    """Feature-cache key: the month's checksum, the vectorizer and the feature config."""
+    return FeatureCache.key([data.sha256], dv=dv, features=FEATURES, min_route_frequency=min_route_frequency)
 
-@task(name="create_features", description="Create feature matrix using DictVectorizer")
-def create_features(df: pd.DataFrame, dv: Optional[DictVectorizer] = None) -> Tuple[any, DictVectorizer]:
+
+@task(
+    name="create_features",
+    description="Create feature matrix using DictVectorizer or feature hashing",
+    **cached_task_options(
+        exclude=("use_cache",),
+        stored=lambda inputs: in_feature_cache(
+            feature_key(inputs["data"], inputs.get("dv"), inputs.get("min_route_frequency", 1)),
+            inputs.get("use_cache", True)
+        )
+    )
+)
+def create_features(
+    data: MonthData,
+    dv: Optional[Union[DictVectorizer, FeatureHasher, RouteStatsIndex]] = None,
+    use_cache: bool = True,
+    min_route_frequency: int = 1
+) -> Features:
     """
-    Create feature matrix from DataFrame.
+    Create feature matrix from a loaded month.
 
     Args:
-        df: Input DataFrame
-        dv: Pre-fitted DictVectorizer (optional)
+        data: Loaded month (see read_dataframe)
+        dv: Pre-fitted DictVectorizer or RouteStatsIndex, or a FeatureHasher (optional)
+        use_cache: Reuse the matrix from the local feature cache when the
+            same data was already vectorized with the same vectorizer
+        min_route_frequency: When fitting, routes with fewer trips share a
+            pickup-zone bucket column instead of getting their own
 
     Returns:
-        Tuple of (feature matrix, DictVectorizer)
+        Features with the matrix, targets and vectorizer
     """
     logger = get_run_logger()
     
     categorical = ['PU_DO']
     numerical = ['trip_distance']
-    
-    # Ensure all required columns exist
-    missing_cols = [col for col in categorical + numerical if col not in df.columns]
-    if missing_cols:
-        raise ValueError(f"Missing required columns: {missing_cols}")
-    
-    dicts = df[categorical + numerical].to_dict(orient='records')
-    logger.info(f"Created {len(dicts)} feature dictionaries")
-
-    if dv is None:
-        dv = DictVectorizer(sparse=True)
-        X = dv.fit_transform(dicts)
-
+    key = feature_key(data, dv, min_route_frequency)
+
+    cache = FeatureCache.from_env() if use_cache else None
+    if cache is not None:
+        cached = cache.load(key)
+        if cached is not None:
+            X, y, dv = cached
+            logger.info(f"Loaded {X.shape[0]} records from feature cache")
+            return Features(X, y, dv, fingerprint=key, num_samples=X.shape[0], cached=True)
+
+    fitted = dv is None
+    if data.streaming:
+        # Streaming mode: the vocabulary and the matrix are built chunk by chunk
+        X, y, dv = stream_features(
+            data.path(), FEATURES, dv=dv, min_route_frequency=min_route_frequency, **data.chunk_kwargs()
+        )
+    else:
+        df = data.frame()
+        # Ensure all required columns exist
+        missing_cols = [col for col in FEATURES if col not in df.columns]
+        if missing_cols:
+            raise ValueError(f"Missing required columns: {missing_cols}")
+
+        # The CSR matrix is built straight from the columns, no per-trip dicts
+        if fitted:
+            dv = fit_columnar([df], FEATURES, min_route_frequency)
+        X = transform_frame(df, dv, FEATURES)
+        y = df['duration'].values
+
+    if fitted:
         # Create artifact with feature info
         feature_info = [
             ["Total Features", X.shape[1]],
+            ["Min Route Frequency", min_route_frequency],
+            ["Route Buckets", sum(name.endswith(f"_{OTHER_ROUTE}") for name in dv.feature_names_)],
             ["Categorical Features", len(categorical)],
             ["Numerical Features", len(numerical)],
             ["Samples", X.shape[0]]
@@ -141,28 +335,156 @@ def create_features(df: pd.DataFrame, dv: Optional[DictVectorizer] = None) -> Tu
             table=feature_info,
             description="Feature matrix information"
         )
+
+    logger.info(f"Vectorized {X.shape[0]} records")
+    if cache is not None:
+        cache.store(key, X, y, dv)
+    return Features(X, y, dv, fingerprint=key, num_samples=X.shape[0], cached=cache is not None)
+
+
+def route_stats_key(data: MonthData, smoothing: float, n_folds: int) -> str:
+    """Feature-cache key of the out-of-fold route-stats training matrix."""
+    return FeatureCache.key(
+        [data.sha256], features=FEATURES, route_stats_smoothing=smoothing, route_stats_folds=n_folds
+    )
+
+
+@task(
+    name="create_route_stats_features",
+    description="Fit the route statistics index and build out-of-fold training features",
+    **cached_task_options(
+        exclude=("use_cache",),
+        stored=lambda inputs: in_feature_cache(
+            route_stats_key(
+                inputs["data"], inputs.get("smoothing", DEFAULT_SMOOTHING), inputs.get("n_folds", DEFAULT_FOLDS)
+            ),
+            inputs.get("use_cache", True)
+        )
+    )
+)
+def create_route_stats_features(
+    data: MonthData,
+    smoothing: float = DEFAULT_SMOOTHING,
+    n_folds: int = DEFAULT_FOLDS,
+    use_cache: bool = True
+) -> Features:
+    """
+    Fit the per-route and per-zone statistics index on the training data.
+
+    Training rows are looked up in out-of-fold indices, so a trip's own
+    duration never enters the route statistics it is trained on; validation
+    and serving use the full index returned here.
+
+    Args:
+        data: Loaded training month
+        smoothing: Trips of weight given to the zone level when smoothing route stats
+        n_folds: Out-of-fold parts for the training rows
+        use_cache: Reuse the matrix and index from the local feature cache
+
+    Returns:
+        Features with the dense float32 matrix and the fitted RouteStatsIndex as `dv`
+    """
+    logger = get_run_logger()
+
+    key = route_stats_key(data, smoothing, n_folds)
+    cache = FeatureCache.from_env() if use_cache else None
+    cached = cache.load(key) if cache is not None else None
+    if cached is not None:
+        X, y, index = cached
+        logger.info(f"Loaded route stats and {X.shape[0]} records from feature cache")
+        return Features(X, y, index, fingerprint=key, num_samples=X.shape[0], cached=True)
+
+    # In streaming mode both passes walk the month's chunks in the same order
+    index, fold_indices = fit_route_stats(data.frames(), smoothing, n_folds)
+    parts = list(iter_out_of_fold(data.frames(), fold_indices))
+    if len(parts) == 1:
+        X, y = parts[0]
     else:
-        X = dv.transform(dicts)
+        X, y = np.vstack([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+    logger.info(f"Route stats for {len(index.route_ids_)} routes; {X.shape[0]} records in {n_folds} folds")
+
+    create_table_artifact(
+        key="route-stats",
+        table=[
+            ["Routes", len(index.route_ids_)],
+            ["Smoothing", index.smoothing],
+            ["Out-of-Fold Parts", n_folds],
+            ["Features", X.shape[1]],
+            ["Samples", X.shape[0]]
+        ],
+        description="Route statistics index"
+    )
+    if cache is not None:
+        cache.store(key, X, y, index)
+    return Features(X, y, index, fingerprint=key, num_samples=X.shape[0], cached=cache is not None)
+
+
+@task(name="compress_rows", description="Merge identical training rows into weighted rows")
+def compress_training_rows(features: Features, distance_resolution: Optional[float] = None) -> Features:
+    """
+    Group identical feature rows (after rounding trip_distance, if a resolution
+    is given) into one row with the summed weight and the mean duration.
+
+    Args:
+        features: Training features
+        distance_resolution: Round trip_distance to this step (miles) before grouping
+
+    Returns:
+        Features of the unique rows, with their weights
+    """
+    logger = get_run_logger()
+    X_train, y_train = features.matrices()
+    X, y, weight = compress_rows(
+        X_train, y_train,
+        resolution=distance_resolution,
+        columns=numeric_columns(features.dv, ['trip_distance'])
+    )
+    logger.info(f"Compressed {X_train.shape[0]:,} training rows to {X.shape[0]:,} "
+                f"({X_train.shape[0] / X.shape[0]:.1f}x)")
+    # Derived from the source key and the resolution, so the training cache key needs no hashing
+    fingerprint = FeatureCache.key(
+        [features.fingerprint], compression="rows", distance_resolution=distance_resolution
+    )
+    return replace(features, X=X, y=y, weight=weight, fingerprint=fingerprint, num_samples=X.shape[0], cached=False)
+
 
-    return X, dv
+def run_rmse(run_id: str) -> Optional[float]:
+    """Validation RMSE logged by a finished training run (None if it was not uploaded)."""
+    client, _ = tracker.connect()
+    return client.get_run(run_id).data.metrics.get("rmse")
 
 
-@task(name="train_model", description="Train XGBoost model with MLflow tracking")
-def train_model(X_train, y_train, X_val, y_val, dv: DictVectorizer) -> str:
+@task(name="train_model", description="Train XGBoost model with MLflow tracking", **cached_task_options())
+def train_model(
+    train: Features,
+    val: Features,
+    params: Optional[dict] = None,
+    dmatrix_cache: bool = False,
+    parent_run_id: Optional[str] = None,
+    incremental_rounds: int = DEFAULT_INCREMENTAL_ROUNDS,
+    distance_resolution: Optional[float] = None
+) -> str:
     """
     Train XGBoost model and log to MLflow.
 
     Args:
-        X_train: Training features
-        y_train: Training targets
-        X_val: Validation features
-        y_val: Validation targets
-        dv: Fitted DictVectorizer
+        train: Training features (with row weights if compressed, see compress_training_rows)
+        val: Validation features
+        params: XGBoost parameters (default: BEST_PARAMS)
+        dmatrix_cache: Save the built DMatrix in XGBoost's binary format under
+            models/dmatrix and reload it on later runs with the same data
+        parent_run_id: Continue the booster of this MLflow run instead of
+            training from scratch (incremental mode)
+        incremental_rounds: Boosting rounds added in incremental mode
+        distance_resolution: Distance rounding used by the compression (logged only)
 
     Returns:
         MLflow run ID
     """
     logger = get_run_logger()
+    X_train, y_train = train.matrices()
+    X_val, y_val = val.matrices()
+    dv, weight = train.dv, train.weight
     
     # Ensure models directory exists
     models_folder = Path('models')
@@ -170,55 +492,75 @@ def train_model(X_train, y_train, X_val, y_val, dv: DictVectorizer) -> str:
     
     logger.info(f"Training with {X_train.shape[0]} samples, {X_train.shape[1]} features")
 
-    with mlflow.start_run() as run:
-        train = xgb.DMatrix(X_train, label=y_train)
-        valid = xgb.DMatrix(X_val, label=y_val)
+    with tracker.start_run() as run:
+        best_params = {**BEST_PARAMS, **(params or {})}
 
-        best_params = {
-            'learning_rate': 0.09585355369315604,
-            'max_depth': 30,
-            'min_child_weight': 1.060597050922164,
-            'objective': 'reg:squarederror',  # Updated from deprecated 'reg:linear'
-            'reg_alpha': 0.018060244040060163,
-            'reg_lambda': 0.011658731377413597,
-            'seed': 42
-        }
+        # QuantileDMatrix for hist, or binary DMatrix files keyed by the data fingerprint
+        train, valid = build_dmatrices(
+            X_train, y_train, X_val, y_val, best_params,
+            cache_dir=models_folder / "dmatrix" if dmatrix_cache else None,
+            fingerprints=(train.fingerprint, val.fingerprint),
+            warm_start=parent_run_id is not None,
+            weight=weight
+        )
 
-        mlflow.log_params(best_params)
+        run.log_params(best_params)
+        run.log_param("row_compression", weight is not None)
+        if weight is not None:
+            run.log_params({"distance_resolution": distance_resolution, "train_rows": X_train.shape[0]})
+        feature_mode = vectorizer_mode(dv)
+        run.log_param("feature_mode", feature_mode)
+        if feature_mode == "hashing":
+            run.log_param("n_features", dv.n_features)
+        elif feature_mode == "route_stats":
+            run.log_param("route_stats_smoothing", dv.smoothing)
+        else:
+            run.log_param("num_features", len(dv.feature_names_))
+
+        # Incremental mode: only new rounds are trained on top of the parent booster
+        parent_booster = None
+        num_boost_round = 30
+        if parent_run_id is not None:
+            parent_booster = load_booster(parent_run_id)
+            num_boost_round = incremental_rounds
+            log_lineage(parent_run_id, run)
+            logger.info(f"Adding {num_boost_round} rounds to the model of run {parent_run_id}")
+        run.log_param("num_boost_round", num_boost_round)
 
         booster = xgb.train(
             params=best_params,
             dtrain=train,
-            num_boost_round=30,
+            num_boost_round=num_boost_round,
             evals=[(valid, 'validation')],
-            early_stopping_rounds=50
+            early_stopping_rounds=50,
+            xgb_model=parent_booster
         )
 
         y_pred = booster.predict(valid)
         rmse = root_mean_squared_error(y_val, y_pred)
-        mlflow.log_metric("rmse", rmse)
+        run.log_metric("rmse", rmse)
 
         # Save preprocessor
         preprocessor_path = "models/preprocessor.b"
         with open(preprocessor_path, "wb") as f_out:
             pickle.dump(dv, f_out)
         
-        try:
-            mlflow.log_artifact(preprocessor_path, artifact_path="preprocessor")
-            # Log model
-            mlflow.xgboost.log_model(booster, artifact_path="models_mlflow")
-            logger.info("Successfully logged model and preprocessor to MLflow")
-        except Exception as e:
-            logger.warning(f"Failed to log to MLflow: {e}")
-            logger.info("Model artifacts saved locally in models/ directory")
+        # Queued: uploaded by the tracker's background worker when the run closes
+        run.log_artifact(preprocessor_path, artifact_path="preprocessor")
+        if feature_mode == "route_stats":
+            # The index as plain arrays too, readable without pickle
+            index_path = f"models/{INDEX_FILENAME}"
+            dv.save(index_path)
+            run.log_artifact(index_path, artifact_path="preprocessor")
+        run.log_model(mlflow.xgboost, booster, "models_mlflow")
 
         # Create Prefect artifact with model performance
         performance_data = [
             ["RMSE", f"{rmse:.4f}"],
             ["Learning Rate", best_params['learning_rate']],
             ["Max Depth", best_params['max_depth']],
-            ["Num Boost Rounds", 30],
-            ["MLflow Run ID", run.info.run_id]
+            ["Num Boost Rounds", booster.num_boosted_rounds()],
+            ["MLflow Run ID", run.run_id]
         ]
 
         create_table_artifact(
@@ -233,7 +575,7 @@ def train_model(X_train, y_train, X_val, y_val, dv: DictVectorizer) -> str:
 
         ## Performance
         - **RMSE**: {rmse:.4f}
-        - **MLflow Run ID**: {run.info.run_id}
+        - **MLflow Run ID**: {run.run_id}
 
         ## Parameters
         - Learning Rate: {best_params['learning_rate']}
@@ -243,7 +585,8 @@ def train_model(X_train, y_train, X_val, y_val, dv: DictVectorizer) -> str:
         - Regularization Lambda: {best_params['reg_lambda']}
 
         ## Training Details
-        - Boost Rounds: 30
+        - Boost Rounds: {booster.num_boosted_rounds()}
+        - Parent Run: {parent_run_id or "-"}
         - Early Stopping: 50 rounds
         - Objective: {best_params['objective']}
         """
@@ -254,42 +597,133 @@ def train_model(X_train, y_train, X_val, y_val, dv: DictVectorizer) -> str:
             description="Detailed training summary"
         )
 
-        return run.info.run_id
+    # The run ID is cached with this task, so it is only returned once the
+    # model and preprocessor are in MLflow; a failed upload fails the task
+    return run.wait()
 
 
 @flow(name="NYC Taxi Duration Prediction Pipeline", description="End-to-end ML pipeline for taxi duration prediction")
-def duration_prediction_flow(year: int, month: int) -> str:
+def duration_prediction_flow(
+    year: int,
+    month: int,
+    offline: bool = False,
+    feature_mode: str = "dictvectorizer",
+    n_features: int = DEFAULT_N_FEATURES,
+    min_route_frequency: int = 1,
+    route_stats_smoothing: float = DEFAULT_SMOOTHING,
+    feature_cache: bool = True,
+    dmatrix_cache: bool = False,
+    incremental: bool = False,
+    parent_run_id: Optional[str] = None,
+    incremental_rounds: int = DEFAULT_INCREMENTAL_ROUNDS,
+    row_compression: bool = False,
+    distance_resolution: Optional[float] = None,
+    compression_baseline: bool = True,
+    memory_budget_mb: Optional[int] = None
+) -> str:
     """
     Main flow for NYC taxi duration prediction.
 
     Args:
         year: Year of training data
         month: Month of training data
+        offline: Only use the local data cache, never download
+        feature_mode: 'dictvectorizer', 'hashing' or 'route_stats'
+        n_features: Number of hashed columns (hashing mode only)
+        min_route_frequency: Trips a route needs for its own column; rarer
+            routes share a per-pickup-zone bucket (dictvectorizer mode only)
+        route_stats_smoothing: Trips of weight of the zone level when
+            smoothing route statistics (route_stats mode only)
+        feature_cache: Reuse feature matrices from the local feature cache
+        dmatrix_cache: Reuse binary DMatrix files from models/dmatrix
+        incremental: Add rounds to a previous run's model, reusing its preprocessor
+        parent_run_id: Run to continue (default: latest run of the experiment)
+        incremental_rounds: Boosting rounds added in incremental mode
+        row_compression: Train on unique feature rows weighted by their count
+        distance_resolution: Round trip_distance to this step before compressing
+        compression_baseline: Also train on the uncompressed rows and report
+            the RMSE change in the row-compression artifact
+        memory_budget_mb: Stream each month in chunks of about this size
+            instead of loading it as one DataFrame
 
     Returns:
         MLflow run ID
     """
+    if feature_mode == "hashing":
+        warning = hashing_memory_warning(n_features, BEST_PARAMS['max_depth'])
+        if warning:
+            get_run_logger().warning(f"⚠️ {warning}")
+
     # Load training data
-    df_train = read_dataframe(year=year, month=month)
+    train_data = read_dataframe(year=year, month=month, offline=offline, memory_budget_mb=memory_budget_mb)
 
     # Calculate validation data period
-    next_year = year if month < 12 else year + 1
-    next_month = month + 1 if month < 12 else 1
+    next_year, next_month = add_months(year, month, 1)
 
     # Load validation data
-    df_val = read_dataframe(year=next_year, month=next_month)
+    val_data = read_dataframe(year=next_year, month=next_month, offline=offline, memory_budget_mb=memory_budget_mb)
 
     # Create features
-    X_train, dv = create_features(df_train)
-    X_val, _ = create_features(df_val, dv)
-
-    # Prepare targets
-    target = 'duration'
-    y_train = df_train[target].values
-    y_val = df_val[target].values
+    train = None
+    if incremental or parent_run_id is not None:
+        # The parent's vectorizer keeps the feature space the booster was trained on
+        tracker.connect()
+        parent_run_id = parent_run_id or latest_model_run(EXPERIMENT_NAME)
+        dv = load_preprocessor(parent_run_id)
+        logger.info(f"Incremental training from run {parent_run_id}")
+    elif feature_mode == "route_stats":
+        # Dense route statistics: out-of-fold lookups for training, the full index for validation
+        train = create_route_stats_features(train_data, route_stats_smoothing, use_cache=feature_cache)
+        dv = train.dv
+    else:
+        dv = initial_vectorizer(feature_mode, n_features)
+
+    if train is not None:
+        # Route stats: only validation is left, looked up in the full index
+        val = create_features(val_data, dv, use_cache=feature_cache)
+    elif dv is not None:
+        # Hashing or a parent vocabulary needs no fit, so train and validation are vectorized concurrently
+        train_future = create_features.submit(train_data, dv, use_cache=feature_cache)
+        val_future = create_features.submit(val_data, dv, use_cache=feature_cache)
+        train = train_future.result()
+        val = val_future.result()
+    else:
+        train = create_features(train_data, use_cache=feature_cache, min_route_frequency=min_route_frequency)
+        val = create_features(val_data, train.dv, use_cache=feature_cache)
 
     # Train model
-    run_id = train_model(X_train, y_train, X_val, y_val, dv)
+    train_kwargs = dict(dmatrix_cache=dmatrix_cache, parent_run_id=parent_run_id, incremental_rounds=incremental_rounds)
+    if row_compression:
+        rows = compress_training_rows(train, distance_resolution)
+        run_id = train_model(rows, val, distance_resolution=distance_resolution, **train_kwargs)
+        baseline_run_id = None
+        if compression_baseline:
+            baseline_run_id = train_model(train, val, **train_kwargs)
+    else:
+        run_id = train_model(train, val, **train_kwargs)
+    # Each training task already waited for its own run; anything else still queued must not fail silently
+    upload_errors = tracker.wait_for_uploads()
+    if upload_errors:
+        raise RuntimeError(f"{len(upload_errors)} MLflow uploads failed") from upload_errors[0]
+
+    if row_compression:
+        rmse = run_rmse(run_id)
+        baseline_rmse = run_rmse(baseline_run_id) if baseline_run_id else None
+        compression_table = [
+            ["Training Rows", f"{train.num_samples:,}"],
+            ["Compressed Rows", f"{rows.num_samples:,}"],
+            ["Compression Ratio", f"{train.num_samples / rows.num_samples:.1f}x"],
+            ["Distance Resolution", distance_resolution if distance_resolution is not None else "exact"],
+            ["RMSE (compressed)", f"{rmse:.4f}" if rmse is not None else "-"],
+            ["RMSE (uncompressed)", f"{baseline_rmse:.4f}" if baseline_rmse is not None else "-"],
+            ["RMSE Change", f"{rmse - baseline_rmse:+.4f}" if None not in (rmse, baseline_rmse) else "-"],
+            ["Baseline Run ID", baseline_run_id or "-"]
+        ]
+        create_table_artifact(
+            key="row-compression",
+            table=compression_table,
+            description="Training set size and RMSE with and without row compression"
+        )
 
     # Create final pipeline artifact
     pipeline_summary = f"""
@@ -298,12 +732,13 @@ def duration_prediction_flow(year: int, month: int) -> str:
     ## Data
     - **Training Period**: {year}-{month:02d}
     - **Validation Period**: {next_year}-{next_month:02d}
-    - **Training Samples**: {len(y_train):,}
-    - **Validation Samples**: {len(y_val):,}
+    - **Training Samples**: {train.num_samples:,}
+    - **Validation Samples**: {val.num_samples:,}
 
     ## Results
     - **MLflow Run ID**: {run_id}
-    - **MLflow Experiment**: nyc-taxi-experiment-prefect
+    - **MLflow Experiment**: {EXPERIMENT_NAME}
+    - **Parent Run**: {parent_run_id or "-"}
 
     ## Next Steps
     1. Review model performance in MLflow UI: http://localhost:5000
@@ -327,6 +762,35 @@ if __name__ == "__main__":
     parser.add_argument('--year', type=int, default=2023, help='Year of the data to train on (default: 2023)')
     parser.add_argument('--month', type=int, default=1, help='Month of the data to train on (default: 1)')
     parser.add_argument('--mlflow-uri', type=str, help='MLflow tracking URI (overrides environment variable)')
+    parser.add_argument('--offline', action='store_true', help='Only use the local data cache, never download')
+    parser.add_argument('--feature-mode', choices=['dictvectorizer', 'hashing', 'route_stats'], default='dictvectorizer',
+                        help='Feature vectorizer: fitted DictVectorizer, stateless hashing or dense route statistics '
+                             '(default: dictvectorizer)')
+    parser.add_argument('--n-features', type=int, default=DEFAULT_N_FEATURES,
+                        help=f'Number of hashed columns in hashing mode (default: {DEFAULT_N_FEATURES}); '
+                             'XGBoost memory grows with columns times tree depth, so keep it at 2^16 or less '
+                             'with the default max_depth of 30')
+    parser.add_argument('--min-route-frequency', type=int, default=1,
+                        help='Trips a route needs for its own column; rarer routes share a pickup-zone bucket (default: 1)')
+    parser.add_argument('--route-stats-smoothing', type=float, default=DEFAULT_SMOOTHING,
+                        help=f'Trips of weight of the zone level in route_stats mode (default: {DEFAULT_SMOOTHING:g})')
+    parser.add_argument('--no-feature-cache', action='store_true', help='Always recompute feature matrices')
+    parser.add_argument('--dmatrix-cache', action='store_true',
+                        help='Save/reload the XGBoost DMatrix in binary format under models/dmatrix')
+    parser.add_argument('--incremental', action='store_true',
+                        help="Add boosting rounds to the last run's model instead of training from scratch")
+    parser.add_argument('--parent-run-id', type=str,
+                        help='MLflow run to continue in incremental mode (default: latest run of the experiment)')
+    parser.add_argument('--incremental-rounds', type=int, default=DEFAULT_INCREMENTAL_ROUNDS,
+                        help=f'Boosting rounds added in incremental mode (default: {DEFAULT_INCREMENTAL_ROUNDS})')
+    parser.add_argument('--compress-rows', action='store_true',
+                        help='Train on unique feature rows weighted by how many trips share them')
+    parser.add_argument('--distance-resolution', type=float,
+                        help='Round trip_distance to this step (miles) before compressing (default: exact)')
+    parser.add_argument('--no-compression-baseline', action='store_true',
+                        help='Skip the uncompressed reference model used to report the RMSE change')
+    parser.add_argument('--memory-budget-mb', type=int,
+                        help='Stream each month in chunks of about this many MB instead of loading it whole')
     args = parser.parse_args()
 
     # Override MLflow URI if provided
@@ -336,7 +800,24 @@ if __name__ == "__main__":
 
     try:
         # Run the flow
-        run_id = duration_prediction_flow(year=args.year, month=args.month)
+        run_id = duration_prediction_flow(
+            year=args.year,
+            month=args.month,
+            offline=args.offline,
+            feature_mode=args.feature_mode,
+            n_features=args.n_features,
+            min_route_frequency=args.min_route_frequency,
+            route_stats_smoothing=args.route_stats_smoothing,
+            feature_cache=not args.no_feature_cache,
+            dmatrix_cache=args.dmatrix_cache,
+            incremental=args.incremental,
+            parent_run_id=args.parent_run_id,
+            incremental_rounds=args.incremental_rounds,
+            row_compression=args.compress_rows,
+            distance_resolution=args.distance_resolution,
+            compression_baseline=not args.no_compression_baseline,
+            memory_budget_mb=args.memory_budget_mb
+        )
         print("\n✅ Pipeline completed successfully!")
         print(f"📊 MLflow run_id: {run_id}")
         print(f"🔗 View results at: {mlflow.get_tracking_uri()}")
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+XGBoost hyperparameter search for the NYC taxi duration model.
+
+Reuses the load and feature tasks of duration_prediction_prefect.py, tunes the
+booster with Optuna and trains the final model with the best parameters.
+"""
+
+import math
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Optional
+
+import optuna
+import xgboost as xgb
+from optuna.study import MaxTrialsCallback
+from optuna.trial import TrialState
+from prefect import task, flow, get_run_logger
+from prefect.artifacts import create_table_artifact
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from taxi_common.periods import add_months
+from taxi_common.xgb_data import build_dmatrices
+
+from duration_prediction_prefect import (
+    BEST_PARAMS,
+    create_features,
+    logger,
+    read_dataframe,
+    setup_mlflow,
+    tracker,
+    train_model,
+)
+
+
+class OptunaPruningCallback(xgb.callback.TrainingCallback):
+    """Reports the per-round validation RMSE to Optuna and stops pruned trials."""
+
+    def __init__(self, trial: optuna.Trial, data_name: str = 'validation', metric_name: str = 'rmse'):
+        self.trial = trial
+        self.data_name = data_name
+        self.metric_name = metric_name
+
+    def after_iteration(self, model, epoch, evals_log):
+        score = evals_log[self.data_name][self.metric_name][-1]
+        self.trial.report(score, step=epoch)
+        if self.trial.should_prune():
+            raise optuna.TrialPruned(f"Trial pruned at boosting round {epoch}")
+        return False
+
+
+def suggest_params(trial: optuna.Trial) -> dict:
+    """Search space from the course notebook (hyperopt version), in Optuna terms."""
+    return {
+        'max_depth': trial.suggest_int('max_depth', 4, 100),
+        'learning_rate': trial.suggest_float('learning_rate', math.exp(-3), 1.0, log=True),
+        'reg_alpha': trial.suggest_float('reg_alpha', math.exp(-5), math.exp(-1), log=True),
+        'reg_lambda': trial.suggest_float('reg_lambda', math.exp(-6), math.exp(-1), log=True),
+        'min_child_weight': trial.suggest_float('min_child_weight', math.exp(-1), math.exp(3), log=True),
+        'objective': 'reg:squarederror',
+        'seed': 42
+    }
+
+
+@task(name="tune_xgboost", description="Search XGBoost hyperparameters with Optuna")
+def tune_xgboost(
+    X_train,
+    y_train,
+    X_val,
+    y_val,
+    n_trials: int = 20,
+    num_boost_round: int = 100,
+    early_stopping_rounds: int = 10,
+    storage: Optional[str] = None,
+    study_name: Optional[str] = None
+) -> dict:
+    """
+    Tune the XGBoost booster, pruning trials on the per-round validation RMSE.
+
+    Args:
+        X_train: Training features
+        y_train: Training targets
+        X_val: Validation features
+        y_val: Validation targets
+        n_trials: Number of Optuna trials
+        num_boost_round: Maximum boosting rounds per trial
+        early_stopping_rounds: Early stopping patience per trial
+        storage: Optional Optuna storage URL (in-memory study if None)
+        study_name: Study to create or resume in `storage`; it must identify
+            the training data, or another month's trials would be resumed
+
+    Returns:
+        Dict with the best params, RMSE and boosting rounds
+    """
+    logger = get_run_logger()
+
+    # Built once and shared by every trial: the quantile sketch is computed a
+    # single time and the trials only read the binned matrix
+    train, valid = build_dmatrices(X_train, y_train, X_val, y_val, params={})
+    logger.info(f"Tuning on {train.num_row()} rows, {train.num_col()} features")
+
+    def objective(trial: optuna.Trial) -> float:
+        params = suggest_params(trial)
+        with tracker.start_run(run_name=f"trial-{trial.number}", parent=hpo_run) as run:
+            run.log_params(params)
+            run.set_tag("model", "xgboost")
+            start = time.perf_counter()
+            try:
+                booster = xgb.train(
+                    params=params,
+                    dtrain=train,
+                    num_boost_round=num_boost_round,
+                    evals=[(valid, 'validation')],
+                    early_stopping_rounds=early_stopping_rounds,
+                    callbacks=[OptunaPruningCallback(trial)],
+                    verbose_eval=False
+                )
+            except optuna.TrialPruned:
+                run.set_tag("pruned", True)
+                raise
+            finally:
+                # Wall time of every trial, pruned or not, to weigh cost against RMSE
+                train_seconds = time.perf_counter() - start
+                trial.set_user_attr('train_seconds', train_seconds)
+                run.log_metric("train_seconds", train_seconds)
+
+            rmse = booster.best_score
+            trial.set_user_attr('best_iteration', booster.best_iteration)
+            run.log_metrics({"rmse": rmse, "best_iteration": booster.best_iteration})
+        return rmse
+
+    study = optuna.create_study(
+        direction="minimize",
+        sampler=optuna.samplers.TPESampler(seed=42),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=5),
+        storage=storage,
+        study_name=study_name,
+        load_if_exists=storage is not None
+    )
+
+    finished = (TrialState.COMPLETE, TrialState.PRUNED)
+    done = len(study.get_trials(deepcopy=False, states=finished))
+    if done:
+        logger.info(f"Resuming study '{study_name}': {done}/{n_trials} trials already finished")
+
+    # Trial runs are buffered and closed in the background, so MLflow adds no
+    # round trips between trials
+    with tracker.start_run(run_name="xgboost-hpo") as hpo_run:
+        hpo_run.log_params({'n_trials': n_trials, 'num_boost_round': num_boost_round, 'study_name': study_name})
+        study.optimize(
+            objective,
+            n_trials=max(0, n_trials - done),
+            callbacks=[MaxTrialsCallback(n_trials, states=finished)]
+        )
+
+        trials = study.get_trials(deepcopy=False)
+        pruned = [t for t in trials if t.state == TrialState.PRUNED]
+        total_seconds = sum(t.user_attrs.get('train_seconds', 0.0) for t in trials)
+        hpo_run.log_metrics({
+            "best_rmse": study.best_value,
+            "pruned_trials": len(pruned),
+            "total_train_seconds": total_seconds
+        })
+
+    best = study.best_trial
+    logger.info(f"Best RMSE {best.value:.4f} after {len(trials)} trials ({len(pruned)} pruned)")
+
+    trial_table = [["Trial", "State", "RMSE", "Train Seconds", "Max Depth", "Learning Rate"]]
+    for t in trials:
+        trial_table.append([
+            t.number,
+            t.state.name,
+            f"{t.value:.4f}" if t.value is not None else "-",
+            f"{t.user_attrs.get('train_seconds', 0.0):.2f}",
+            t.params.get('max_depth'),
+            f"{t.params.get('learning_rate', 0.0):.4f}"
+        ])
+    create_table_artifact(
+        key="xgboost-hpo-trials",
+        table=trial_table,
+        description=f"Optuna trials - best RMSE: {best.value:.4f}"
+    )
+
+    return {
+        'params': {**BEST_PARAMS, **best.params},
+        'rmse': best.value,
+        'best_iteration': best.user_attrs.get('best_iteration'),
+        'train_seconds': best.user_attrs.get('train_seconds')
+    }
+
+
+@flow(name="NYC Taxi XGBoost HPO", description="Tune XGBoost hyperparameters and train the final model")
+def xgboost_hpo_flow(
+    year: int,
+    month: int,
+    n_trials: int = 20,
+    num_boost_round: int = 100,
+    offline: bool = False,
+    storage: Optional[str] = None,
+    study_name: Optional[str] = None
+) -> str:
+    """
+    Tune XGBoost on a month of data (validated on the next month) and train
+    the final model with the best parameters.
+
+    Args:
+        year: Year of training data
+        month: Month of training data
+        n_trials: Number of Optuna trials
+        num_boost_round: Maximum boosting rounds per trial
+        offline: Only use the local data cache, never download
+        storage: Optional Optuna storage URL to persist the study
+        study_name: Study in `storage` (default: derived from the training
+            month and the feature matrix, so a rerun only resumes its own study)
+
+    Returns:
+        MLflow run ID of the final model
+    """
+    train_data = read_dataframe(year=year, month=month, offline=offline)
+    next_year, next_month = add_months(year, month, 1)
+    val_data = read_dataframe(year=next_year, month=next_month, offline=offline)
+
+    train = create_features(train_data)
+    val = create_features(val_data, train.dv)
+
+    # The feature-cache key covers the month's checksum, the vectorizer and the feature config
+    study_name = study_name or f"xgboost-hpo-{year}-{month:02d}-{train.fingerprint[:12]}"
+
+    best = tune_xgboost(
+        *train.matrices(), *val.matrices(),
+        n_trials=n_trials,
+        num_boost_round=num_boost_round,
+        storage=storage,
+        study_name=study_name
+    )
+    run_id = train_model(train, val, params=best['params'])
+    upload_errors = tracker.wait_for_uploads()
+    if upload_errors:
+        raise RuntimeError(f"{len(upload_errors)} MLflow uploads failed") from upload_errors[0]
+    return run_id
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Tune the taxi trip duration XGBoost model with Optuna.')
+    parser.add_argument('--year', type=int, default=2023, help='Year of the data to train on (default: 2023)')
+    parser.add_argument('--month', type=int, default=1, help='Month of the data to train on (default: 1)')
+    parser.add_argument('--n-trials', type=int, default=20, help='Number of Optuna trials (default: 20)')
+    parser.add_argument('--num-boost-round', type=int, default=100, help='Maximum boosting rounds per trial (default: 100)')
+    parser.add_argument('--storage', type=str, help='Optuna storage URL, e.g. sqlite:///optuna.db (default: in memory)')
+    parser.add_argument('--study-name', type=str,
+                        help='Optuna study to create or resume in --storage '
+                             '(default: derived from the training month and features)')
+    parser.add_argument('--mlflow-uri', type=str, help='MLflow tracking URI (overrides environment variable)')
+    parser.add_argument('--offline', action='store_true', help='Only use the local data cache, never download')
+    args = parser.parse_args()
+
+    if args.mlflow_uri:
+        os.environ["MLFLOW_TRACKING_URI"] = args.mlflow_uri
+        setup_mlflow()
+
+    try:
+        run_id = xgboost_hpo_flow(
+            year=args.year,
+            month=args.month,
+            n_trials=args.n_trials,
+            num_boost_round=args.num_boost_round,
+            offline=args.offline,
+            storage=args.storage,
+            study_name=args.study_name
+        )
+        print("\n✅ HPO completed successfully!")
+        print(f"📊 MLflow run_id of the tuned model: {run_id}")
+    except Exception as e:
+        logger.error(f"HPO failed: {e}")
+        raise
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Check that float32 feature matrices do not change model accuracy.
+
+Builds the train/validation matrices of two green-taxi months twice: with the
+float32 columnar path the pipelines use (taxi_common.vectorizers) and with a
+plain float64 DictVectorizer over per-row dicts, the way they were built
+before. Both are fed to the same LinearRegression and XGBoost models and the
+validation RMSEs are compared.
+
+Usage:
+    python 04-orchestration/check_float32_accuracy.py [--train 2023-01] [--val 2023-02]
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.linear_model import LinearRegression
+from sklearn.metrics import root_mean_squared_error
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from taxi_common.data_store import DatasetStore
+from taxi_common.features import feature_frame, prepare_trips
+from taxi_common.vectorizers import FEATURE_DTYPE, fit_columnar, transform_frame
+
+DATA_URL_PATTERN = 'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
+FEATURES = ['PU_DO', 'trip_distance']
+
+# float32 keeps ~7 significant digits; anything beyond this is a real regression
+RMSE_TOLERANCE = 1e-3
+
+XGB_PARAMS = {
+    'learning_rate': 0.1,
+    'max_depth': 6,
+    'objective': 'reg:squarederror',
+    'seed': 42,
+}
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_month(store, period):
+    """Prepared trips of a 'YYYY-MM' period from the local dataset store."""
+    year, month = (int(part) for part in period.split('-'))
+    return prepare_trips(pd.read_parquet(store.fetch(year, month, DATA_URL_PATTERN)))
+
+
+def build_matrices(df_train, df_val):
+    """Train/validation matrices in float32 (current path) and float64 (reference)."""
+    dv32 = fit_columnar([df_train], FEATURES)
+    X32 = [transform_frame(df, dv32, FEATURES) for df in (df_train, df_val)]
+
+    dv64 = DictVectorizer()
+    X64 = [dv64.fit_transform(feature_frame(df_train, FEATURES).to_dict(orient='records'))]
+    X64.append(dv64.transform(feature_frame(df_val, FEATURES).to_dict(orient='records')))
+
+    assert list(dv32.feature_names_) == list(dv64.feature_names_), "Vocabularies differ"
+    assert X32[0].dtype == FEATURE_DTYPE and X64[0].dtype == np.float64
+    for a, b in zip(X32, X64):
+        assert a.shape == b.shape, f"Shapes differ: {a.shape} vs {b.shape}"
+        assert abs(a - b.astype(FEATURE_DTYPE)).max() == 0, "float32 matrix differs from the rounded float64 one"
+    return X32, X64
+
+
+def compare_rmse(name, fit_predict, X32, X64, y_train, y_val):
+    """Fit the same model on both matrices and compare validation RMSE."""
+    rmse32 = root_mean_squared_error(y_val, fit_predict(X32[0], y_train, X32[1]))
+    rmse64 = root_mean_squared_error(y_val, fit_predict(X64[0], y_train, X64[1]))
+    diff = abs(rmse32 - rmse64)
+    logger.info(f"📈 {name}: RMSE float32={rmse32:.6f} float64={rmse64:.6f} (diff {diff:.2e})")
+    assert diff < RMSE_TOLERANCE, f"{name}: float32 changes validation RMSE by {diff:.2e}"
+    return rmse32, rmse64
+
+
+def fit_predict_linear(X_train, y_train, X_val):
+    return LinearRegression().fit(X_train, y_train).predict(X_val)
+
+
+def fit_predict_xgboost(X_train, y_train, X_val):
+    booster = xgb.train(XGB_PARAMS, xgb.DMatrix(X_train, label=y_train), num_boost_round=50)
+    return booster.predict(xgb.DMatrix(X_val))
+
+
+def run_accuracy_check(train_period='2023-01', val_period='2023-02'):
+    """
+    Run the float32 vs float64 comparison.
+
+    Returns:
+        dict: {model name: (rmse float32, rmse float64)}
+    """
+    store = DatasetStore.from_env()
+    df_train = load_month(store, train_period)
+    df_val = load_month(store, val_period)
+    logger.info(f"🚕 {len(df_train)} train trips ({train_period}), {len(df_val)} validation trips ({val_period})")
+
+    X32, X64 = build_matrices(df_train, df_val)
+    logger.info(f"📊 Train matrix: {X32[0].data.nbytes + X32[0].indices.nbytes + X32[0].indptr.nbytes} bytes "
+                f"in float32 vs {X64[0].data.nbytes + X64[0].indices.nbytes + X64[0].indptr.nbytes} in float64")
+
+    y_train = df_train['duration'].to_numpy()
+    y_val = df_val['duration'].to_numpy()
+    results = {
+        'LinearRegression': compare_rmse('LinearRegression', fit_predict_linear, X32, X64, y_train, y_val),
+        'XGBoost': compare_rmse('XGBoost', fit_predict_xgboost, X32, X64, y_train, y_val),
+    }
+    logger.info("✅ float32 features keep the validation RMSE")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare validation RMSE of float32 vs float64 feature matrices')
+    parser.add_argument('--train', default='2023-01', help='Training period (YYYY-MM)')
+    parser.add_argument('--val', default='2023-02', help='Validation period (YYYY-MM)')
+    args = parser.parse_args()
+    run_accuracy_check(args.train, args.val)
@@ -1,62 +1,87 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import json
+import multiprocessing
+import os
 import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import mlflow
-import pandas as pd
 import xgboost as xgb
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.metrics import root_mean_squared_error
 
-mlflow.set_tracking_uri("http://127.0.0.1:5000")
-mlflow.set_experiment("nyc-taxi-experiment")
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from taxi_common.data_store import DatasetStore
+from taxi_common.features import prepare_trips
+from taxi_common.loader import read_trips
+from taxi_common.periods import add_months, format_period, month_range, training_window
+from taxi_common.streaming import stack_features
+from taxi_common.tracking import Tracker
+from taxi_common.vectorizers import fit_columnar, transform_columnar
+from taxi_common.xgb_data import build_dmatrices
+from taxi_common.warm_start import (
+    DEFAULT_INCREMENTAL_ROUNDS, latest_model_run, load_booster, load_preprocessor, log_lineage
+)
+
+EXPERIMENT_NAME = "nyc-taxi-experiment"
+
+# Connects on the first run, not at import; falls back to sqlite if the server is down
+tracker = Tracker("http://127.0.0.1:5000", EXPERIMENT_NAME)
 
 models_folder = Path('models')
 models_folder.mkdir(exist_ok=True)
 
+DATA_URL_PATTERN = 'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
 
 
-def read_dataframe(year, month):
+def read_dataframe(year, month, store=None):
     """
     #TODO add docstrings all functions
     """
-    url = f'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
-    df = pd.read_parquet(url)
-
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
-
-    df = df[(df.duration >= 1) & (df.duration <= 60)]
+    if store is None:
+        store = DatasetStore.from_env()
 
     categorical = ['PULocationID', 'DOLocationID']
-    df[categorical] = df[categorical].astype(str)
+    numerical = ['trip_distance']
+    df = read_trips(
+        store.fetch(year, month, DATA_URL_PATTERN),
+        categorical=categorical,
+        numerical=numerical,
+        min_duration=1,
+        max_duration=60
+    )
 
-    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
+    df = prepare_trips(df, min_duration=1, max_duration=60, categorical=categorical, numerical=numerical)
 
     return df
 
 
+def read_months(periods, store=None):
+    """Loads several (year, month) periods concurrently, one DataFrame per month."""
+    with ThreadPoolExecutor(max_workers=len(periods)) as executor:
+        return list(executor.map(lambda period: read_dataframe(*period, store=store), periods))
+
+
 def create_X(df, dv=None):
     categorical = ['PU_DO']
     numerical = ['trip_distance']
-    dicts = df[categorical + numerical].to_dict(orient='records')
+    features = categorical + numerical
 
+    # Same vocabulary and matrix as DictVectorizer on dicts, built from the columns
     if dv is None:
-        dv = DictVectorizer(sparse=True)
-        X = dv.fit_transform(dicts)
-    else:
-        X = dv.transform(dicts)
+        dv = fit_columnar([df], features)
+    X = transform_columnar(df, dv, features)
 
     return X, dv
 
 
-def train_model(X_train, y_train, X_val, y_val, dv):
-    with mlflow.start_run() as run:
-        train = xgb.DMatrix(X_train, label=y_train)
-        valid = xgb.DMatrix(X_val, label=y_val)
-
+def train_model(X_train, y_train, X_val, y_val, dv, train_months=1, parent_run_id=None,
+                incremental_rounds=DEFAULT_INCREMENTAL_ROUNDS, nthread=None):
+    with tracker.start_run() as run:
         best_params = {
             'learning_rate': 0.09585355369315604,
             'max_depth': 30,
@@ -66,47 +91,167 @@ def train_model(X_train, y_train, X_val, y_val, dv):
             'reg_lambda': 0.011658731377413597,
             'seed': 42
         }
+        if nthread is not None:
+            best_params['nthread'] = nthread
 
-        mlflow.log_params(best_params)
+        run.log_params(best_params)
+        run.log_param("train_months", train_months)
+
+        # QuantileDMatrix with the default hist tree method (plain DMatrix when warm starting)
+        train, valid = build_dmatrices(
+            X_train, y_train, X_val, y_val, best_params, warm_start=parent_run_id is not None
+        )
+
+        # Incremental mode: only new rounds are trained on top of the parent booster
+        parent_booster = None
+        num_boost_round = 30
+        if parent_run_id is not None:
+            parent_booster = load_booster(parent_run_id)
+            num_boost_round = incremental_rounds
+            log_lineage(parent_run_id, run)
+        run.log_param("num_boost_round", num_boost_round)
 
         booster = xgb.train(
             params=best_params,
             dtrain=train,
-            num_boost_round=30,
+            num_boost_round=num_boost_round,
             evals=[(valid, 'validation')],
-            early_stopping_rounds=50
+            early_stopping_rounds=50,
+            xgb_model=parent_booster
         )
 
         y_pred = booster.predict(valid)
         rmse = root_mean_squared_error(y_val, y_pred)
-        mlflow.log_metric("rmse", rmse)
+        run.log_metric("rmse", rmse)
+
+        # Pickled in a private directory: backfill workers train several months at once
+        with tempfile.TemporaryDirectory(dir=models_folder) as tmp_dir:
+            preprocessor_path = Path(tmp_dir) / "preprocessor.b"
+            with open(preprocessor_path, "wb") as f_out:
+                pickle.dump(dv, f_out)
+            run.log_artifact(preprocessor_path, artifact_path="preprocessor")
+            os.replace(preprocessor_path, models_folder / "preprocessor.b")
+
+        # Uploaded in the background together with the params and metrics
+        run.log_model(mlflow.xgboost, booster, "models_mlflow")
+
+        return run.run_id
+
+
+def run(year, month, store=None, train_months=1, incremental=False, parent_run_id=None,
+        incremental_rounds=DEFAULT_INCREMENTAL_ROUNDS, nthread=None):
+    # Rolling window: the last `train_months` months up to year-month, validated on the next one
+    train_periods = training_window(year, month, train_months)
+    next_year, next_month = add_months(year, month, 1)
+
+    *train_dfs, df_val = read_months(train_periods + [(next_year, next_month)], store=store)
+    print(f"Training on {format_period(train_periods)}, validating on {next_year}-{next_month:02d}")
+
+    dv = None
+    if incremental or parent_run_id is not None:
+        # Keep the parent's feature space so its booster can keep growing
+        tracker.connect()
+        parent_run_id = parent_run_id or latest_model_run(EXPERIMENT_NAME)
+        dv = load_preprocessor(parent_run_id)
+        print(f"Incremental training from run {parent_run_id}")
+
+    # One vocabulary for the whole window; only the per-month CSR matrices are stacked
+    X_train, y_train, dv = stack_features(train_dfs, ['PU_DO', 'trip_distance'], dv=dv)
+    del train_dfs
+    X_val, _ = create_X(df_val, dv)
 
-        with open("models/preprocessor.b", "wb") as f_out:
-            pickle.dump(dv, f_out)
-        mlflow.log_artifact("models/preprocessor.b", artifact_path="preprocessor")
+    target = 'duration'
+    y_val = df_val[target].values
 
-        mlflow.xgboost.log_model(booster, artifact_path="models_mlflow")
+    run_id = train_model(
+        X_train, y_train, X_val, y_val, dv,
+        train_months=train_months,
+        parent_run_id=parent_run_id,
+        incremental_rounds=incremental_rounds,
+        nthread=nthread
+    )
+    print(f"MLflow run_id: {run_id}")
+    tracker.wait_for_uploads()
+    return run_id
 
-        return run.info.run_id
 
+def prefetch(periods, store):
+    """Downloads every distinct month once into the shared cache, before any worker reads it."""
+    with ThreadPoolExecutor(max_workers=min(len(periods), 8)) as executor:
+        list(executor.map(lambda period: store.fetch(*period, DATA_URL_PATTERN), periods))
 
-def run(year, month):
-    df_train = read_dataframe(year=year, month=month)
 
-    next_year = year if month < 12 else year + 1
-    next_month = month + 1 if month < 12 else 1
-    df_val = read_dataframe(year=next_year, month=next_month)
+def write_manifest(path, manifest):
+    """Writes the month -> run_id manifest atomically, so a crash never leaves it half written."""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w") as f_out:
+        json.dump(dict(sorted(manifest.items())), f_out, indent=2)
+    os.replace(tmp_name, path)
 
-    X_train, dv = create_X(df_train)
-    X_val, _ = create_X(df_val, dv)
 
-    target = 'duration'
-    y_train = df_train[target].values
-    y_val = df_val[target].values
+def _init_worker(tracking_uri):
+    # Every worker logs where the parent resolved the tracking URI (no probe per process)
+    tracker.configure(tracking_uri)
 
-    run_id = train_model(X_train, y_train, X_val, y_val, dv)
-    print(f"MLflow run_id: {run_id}")
-    return run_id
+
+def backfill(start, end, store=None, train_months=1, workers=None, manifest_path="backfill_manifest.json"):
+    """
+    Trains one model per month from start to end (inclusive) in a process pool.
+
+    The months overlap (the validation month of one run is the training month
+    of the next), so all of them are fetched once into the shared data cache
+    first; the workers then only read local files. The manifest is rewritten as
+    each month finishes, and a failed month does not stop the others.
+
+    Returns:
+        Tuple (manifest, failed): {"YYYY-MM": run_id} and the labels of failed months
+    """
+    if store is None:
+        store = DatasetStore.from_env()
+    months = month_range(start, end)
+    needed = sorted({
+        period
+        for year, month in months
+        for period in training_window(year, month, train_months) + [add_months(year, month, 1)]
+    })
+    print(f"Backfilling {format_period(months)}: fetching {len(needed)} months")
+    prefetch(needed, store)
+
+    # Create the experiment before the workers race to do it, and resolve the server fallback once
+    tracker.connect()
+    tracking_uri = mlflow.get_tracking_uri()
+
+    cpus = os.cpu_count() or 1
+    workers = min(workers or cpus, len(months))
+    # Split the cores so concurrent boosters do not oversubscribe the machine
+    nthread = max(1, cpus // workers)
+
+    manifest, failed = {}, []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        # spawn: workers must not inherit the parent's MLflow connections and threads
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(tracking_uri,)
+    ) as executor:
+        futures = {
+            executor.submit(run, year, month, store=store, train_months=train_months, nthread=nthread):
+                format_period([(year, month)])
+            for year, month in months
+        }
+        for future in as_completed(futures):
+            label = futures[future]
+            try:
+                manifest[label] = future.result()
+            except Exception as e:
+                failed.append(label)
+                print(f"Backfill of {label} failed: {e}")
+                continue
+            write_manifest(manifest_path, manifest)
+            print(f"{label} done ({len(manifest)}/{len(months)})")
+
+    return manifest, sorted(failed)
 
 
 if __name__ == "__main__":
@@ -115,9 +260,52 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Train a model to predict taxi trip duration.')
     parser.add_argument('--year', type=int, required=True, help='Year of the data to train on')
     parser.add_argument('--month', type=int, required=True, help='Month of the data to train on')
+    parser.add_argument('--train-months', type=int, default=1, help='Number of months up to --year/--month to train on (default: 1)')
+    parser.add_argument('--cache-dir', type=str, help='Local data cache directory (default: $TAXI_DATA_CACHE_DIR or ~/.cache/nyc-taxi)')
+    parser.add_argument('--offline', action='store_true', help='Only use cached data; fail instead of downloading')
+    parser.add_argument('--incremental', action='store_true',
+                        help="Add boosting rounds to the last run's model instead of training from scratch")
+    parser.add_argument('--parent-run-id', type=str,
+                        help='MLflow run to continue in incremental mode (default: latest run of the experiment)')
+    parser.add_argument('--incremental-rounds', type=int, default=DEFAULT_INCREMENTAL_ROUNDS,
+                        help=f'Boosting rounds added in incremental mode (default: {DEFAULT_INCREMENTAL_ROUNDS})')
+    parser.add_argument('--end-year', type=int,
+                        help='Backfill: train every month from --year/--month through --end-year/--end-month')
+    parser.add_argument('--end-month', type=int, help='Last month of the backfill (with --end-year)')
+    parser.add_argument('--workers', type=int,
+                        help='Backfill: months trained at the same time (default: one per CPU)')
+    parser.add_argument('--manifest', type=str, default='backfill_manifest.json',
+                        help='Backfill: JSON file mapping each month to its run_id (default: backfill_manifest.json)')
     args = parser.parse_args()
 
-    run_id = run(year=args.year, month=args.month)
+    store = DatasetStore.from_env(cache_dir=args.cache_dir, offline=args.offline or None)
+
+    if args.end_year is not None or args.end_month is not None:
+        if args.end_year is None or args.end_month is None:
+            parser.error('--end-year and --end-month go together')
+        if args.incremental or args.parent_run_id:
+            parser.error('incremental runs chain month by month and cannot be backfilled in parallel')
+        manifest, failed = backfill(
+            start=(args.year, args.month),
+            end=(args.end_year, args.end_month),
+            store=store,
+            train_months=args.train_months,
+            workers=args.workers,
+            manifest_path=args.manifest
+        )
+        print(f"Manifest with {len(manifest)} runs written to {args.manifest}")
+        if failed:
+            sys.exit(f"Backfill failed for: {', '.join(failed)}")
+        sys.exit(0)
+    run_id = run(
+        year=args.year,
+        month=args.month,
+        store=store,
+        train_months=args.train_months,
+        incremental=args.incremental,
+        parent_run_id=args.parent_run_id,
+        incremental_rounds=args.incremental_rounds
+    )
 
     with open("run_id.txt", "w") as f:
         f.write(run_id)
@@ -126,3 +314,5 @@ if __name__ == "__main__":
 # uv run mlflow server --host 127.0.0.1 --port 5000
 # en otra terminal ejecuta el script con uv run python duration_prediction_prefect.py --year 2024 --month 12
 # para mirar los args de input ejecutar uv run python duration_prediction_prefect.py --help
+# para reentrenar un año completo en paralelo:
+# uv run python duration-prediction.py --year 2023 --month 1 --end-year 2023 --end-month 12 --workers 4
@@ -7,21 +7,51 @@ Pipeline con configuración YAML y artifacts estructurados entre tasks
 """
 
 import os
+import sys
 import pickle
 import logging
+import tempfile
+import itertools
 from pathlib import Path
-from typing import Tuple, Optional, Dict, Any
-from dataclasses import dataclass
+from typing import Tuple, Optional, Dict, Any, List, Union
+from dataclasses import dataclass, replace
 
 import yaml
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import xgboost as xgb
-from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
 from sklearn.metrics import root_mean_squared_error
 
 import mlflow
 from prefect import task, flow, get_run_logger
 from prefect.artifacts import create_table_artifact, create_markdown_artifact
+from prefect.futures import as_completed
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from taxi_common.data_store import DatasetStore
+from taxi_common.compression import compress_rows, numeric_columns
+from taxi_common.feature_cache import FeatureCache, data_fingerprint
+from taxi_common.features import prepare_trips
+from taxi_common.loader import read_trips
+from taxi_common.periods import add_months, format_period, training_window
+from taxi_common.route_stats import (
+    DEFAULT_FOLDS, DEFAULT_SMOOTHING, INDEX_FILENAME, RouteStatsIndex, fit_route_stats, iter_out_of_fold
+)
+from taxi_common.task_cache import cached_task_options
+from taxi_common.tracking import Tracker
+from taxi_common.streaming import (
+    fit_vectorizer, iter_file_features, iter_trip_chunks, stack_features, stream_features, summarize_chunks
+)
+from taxi_common.xgb_data import build_dmatrices, build_external_dmatrices
+from taxi_common.vectorizers import (
+    DEFAULT_N_FEATURES, OTHER_ROUTE, hashing_memory_warning, initial_vectorizer, output_width, stack_matrices,
+    vectorizer_mode
+)
+from taxi_common.warm_start import (
+    DEFAULT_INCREMENTAL_ROUNDS, latest_model_run, load_booster, load_preprocessor, log_lineage
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -45,6 +75,32 @@ class PipelineConfig:
     preprocessor_filename: str
     retries: int
     retry_delay_seconds: int
+    cache_dir: Optional[str] = None
+    cache_max_size_gb: float = 5.0
+    offline: bool = False
+    streaming: bool = False
+    memory_budget_mb: int = 512
+    train_months: int = 1
+    feature_mode: str = "dictvectorizer"
+    n_features: int = DEFAULT_N_FEATURES
+    min_route_frequency: int = 1
+    route_stats_smoothing: float = DEFAULT_SMOOTHING
+    route_stats_folds: int = DEFAULT_FOLDS
+    feature_cache: bool = True
+    feature_cache_dir: Optional[str] = None
+    feature_cache_max_size_gb: float = 5.0
+    row_compression: bool = False
+    distance_resolution: Optional[float] = None
+    compression_baseline: bool = True
+    dmatrix_cache: bool = False
+    external_memory: bool = False
+    external_memory_dir: Optional[str] = None
+    incremental: bool = False
+    incremental_rounds: int = DEFAULT_INCREMENTAL_ROUNDS
+    parent_run_id: Optional[str] = None
+    param_sets: Optional[List[dict]] = None
+    param_grid: Optional[Dict[str, list]] = None
+    max_concurrent_trainings: int = 2
     
     @classmethod
     def from_yaml(cls, config_path: str = "config.yaml"):
@@ -52,6 +108,10 @@ class PipelineConfig:
         with open(config_path, 'r') as f:
             config = yaml.safe_load(f)
         
+        cache = config.get('cache', {})
+        features = config.get('features', {})
+        compression = features.get('compression', {})
+        
         return cls(
             mlflow_uri=config['mlflow']['tracking_uri'],
             experiment_name=config['mlflow']['experiment_name'],
@@ -63,47 +123,223 @@ class PipelineConfig:
             model_params=config['model']['params'],
             num_boost_round=config['model']['num_boost_round'],
             early_stopping_rounds=config['model']['early_stopping_rounds'],
+            dmatrix_cache=config['model'].get('dmatrix_cache', False),
+            external_memory=config['model'].get('external_memory', False),
+            external_memory_dir=config['model'].get('external_memory_dir'),
+            incremental=config['model'].get('incremental', False),
+            incremental_rounds=config['model'].get('incremental_rounds', DEFAULT_INCREMENTAL_ROUNDS),
+            parent_run_id=config['model'].get('parent_run_id'),
+            param_sets=config['model'].get('param_sets'),
+            param_grid=config['model'].get('grid'),
+            max_concurrent_trainings=config['model'].get('max_concurrent_trainings', 2),
             models_dir=config['output']['models_dir'],
             preprocessor_filename=config['output']['preprocessor_filename'],
             retries=config['prefect']['retries'],
-            retry_delay_seconds=config['prefect']['retry_delay_seconds']
+            retry_delay_seconds=config['prefect']['retry_delay_seconds'],
+            cache_dir=cache.get('dir'),
+            cache_max_size_gb=cache.get('max_size_gb', 5.0),
+            offline=cache.get('offline', False),
+            streaming=config['data'].get('streaming', False),
+            memory_budget_mb=config['data'].get('memory_budget_mb', 512),
+            train_months=config['data'].get('train_months', 1),
+            feature_mode=features.get('mode', 'dictvectorizer'),
+            n_features=features.get('n_features', DEFAULT_N_FEATURES),
+            min_route_frequency=features.get('min_route_frequency', 1),
+            route_stats_smoothing=features.get('route_stats_smoothing', DEFAULT_SMOOTHING),
+            route_stats_folds=features.get('route_stats_folds', DEFAULT_FOLDS),
+            feature_cache=features.get('cache', True),
+            feature_cache_dir=features.get('cache_dir'),
+            feature_cache_max_size_gb=features.get('cache_max_size_gb', 5.0),
+            row_compression=compression.get('enabled', False),
+            distance_resolution=compression.get('distance_resolution'),
+            compression_baseline=compression.get('compare_baseline', True)
+        )
+
+    def chunk_kwargs(self) -> Dict[str, Any]:
+        """Argumentos de lectura por chunks (modo streaming) derivados del config"""
+        return dict(
+            categorical=self.categorical_features,
+            numerical=self.numerical_features,
+            min_duration=self.min_duration,
+            max_duration=self.max_duration,
+            memory_budget_mb=self.memory_budget_mb
+        )
+
+    def open_data_store(self) -> DatasetStore:
+        """Cache local de los parquet mensuales"""
+        return DatasetStore.from_env(
+            cache_dir=self.cache_dir,
+            max_size_gb=self.cache_max_size_gb,
+            offline=self.offline or None
+        )
+
+    def data_path(self, year: int, month: int) -> str:
+        """
+        Archivo local de un mes, resuelto en el cache en cada uso: si el LRU lo
+        expulsó desde que se cargó, se descarga de nuevo (offline: CacheMissError)
+        en vez de devolver una ruta que ya no existe.
+        """
+        return str(self.open_data_store().fetch(year, month, self.data_url_pattern))
+
+    def read_month(self, year: int, month: int) -> pd.DataFrame:
+        """Viajes de un mes con las columnas y el filtro de duración del config, listos para vectorizar"""
+        # Proyección de columnas del config y filtro de duración dentro del scan de Arrow
+        df = read_trips(
+            self.data_path(year, month),
+            categorical=self.categorical_features,
+            numerical=self.numerical_features,
+            min_duration=self.min_duration,
+            max_duration=self.max_duration
+        )
+        # Feature engineering vectorizado: duración, filtro de outliers y PU_DO
+        return prepare_trips(
+            df,
+            min_duration=self.min_duration,
+            max_duration=self.max_duration,
+            categorical=self.categorical_features,
+            numerical=self.numerical_features
         )
 
+    def month_frame(self, data: "DataLoadResult") -> pd.DataFrame:
+        """
+        DataFrame de un mes cargado. Un DataLoadResult leído del cache de Prefect
+        no lo trae (se persiste solo el sha256): se relee del DatasetStore.
+        """
+        if data.dataframe is None:
+            if data_fingerprint(self.data_path(data.year, data.month)) != data.sha256:
+                raise RuntimeError(
+                    f"{data.year}-{data.month:02d} changed in the data cache since it was loaded; "
+                    "rerun to load it again"
+                )
+            data.dataframe = self.read_month(data.year, data.month)
+        return data.dataframe
+
+    def open_feature_cache(self) -> Optional[FeatureCache]:
+        """Cache de matrices de features (None si está desactivado)"""
+        if not self.feature_cache:
+            return None
+        cache_dir = self.feature_cache_dir
+        if cache_dir is None and self.cache_dir is not None:
+            cache_dir = os.path.join(self.cache_dir, "features")
+        return FeatureCache.from_env(cache_dir=cache_dir, max_size_gb=self.feature_cache_max_size_gb)
+
+    def model_param_sets(self) -> List[dict]:
+        """
+        Parámetros de cada modelo a entrenar: `params` con cada override de
+        `param_sets` y con cada combinación de `grid` (producto cartesiano).
+        Sin ninguno de los dos, solo `params`.
+        """
+        overrides = list(self.param_sets or [])
+        if self.param_grid:
+            names = sorted(self.param_grid)
+            overrides += [
+                dict(zip(names, values))
+                for values in itertools.product(*(self.param_grid[name] for name in names))
+            ]
+        return [{**self.model_params, **override} for override in overrides] or [self.model_params]
+
+    def hashing_memory_warning(self) -> Optional[str]:
+        """Aviso si `n_features` es demasiado ancho para el árbol más profundo a entrenar (modo hashing)"""
+        if self.feature_mode != "hashing":
+            return None
+        max_depth = max((params.get('max_depth') or 0 for params in self.model_param_sets()), default=0)
+        return hashing_memory_warning(self.n_features, max_depth or None)
+
+    def feature_columns(self) -> List[str]:
+        """Columnas que forman cada dict de features: la ruta PU_DO y las numéricas"""
+        return ['PU_DO'] + self.numerical_features
+
+    def feature_key_fields(self) -> Dict[str, Any]:
+        """Campos del config que determinan la matriz de features (llave del cache)"""
+        return dict(
+            categorical=self.categorical_features,
+            numerical=self.numerical_features,
+            min_duration=self.min_duration,
+            max_duration=self.max_duration,
+            min_route_frequency=self.min_route_frequency
+        )
+
+    def load_features(self, features: "FeatureResult") -> "FeatureResult":
+        """
+        FeatureResult con su matriz. Uno leído del cache de Prefect trae solo la
+        llave (`fingerprint`): X e y se abren del FeatureCache.
+        """
+        if features.X is not None or not features.cached:
+            return features
+        cache = self.open_feature_cache()
+        cached = cache.load(features.fingerprint) if cache is not None else None
+        if cached is None:
+            raise RuntimeError(
+                f"Features {features.fingerprint[:12]} are no longer in the feature cache; rerun to rebuild them"
+            )
+        X, y, _ = cached
+        return replace(features, X=X, y=y)
+
+
+# Tracking de MLflow compartido por las tareas: conexión perezosa con prueba
+# corta y fallback a SQLite, params/métricas en batch y subidas en segundo plano
+tracker = Tracker()
+
 
 def setup_mlflow(config: PipelineConfig):
-    """Setup MLflow con configuración desde YAML"""
-    try:
-        mlflow.set_tracking_uri(config.mlflow_uri)
-        mlflow.search_experiments()
-        logger.info(f"✅ Connected to MLflow at: {config.mlflow_uri}")
-    except Exception as e:
-        logger.warning(f"⚠️ Failed to connect: {e}")
-        logger.info("Falling back to local SQLite database")
-        mlflow.set_tracking_uri("sqlite:///mlflow.db")
-    
-    try:
-        mlflow.set_experiment(config.experiment_name)
-        logger.info(f"✅ Experiment set: {config.experiment_name}")
-    except Exception as e:
-        logger.error(f"❌ Failed to set MLflow experiment: {e}")
-        raise
+    """Setup MLflow con configuración desde YAML (se conecta en la primera ejecución)"""
+    tracker.configure(config.mlflow_uri, config.experiment_name)
+    logger.info(f"✅ MLflow: {config.mlflow_uri}, experiment {config.experiment_name}")
 
 
 @dataclass
 class DataLoadResult:
     """Resultado de la carga de datos - se pasa entre tasks"""
-    dataframe: pd.DataFrame
+    dataframe: Optional[pd.DataFrame]  # None en modo streaming o leído del cache de Prefect
     year: int
     month: int
     num_records: int
     avg_duration: float
     unique_locations: int
+    # Checksum del mes; el archivo se resuelve con `config.data_path` al usarlo,
+    # porque una ruta persistida puede quedar colgando si el cache la expulsa
+    sha256: Optional[str] = None
+
+    def __getstate__(self):
+        # El mes ya está en el DatasetStore: Prefect persiste solo la referencia (ver `config.month_frame`)
+        return {**self.__dict__, "dataframe": None}
+
+    def cache_fingerprint(self):
+        return {"year": self.year, "month": self.month, "sha256": self.sha256}
+
+
+# Campos del config que afectan el resultado de cada task (llaves del cache de Prefect)
+LOAD_CONFIG_FIELDS = (
+    "data_url_pattern", "min_duration", "max_duration",
+    "categorical_features", "numerical_features", "streaming", "memory_budget_mb"
+)
+FEATURE_CONFIG_FIELDS = (
+    "min_duration", "max_duration", "categorical_features", "numerical_features", "external_memory",
+    "min_route_frequency"
+)
+ROUTE_STATS_CONFIG_FIELDS = (
+    "min_duration", "max_duration", "categorical_features", "numerical_features", "memory_budget_mb",
+    "route_stats_smoothing", "route_stats_folds"
+)
+TRAIN_CONFIG_FIELDS = (
+    "mlflow_uri", "experiment_name", "model_params", "num_boost_round", "early_stopping_rounds",
+    "models_dir", "preprocessor_filename", "train_months", "feature_mode", "n_features",
+    "external_memory", "memory_budget_mb", "incremental_rounds", "row_compression", "distance_resolution",
+    "min_route_frequency", "route_stats_smoothing", "route_stats_folds"
+)
+
+
+def stored_month(inputs: Dict[str, Any]) -> Optional[str]:
+    """sha256 del mes en el DatasetStore (None si hay que descargarlo): llave de la carga"""
+    config = inputs["config"]
+    return config.open_data_store().checksum(inputs["year"], inputs["month"], config.data_url_pattern)
 
 
 @task(
     name="📥 YAML-Config: Load Taxi Data",
     description="[YAML Version] Load NYC taxi data from parquet files",
-    tags=["yaml-config", "data", "extract"]
+    tags=["yaml-config", "data", "extract"],
+    **cached_task_options(LOAD_CONFIG_FIELDS, stored=stored_month)
 )
 def yaml_load_taxi_data(year: int, month: int, config: PipelineConfig) -> DataLoadResult:
     """
@@ -116,36 +352,38 @@ def yaml_load_taxi_data(year: int, month: int, config: PipelineConfig) -> DataLo
     logger.info(f"📂 Loading data from: {url}")
     
     try:
-        df = pd.read_parquet(url)
-        logger.info(f"✅ Successfully loaded {len(df)} records")
+        # Cache local: solo descarga si el mes no está (o su checksum no coincide)
+        path = config.data_path(year, month)
+
+        if config.streaming:
+            # Modo streaming: no se materializa el mes, solo se recorren sus chunks
+            df = None
+            logger.info(f"🌊 Streaming mode: {config.memory_budget_mb} MB per chunk")
+        else:
+            df = config.read_month(year, month)
+            logger.info(f"✅ Successfully loaded {len(df)} records")
     except Exception as e:
         logger.error(f"❌ Failed to load data from {url}: {e}")
         raise
 
-    # Feature engineering
-    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-    df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
-
-    # Filter outliers usando config
-    df = df[(df.duration >= config.min_duration) & (df.duration <= config.max_duration)]
-    logger.info(f"🔍 Filtered to {len(df)} records (duration: {config.min_duration}-{config.max_duration} min)")
-
-    # Categorical features desde config
-    df[config.categorical_features] = df[config.categorical_features].astype(str)
-    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
+    if df is None:
+        stats = summarize_chunks(iter_trip_chunks(path, **config.chunk_kwargs()))
+    else:
+        stats = summarize_chunks([df])
+    logger.info(f"🔍 Filtered to {stats['num_records']} records (duration: {config.min_duration}-{config.max_duration} min)")
 
     # Calcular estadísticas
-    num_records = len(df)
-    avg_duration = df['duration'].mean()
-    unique_locations = df['PU_DO'].nunique()
+    num_records = stats['num_records']
+    avg_duration = stats['avg_duration']
+    unique_locations = stats['unique_routes']
 
     # Crear artifact con resumen
     summary_data = [
         ["📊 Metric", "Value"],
         ["Total Records", f"{num_records:,}"],
         ["Average Duration", f"{avg_duration:.2f} min"],
-        ["Min Duration", f"{df['duration'].min():.2f} min"],
-        ["Max Duration", f"{df['duration'].max():.2f} min"],
+        ["Min Duration", f"{stats['min_duration']:.2f} min"],
+        ["Max Duration", f"{stats['max_duration']:.2f} min"],
         ["Unique PU_DO", f"{unique_locations:,}"],
         ["Period", f"{year}-{month:02d}"],
         ["🏷️ Version", "YAML Config"]
@@ -164,85 +402,308 @@ def yaml_load_taxi_data(year: int, month: int, config: PipelineConfig) -> DataLo
         month=month,
         num_records=num_records,
         avg_duration=avg_duration,
-        unique_locations=unique_locations
+        unique_locations=unique_locations,
+        sha256=data_fingerprint(path)
     )
 
 
 @dataclass
 class FeatureResult:
     """Resultado de feature engineering - se pasa entre tasks"""
-    X: any  # Sparse matrix
-    y: any  # Target array
-    dv: DictVectorizer
+    X: any  # Sparse matrix, densa en modo route_stats (None en modo external memory)
+    y: any  # Target array (None en modo external memory)
+    dv: Union[DictVectorizer, FeatureHasher, RouteStatsIndex]
     num_features: int
     num_samples: int
+    fingerprint: Optional[str] = None  # huella de datos + config de features
+    periods: Optional[List[Tuple[int, int]]] = None  # meses (año, mes) que se recorren por chunks al entrenar
+    weight: any = None  # pesos de las filas comprimidas (None = una fila por viaje)
+    fold_indices: Optional[List[RouteStatsIndex]] = None  # route_stats out-of-fold (external memory)
+    cached: bool = False  # X e y quedaron en el FeatureCache bajo `fingerprint`
+
+    def __getstate__(self):
+        # Prefect persiste solo la llave de lo que ya guarda el FeatureCache (ver `config.load_features`)
+        if self.cached:
+            return {**self.__dict__, "X": None, "y": None}
+        return self.__dict__
+
+    def cache_fingerprint(self):
+        return self.fingerprint
+
+
+@dataclass
+class RouteStatsResult:
+    """Índice de route_stats ajustado - se pasa a las tasks de features"""
+    index: RouteStatsIndex  # índice completo: validación y serving
+    fold_indices: List[RouteStatsIndex]  # índices out-of-fold: filas de entrenamiento
+
+
+@task(
+    name="🗺️ YAML-Config: Fit Route Stats",
+    description="[YAML Version] Fit the per-route and per-zone statistics index",
+    tags=["yaml-config", "features", "fit"],
+    **cached_task_options(ROUTE_STATS_CONFIG_FIELDS)
+)
+def yaml_fit_route_stats(data_result: List[DataLoadResult], config: PipelineConfig) -> RouteStatsResult:
+    """
+    Ajusta el índice de estadísticas por ruta (modo `route_stats`) con los
+    meses de entrenamiento, junto con los índices out-of-fold que transforman
+    esos mismos meses sin fuga del target. En modo streaming se acumula chunk
+    por chunk. El índice hace de vectorizador: train y validación se
+    transforman después en paralelo, sin fit.
+    """
+    logger = get_run_logger()
+
+    period = format_period([(r.year, r.month) for r in data_result])
+    if config.streaming:
+        frames = itertools.chain.from_iterable(
+            iter_trip_chunks(config.data_path(r.year, r.month), **config.chunk_kwargs()) for r in data_result
+        )
+    else:
+        frames = [config.month_frame(r) for r in data_result]
+    index, fold_indices = fit_route_stats(frames, config.route_stats_smoothing, config.route_stats_folds)
+
+    num_routes = len(index.route_ids_)
+    logger.info(f"🗺️ Route stats for {period}: {num_routes:,} routes, smoothing {index.smoothing:g} trips")
+
+    create_table_artifact(
+        key=f"yaml-route-stats-{data_result[0].year}-{data_result[0].month:02d}",
+        table=[
+            ["📊 Metric", "Value"],
+            ["Routes", f"{num_routes:,}"],
+            ["Trips", f"{int(index.global_stats_[-1]):,}"],
+            ["Global Mean Duration", f"{index.global_stats_[0]:.2f} min"],
+            ["Global Median Duration", f"{index.global_stats_[1]:.2f} min"],
+            ["Smoothing", f"{index.smoothing:g}"],
+            ["Out-of-Fold Parts", len(fold_indices)],
+            ["Features", len(index.feature_names_)],
+            ["🏷️ Version", "YAML Config"]
+        ],
+        description=f"🗺️ [YAML Config] Route statistics index for {period}"
+    )
+    return RouteStatsResult(index=index, fold_indices=fold_indices)
+
+
+def feature_cache_key(
+    data_results: List[DataLoadResult],
+    config: PipelineConfig,
+    dv: Optional[Union[DictVectorizer, FeatureHasher, RouteStatsIndex]] = None,
+    fold_indices: Optional[List[RouteStatsIndex]] = None
+) -> str:
+    """Llave del FeatureCache: mismos datos + mismo config de features = misma matriz"""
+    return FeatureCache.key(
+        [r.sha256 for r in data_results],
+        dv=dv,
+        features=config.feature_columns(),
+        out_of_fold=len(fold_indices) if fold_indices else None,
+        **config.feature_key_fields()
+    )
+
+
+def stored_features(inputs: Dict[str, Any]) -> Optional[str]:
+    """
+    Llave de la matriz en el FeatureCache, o None si no está (o el cache está
+    desactivado): el resultado persistido en Prefect no trae la matriz.
+    """
+    config = inputs["config"]
+    data_result = inputs["data_result"]
+    key = feature_cache_key(
+        data_result if isinstance(data_result, list) else [data_result],
+        config,
+        dv=inputs.get("dv"),
+        fold_indices=inputs.get("fold_indices")
+    )
+    if config.external_memory:
+        # Sin matriz: el resultado es solo el vocabulario y los meses
+        return key
+    cache = config.open_feature_cache()
+    return key if cache is not None and key in cache else None
 
 
 @task(
     name="🔧 YAML-Config: Engineer Features",
     description="[YAML Version] Create feature matrix using DictVectorizer",
-    tags=["yaml-config", "features", "transform"]
+    tags=["yaml-config", "features", "transform"],
+    **cached_task_options(FEATURE_CONFIG_FIELDS, stored=stored_features)
 )
 def yaml_engineer_features(
-    data_result: DataLoadResult,
+    data_result: Union[DataLoadResult, List[DataLoadResult]],
     config: PipelineConfig,
-    dv: Optional[DictVectorizer] = None
+    dv: Optional[Union[DictVectorizer, FeatureHasher, RouteStatsIndex]] = None,
+    fold_indices: Optional[List[RouteStatsIndex]] = None
 ) -> FeatureResult:
     """
     Crea matriz de features desde DataLoadResult.
-    Recibe el resultado de yaml_load_taxi_data como input.
+    Recibe el resultado de yaml_load_taxi_data como input, o una lista de
+    resultados (uno por mes) cuando se entrena con una ventana de varios meses.
+    Con `fold_indices` (entrenamiento en modo route_stats) cada fila se
+    transforma con el índice out-of-fold que no la vio.
     """
     logger = get_run_logger()
     
-    df = data_result.dataframe
+    data_results = data_result if isinstance(data_result, list) else [data_result]
+    period = format_period([(r.year, r.month) for r in data_results])
     
     # Features desde config
     categorical = ['PU_DO']
     numerical = config.numerical_features
+    features = config.feature_columns()
+    
+    fit = dv is None
     
-    # Verificar columnas
-    missing_cols = [col for col in categorical + numerical if col not in df.columns]
-    if missing_cols:
-        raise ValueError(f"❌ Missing required columns: {missing_cols}")
+    # Cache por contenido: mismos datos + mismo config de features = misma matriz
+    cache_key = feature_cache_key(data_results, config, dv=dv, fold_indices=fold_indices)
+    # En external memory no hay matriz que cachear: XGBoost la arma al entrenar
+    cache = None if config.external_memory else config.open_feature_cache()
+    cached = cache.load(cache_key) if cache is not None else None
     
-    dicts = df[categorical + numerical].to_dict(orient='records')
-    logger.info(f"📝 Created {len(dicts):,} feature dictionaries")
-
-    # Fit o transform
-    if dv is None:
-        dv = DictVectorizer(sparse=True)
-        X = dv.fit_transform(dicts)
-        logger.info(f"✅ Fitted DictVectorizer with {X.shape[1]:,} features")
+    if cached is not None:
+        X, y, dv = cached
+        logger.info(f"♻️ Loaded {X.shape[0]:,} rows for {period} from feature cache")
+    elif config.external_memory:
+        # External memory: solo se ajusta el vocabulario (valores únicos por chunk)
+        if fit:
+            chunks = itertools.chain.from_iterable(
+                iter_trip_chunks(config.data_path(r.year, r.month), **config.chunk_kwargs()) for r in data_results
+            )
+            dv = fit_vectorizer(chunks, features, config.min_route_frequency)
+        X = y = None
+        logger.info(f"💽 External memory: {period} will be read in chunks during training")
+    elif config.streaming:
+        # Modo streaming: el vocabulario y la matriz se construyen chunk por chunk
+        if fit:
+            chunks = itertools.chain.from_iterable(
+                iter_trip_chunks(config.data_path(r.year, r.month), **config.chunk_kwargs()) for r in data_results
+            )
+            dv = fit_vectorizer(chunks, features, config.min_route_frequency)
+        if fold_indices:
+            # Mismo orden de chunks que al ajustar los índices out-of-fold
+            chunks = itertools.chain.from_iterable(
+                iter_trip_chunks(config.data_path(r.year, r.month), **config.chunk_kwargs()) for r in data_results
+            )
+            parts = list(iter_out_of_fold(chunks, fold_indices))
+        else:
+            parts = [stream_features(config.data_path(r.year, r.month), features, dv=dv, **config.chunk_kwargs()) for r in data_results]
+        X = stack_matrices([part[0] for part in parts])
+        y = np.concatenate([part[1] for part in parts])
+        logger.info(f"🌊 Streamed {X.shape[0]:,} rows for {period}")
+    else:
+        # Verificar columnas
+        dfs = [config.month_frame(r) for r in data_results]
+        missing_cols = [col for col in features if col not in dfs[0].columns]
+        if missing_cols:
+            raise ValueError(f"❌ Missing required columns: {missing_cols}")
         
-        # Crear artifact solo cuando se hace fit
+        if fold_indices:
+            parts = list(iter_out_of_fold(dfs, fold_indices))
+            X = np.vstack([part[0] for part in parts])
+            y = np.concatenate([part[1] for part in parts])
+        else:
+            # Fit o transform: un vocabulario para todos los meses, se apilan solo las matrices
+            X, y, dv = stack_features(dfs, features, dv=dv, min_route_frequency=config.min_route_frequency)
+        logger.info(f"📝 Vectorized {X.shape[0]:,} records for {period}")
+
+    if cache is not None and cached is None:
+        cache.store(cache_key, X, y, dv)
+
+    if X is None:
+        num_samples, num_features = sum(r.num_records for r in data_results), output_width(dv)
+    else:
+        num_samples, num_features = X.shape
+
+    mode = vectorizer_mode(dv)
+    route_buckets = 0
+    if mode == "dictvectorizer":
+        route_buckets = sum(name.endswith(f"_{OTHER_ROUTE}") for name in dv.feature_names_)
+    if fit:
+        logger.info(f"✅ Fitted DictVectorizer with {num_features:,} features")
+        if config.min_route_frequency > 1:
+            logger.info(f"🪣 Routes with fewer than {config.min_route_frequency} trips share "
+                        f"{route_buckets:,} pickup-zone buckets")
+    elif mode == "hashing":
+        logger.info(f"✅ Hashed features into {num_features:,} columns (no fit)")
+    elif mode == "route_stats":
+        source = f"{len(fold_indices)} out-of-fold indices" if fold_indices else "the full index"
+        logger.info(f"✅ Looked up {num_features} dense route-stats columns from {source} (no fit)")
+    else:
+        logger.info(f"✅ Transformed features: {num_features:,} features")
+
+    if fit or mode != "dictvectorizer":
+        # Crear artifact cuando se hace fit (o en cada mes con hashing o route_stats, sin fit aquí)
+        if X is None:
+            sparsity = "-"
+        elif sp.issparse(X):
+            sparsity = f"{(1 - X.nnz / (num_samples * num_features)) * 100:.2f}%"
+        else:
+            sparsity = "dense"
         feature_info = [
             ["📊 Metric", "Value"],
-            ["Total Features", f"{X.shape[1]:,}"],
+            ["Feature Mode", mode],
+            ["Total Features", f"{num_features:,}"],
             ["Categorical Features", len(categorical)],
             ["Numerical Features", len(numerical)],
-            ["Samples", f"{X.shape[0]:,}"],
-            ["Sparsity", f"{(1 - X.nnz / (X.shape[0] * X.shape[1])) * 100:.2f}%"],
+            ["Samples", f"{num_samples:,}"],
+            ["Min Route Frequency", config.min_route_frequency],
+            ["Route Buckets", route_buckets],
+            ["Sparsity", sparsity],
             ["🏷️ Version", "YAML Config"]
         ]
 
         create_table_artifact(
-            key=f"yaml-feature-info-{data_result.year}-{data_result.month:02d}",
+            key=f"yaml-feature-info-{data_results[0].year}-{data_results[0].month:02d}",
             table=feature_info,
-            description=f"🔧 [YAML Config] Features for {data_result.year}-{data_result.month:02d}"
+            description=f"🔧 [YAML Config] Features for {period}"
         )
-    else:
-        X = dv.transform(dicts)
-        logger.info(f"✅ Transformed features: {X.shape[1]:,} features")
-
-    # Target
-    y = df['duration'].values
 
     return FeatureResult(
         X=X,
         y=y,
         dv=dv,
-        num_features=X.shape[1],
-        num_samples=X.shape[0]
+        num_features=num_features,
+        num_samples=num_samples,
+        fingerprint=cache_key,
+        periods=[(r.year, r.month) for r in data_results],
+        fold_indices=fold_indices if config.external_memory else None,
+        cached=cache is not None
+    )
+
+
+@task(
+    name="🗜️ YAML-Config: Compress Training Rows",
+    description="[YAML Version] Merge identical feature rows into weighted rows",
+    tags=["yaml-config", "features", "compression"]
+)
+def yaml_compress_features(train_features: FeatureResult, config: PipelineConfig) -> FeatureResult:
+    """
+    Agrupa las filas de features idénticas (con `trip_distance` redondeada a
+    `distance_resolution`, si se indica) en una fila con peso = cantidad de
+    viajes y target = duración promedio. `num_samples` sigue contando viajes.
+    """
+    logger = get_run_logger()
+
+    train_features = config.load_features(train_features)
+    X, y, weight = compress_rows(
+        train_features.X, train_features.y,
+        resolution=config.distance_resolution,
+        columns=numeric_columns(train_features.dv, config.numerical_features)
+    )
+    ratio = train_features.X.shape[0] / X.shape[0]
+    logger.info(f"🗜️ Compressed {train_features.X.shape[0]:,} training rows to {X.shape[0]:,} ({ratio:.1f}x)")
+
+    # La huella sale de la de las features y de la resolución (llaves del cache de DMatrix y del entrenamiento)
+    compressed_fingerprint = FeatureCache.key(
+        [train_features.fingerprint], compression="rows", distance_resolution=config.distance_resolution
+    )
+    return FeatureResult(
+        X=X,
+        y=y,
+        dv=train_features.dv,
+        num_features=train_features.num_features,
+        num_samples=train_features.num_samples,
+        fingerprint=compressed_fingerprint,
+        periods=train_features.periods,
+        weight=weight,
+        fold_indices=getattr(train_features, "fold_indices", None)
     )
 
 
@@ -253,21 +714,43 @@ class ModelResult:
     rmse: float
     num_boost_rounds: int
     best_iteration: int
+    params: Optional[Dict[str, Any]] = None
+
+
+def submit_with_limit(task_fn, kwargs_list: List[Dict[str, Any]], limit: int) -> list:
+    """
+    Envía una task por cada juego de argumentos, con a lo sumo `limit` corriendo a la vez.
+
+    Returns:
+        Futures en el mismo orden que `kwargs_list`
+    """
+    futures = []
+    for kwargs in kwargs_list:
+        running = [f for f in futures if not f.state.is_final()]
+        if len(running) >= limit:
+            # Esperar a que termine alguna antes de ocupar otro slot
+            next(as_completed(running))
+        futures.append(task_fn.submit(**kwargs))
+    return futures
 
 
 @task(
     name="🤖 YAML-Config: Train XGBoost Model",
     description="[YAML Version] Train XGBoost model with MLflow tracking",
-    tags=["yaml-config", "model", "train", "xgboost"]
+    tags=["yaml-config", "model", "train", "xgboost"],
+    **cached_task_options(TRAIN_CONFIG_FIELDS)
 )
 def yaml_train_xgboost_model(
     train_features: FeatureResult,
     val_features: FeatureResult,
-    config: PipelineConfig
+    config: PipelineConfig,
+    parent_run_id: Optional[str] = None
 ) -> ModelResult:
     """
     Entrena modelo XGBoost.
     Recibe FeatureResult de train y validation como inputs.
+    Con `parent_run_id` continúa el booster de esa ejecución (modo incremental)
+    agregando `incremental_rounds` rondas en vez de entrenar desde cero.
     """
     logger = get_run_logger()
     
@@ -277,51 +760,130 @@ def yaml_train_xgboost_model(
     
     logger.info(f"🎯 Training with {train_features.num_samples:,} samples, {train_features.num_features:,} features")
 
-    with mlflow.start_run() as run:
-        # Preparar datos
-        train = xgb.DMatrix(train_features.X, label=train_features.y)
-        valid = xgb.DMatrix(val_features.X, label=val_features.y)
+    # Los FeatureResult persistidos en el cache de Prefect antes de existir `weight` no lo traen
+    weight = getattr(train_features, "weight", None)
 
+    with tracker.start_run() as run:
         # Parámetros desde config
         params = config.model_params
-        mlflow.log_params(params)
+
+        if config.external_memory:
+            # External memory: XGBoost recorre los parquet por chunks y guarda las páginas en disco
+            features = config.feature_columns()
+            fold_indices = getattr(train_features, "fold_indices", None)
+
+            def month_paths(periods):
+                # Se resuelven en cada pasada: el cache de datos pudo expulsar los meses
+                return [config.data_path(year, month) for year, month in periods]
+
+            def train_chunks():
+                train_paths = month_paths(train_features.periods)
+                if fold_indices:
+                    # route_stats: cada fila con el índice out-of-fold que no la vio
+                    return iter_out_of_fold(
+                        itertools.chain.from_iterable(
+                            iter_trip_chunks(path, **config.chunk_kwargs()) for path in train_paths
+                        ),
+                        fold_indices
+                    )
+                return iter_file_features(train_paths, train_features.dv, features, **config.chunk_kwargs())
+
+            train, valid = build_external_dmatrices(
+                train_chunks,
+                lambda: iter_file_features(month_paths(val_features.periods), train_features.dv, features, **config.chunk_kwargs()),
+                params,
+                cache_dir=config.external_memory_dir or models_folder / "extmem",
+                warm_start=parent_run_id is not None
+            )
+            y_val = valid.get_label()
+        else:
+            # Preparar datos: QuantileDMatrix con hist, o DMatrix binario desde el cache
+            train_features = config.load_features(train_features)
+            val_features = config.load_features(val_features)
+            train, valid = build_dmatrices(
+                train_features.X, train_features.y,
+                val_features.X, val_features.y,
+                params,
+                cache_dir=models_folder / "dmatrix" if config.dmatrix_cache else None,
+                fingerprints=(train_features.fingerprint, val_features.fingerprint),
+                warm_start=parent_run_id is not None,
+                weight=weight
+            )
+            y_val = val_features.y
+        run.log_params(params)
+
+        # Modo incremental: se parte del booster del padre y solo se agregan rondas
+        parent_booster = None
+        num_boost_round = config.num_boost_round
+        if parent_run_id is not None:
+            parent_booster = load_booster(parent_run_id)
+            num_boost_round = config.incremental_rounds
+            log_lineage(parent_run_id, run)
+            logger.info(f"🔁 Adding {num_boost_round} rounds to the model of run {parent_run_id}")
         
-        # Log configuración adicional
-        mlflow.log_param("num_boost_round", config.num_boost_round)
-        mlflow.log_param("early_stopping_rounds", config.early_stopping_rounds)
-        mlflow.log_param("pipeline_version", "yaml-config")
+        # Log configuración adicional (el modo de features lo fija el vectorizador,
+        # que en modo incremental viene del padre)
+        mode = vectorizer_mode(train_features.dv)
+        run.log_params({
+            "num_boost_round": num_boost_round,
+            "early_stopping_rounds": config.early_stopping_rounds,
+            "train_months": config.train_months,
+            "feature_mode": mode,
+            "external_memory": config.external_memory,
+            "pipeline_version": "yaml-config"
+        })
+        if mode == "hashing":
+            run.log_param("n_features", train_features.dv.n_features)
+        elif mode == "route_stats":
+            run.log_params({"route_stats_smoothing": train_features.dv.smoothing,
+                            "route_stats_folds": config.route_stats_folds})
+        else:
+            run.log_param("min_route_frequency", config.min_route_frequency)
+        run.log_param("row_compression", weight is not None)
+        if weight is not None:
+            run.log_params({"distance_resolution": config.distance_resolution, "train_rows": train_features.X.shape[0]})
 
         # Entrenar
         logger.info("🚀 Starting training...")
         booster = xgb.train(
             params=params,
             dtrain=train,
-            num_boost_round=config.num_boost_round,
+            num_boost_round=num_boost_round,
             evals=[(valid, 'validation')],
-            early_stopping_rounds=config.early_stopping_rounds
+            early_stopping_rounds=config.early_stopping_rounds,
+            xgb_model=parent_booster
         )
 
         # Evaluar
         y_pred = booster.predict(valid)
-        rmse = root_mean_squared_error(val_features.y, y_pred)
-        mlflow.log_metric("rmse", rmse)
-        mlflow.log_metric("train_samples", train_features.num_samples)
-        mlflow.log_metric("val_samples", val_features.num_samples)
-        mlflow.log_metric("num_features", train_features.num_features)
+        rmse = root_mean_squared_error(y_val, y_pred)
+        run.log_metrics({
+            "rmse": rmse,
+            "train_samples": train_features.num_samples,
+            "val_samples": val_features.num_samples,
+            "num_features": train_features.num_features
+        })
         
         logger.info(f"📊 RMSE: {rmse:.4f}")
 
-        # Guardar preprocessor
+        # Guardar preprocessor (escritura atómica: varios entrenamientos pueden correr a la vez)
         preprocessor_path = models_folder / config.preprocessor_filename
-        with open(preprocessor_path, "wb") as f_out:
+        fd, tmp_name = tempfile.mkstemp(dir=models_folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f_out:
             pickle.dump(train_features.dv, f_out)
+        os.replace(tmp_name, preprocessor_path)
         
-        try:
-            mlflow.log_artifact(str(preprocessor_path), artifact_path="preprocessor")
-            mlflow.xgboost.log_model(booster, artifact_path="models_mlflow")
-            logger.info("✅ Successfully logged model and preprocessor to MLflow")
-        except Exception as e:
-            logger.warning(f"⚠️ Failed to log to MLflow: {e}")
+        # Se suben en segundo plano al cerrar la ejecución; la task las espera antes de retornar
+        run.log_artifact(str(preprocessor_path), artifact_path="preprocessor")
+        if mode == "route_stats":
+            # El índice también como arrays (.npz): legible sin pickle ni taxi_common
+            fd, tmp_name = tempfile.mkstemp(dir=models_folder, suffix=".tmp")
+            os.close(fd)
+            train_features.dv.save(tmp_name)
+            index_path = models_folder / INDEX_FILENAME
+            os.replace(tmp_name, index_path)
+            run.log_artifact(str(index_path), artifact_path="preprocessor")
+        run.log_model(mlflow.xgboost, booster, "models_mlflow")
 
         # Crear artifact de performance
         performance_data = [
@@ -333,7 +895,7 @@ def yaml_train_xgboost_model(
             ["Features", f"{train_features.num_features:,}"],
             ["Learning Rate", params['learning_rate']],
             ["Max Depth", params['max_depth']],
-            ["MLflow Run ID", run.info.run_id[:8] + "..."],
+            ["MLflow Run ID", run.run_id[:8] + "..."],
             ["🏷️ Version", "YAML Config"]
         ]
 
@@ -349,8 +911,8 @@ def yaml_train_xgboost_model(
 
 ## 📊 Performance Metrics
 - **RMSE**: {rmse:.4f} minutes
-- **Best Iteration**: {booster.best_iteration}/{config.num_boost_round}
-- **MLflow Run ID**: `{run.info.run_id}`
+- **Best Iteration**: {booster.best_iteration}/{booster.num_boosted_rounds()}
+- **MLflow Run ID**: `{run.run_id}`
 - **Pipeline Version**: YAML Config
 
 ## 📈 Data Statistics
@@ -369,7 +931,7 @@ def yaml_train_xgboost_model(
 | Objective | {params['objective']} |
 
 ## 🎯 Training Configuration
-- **Boost Rounds**: {config.num_boost_round}
+- **Boost Rounds**: {num_boost_round}{f" (warm start from `{parent_run_id}`)" if parent_run_id else ""}
 - **Early Stopping**: {config.early_stopping_rounds} rounds
 - **Config File**: `config.yaml`
 
@@ -385,12 +947,15 @@ def yaml_train_xgboost_model(
             description="📝 [YAML Config] Detailed training summary"
         )
 
-        return ModelResult(
-            run_id=run.info.run_id,
-            rmse=rmse,
-            num_boost_rounds=config.num_boost_round,
-            best_iteration=booster.best_iteration
-        )
+    # El resultado se cachea: solo se retorna con el modelo y el preprocessor ya
+    # en MLflow, así una subida fallida hace fallar la task en vez de quedar cacheada
+    return ModelResult(
+        run_id=run.wait(),
+        rmse=rmse,
+        num_boost_rounds=booster.num_boosted_rounds(),
+        best_iteration=booster.best_iteration,
+        params=params
+    )
 
 
 @flow(
@@ -401,7 +966,16 @@ def yaml_train_xgboost_model(
 def taxi_duration_yaml_pipeline(
     year: int,
     month: int,
-    config_path: str = "config.yaml"
+    config_path: str = "config.yaml",
+    offline: bool = False,
+    train_months: Optional[int] = None,
+    external_memory: bool = False,
+    incremental: bool = False,
+    parent_run_id: Optional[str] = None,
+    param_sets: Optional[List[dict]] = None,
+    row_compression: bool = False,
+    distance_resolution: Optional[float] = None,
+    min_route_frequency: Optional[int] = None
 ) -> ModelResult:
     """
     Flow principal que orquesta todas las tasks.
@@ -411,53 +985,204 @@ def taxi_duration_yaml_pipeline(
     - ✅ Configuración desde YAML
     - ✅ Artifacts estructurados entre tasks
     - ✅ Nombres únicos para diferenciar en Prefect UI
+
+    Con varios juegos de parámetros (`param_sets`, o `model.param_sets` /
+    `model.grid` en el YAML) los datos se cargan y vectorizan una sola vez y
+    los modelos se entrenan en paralelo; se retorna el de menor RMSE.
+
+    Con compresión de filas (`features.compression` en el YAML) se entrena con
+    las filas únicas ponderadas y, si `compare_baseline`, se reentrena la mejor
+    configuración sin comprimir para reportar el cambio de RMSE.
     """
     logger = get_run_logger()
     
     # 1. Cargar configuración desde YAML
     logger.info(f"📋 Loading configuration from: {config_path}")
     config = PipelineConfig.from_yaml(config_path)
+    if offline:
+        config.offline = True
+    if train_months is not None:
+        config.train_months = train_months
+    if external_memory:
+        config.external_memory = True
+    if config.external_memory and not config.streaming:
+        # Cargar los meses completos en pandas anularía el presupuesto de memoria
+        logger.info("💽 External memory training: switching data loading to streaming mode")
+        config.streaming = True
+    if incremental or parent_run_id is not None:
+        config.incremental = True
+    if parent_run_id is not None:
+        config.parent_run_id = parent_run_id
+    if param_sets is not None:
+        config.param_sets, config.param_grid = param_sets, None
+    if min_route_frequency is not None:
+        config.min_route_frequency = min_route_frequency
+    if config.min_route_frequency > 1 and config.feature_mode != "dictvectorizer":
+        logger.warning(f"⚠️ min_route_frequency only applies to the dictvectorizer mode; ignored in {config.feature_mode}")
+    hashing_warning = config.hashing_memory_warning()
+    if hashing_warning:
+        logger.warning(f"⚠️ {hashing_warning}")
+    if row_compression:
+        config.row_compression = True
+    if distance_resolution is not None:
+        config.distance_resolution = distance_resolution
+    if config.row_compression and config.external_memory:
+        raise ValueError("Row compression needs the feature matrix in memory; disable external_memory")
     
     # 2. Setup MLflow
     setup_mlflow(config)
     
-    # 3. Cargar datos de entrenamiento
-    logger.info(f"📥 Loading training data: {year}-{month:02d}")
-    train_data = yaml_load_taxi_data(year=year, month=month, config=config)
-    
-    # 4. Calcular período de validación
-    next_year = year if month < 12 else year + 1
-    next_month = month + 1 if month < 12 else 1
+    # 3. Calcular ventana de entrenamiento y período de validación
+    train_periods = training_window(year, month, config.train_months)
+    next_year, next_month = add_months(year, month, 1)
     
-    # 5. Cargar datos de validación
+    # 4. Cargar meses de entrenamiento y validación en paralelo
+    logger.info(f"📥 Loading training data: {format_period(train_periods)}")
     logger.info(f"📥 Loading validation data: {next_year}-{next_month:02d}")
-    val_data = yaml_load_taxi_data(year=next_year, month=next_month, config=config)
-    
-    # 6. Crear features de entrenamiento (fit DictVectorizer)
-    logger.info("🔧 Creating training features...")
-    train_features = yaml_engineer_features(
-        data_result=train_data,
-        config=config,
-        dv=None  # Fit nuevo
-    )
+    train_futures = [
+        yaml_load_taxi_data.submit(year=train_year, month=train_month, config=config)
+        for train_year, train_month in train_periods
+    ]
+    val_future = yaml_load_taxi_data.submit(year=next_year, month=next_month, config=config)
+    train_data = [future.result() for future in train_futures]
+    val_data = val_future.result()
     
-    # 7. Crear features de validación (transform con DV existente)
-    logger.info("🔧 Creating validation features...")
-    val_features = yaml_engineer_features(
-        data_result=val_data,
-        config=config,
-        dv=train_features.dv  # Reutilizar DV del training
-    )
+    parent_run_id = None
+    fold_indices = None
+    if config.incremental:
+        # Incremental: el vectorizador del modelo padre fija el espacio de features
+        tracker.connect()
+        parent_run_id = config.parent_run_id or latest_model_run(config.experiment_name)
+        dv = load_preprocessor(parent_run_id, config.preprocessor_filename)
+        logger.info(f"🔁 Incremental training from run {parent_run_id}")
+    elif config.feature_mode == "route_stats":
+        # Estadísticas por ruta de los meses de entrenamiento; después se usan como lookup
+        logger.info("🗺️ Fitting route stats index...")
+        route_stats = yaml_fit_route_stats(data_result=train_data, config=config)
+        dv, fold_indices = route_stats.index, route_stats.fold_indices
+    else:
+        dv = initial_vectorizer(config.feature_mode, config.n_features)
+
+    if dv is not None:
+        # 5-6. Hashing, route stats o vocabulario del padre: sin fit, train y validación se vectorizan en paralelo
+        logger.info("🔧 Creating training and validation features (no fit)...")
+        train_future = yaml_engineer_features.submit(
+            data_result=train_data, config=config, dv=dv, fold_indices=fold_indices
+        )
+        val_future = yaml_engineer_features.submit(data_result=val_data, config=config, dv=dv)
+        train_features = train_future.result()
+        val_features = val_future.result()
+    else:
+        # 5. Crear features de entrenamiento (fit DictVectorizer)
+        logger.info("🔧 Creating training features...")
+        train_features = yaml_engineer_features(
+            data_result=train_data,
+            config=config,
+            dv=None  # Fit nuevo
+        )
+        
+        # 6. Crear features de validación (transform con DV existente)
+        logger.info("🔧 Creating validation features...")
+        val_features = yaml_engineer_features(
+            data_result=val_data,
+            config=config,
+            dv=train_features.dv  # Reutilizar DV del training
+        )
     
-    # 8. Entrenar modelo
-    logger.info("🤖 Training model...")
-    model_result = yaml_train_xgboost_model(
-        train_features=train_features,
-        val_features=val_features,
-        config=config
+    # 6b. Compresión opcional: filas únicas con peso en vez de una fila por viaje
+    full_train_features = train_features
+    if config.row_compression:
+        logger.info("🗜️ Compressing training rows...")
+        train_features = yaml_compress_features(train_features=full_train_features, config=config)
+
+    # 7. Entrenar un modelo por juego de parámetros, todos sobre las mismas features
+    model_params = config.model_param_sets()
+    if len(model_params) == 1:
+        logger.info("🤖 Training model...")
+        model_results = [yaml_train_xgboost_model(
+            train_features=train_features,
+            val_features=val_features,
+            config=config,
+            parent_run_id=parent_run_id
+        )]
+    else:
+        limit = max(1, config.max_concurrent_trainings)
+        logger.info(f"🤖 Training {len(model_params)} models, {limit} at a time...")
+        # Repartir los cores entre los entrenamientos simultáneos
+        nthread = max(1, (os.cpu_count() or 1) // limit)
+        futures = submit_with_limit(
+            yaml_train_xgboost_model,
+            [
+                dict(
+                    train_features=train_features,
+                    val_features=val_features,
+                    config=replace(config, model_params={'nthread': nthread, **params}),
+                    parent_run_id=parent_run_id
+                )
+                for params in model_params
+            ],
+            limit
+        )
+        model_results = [future.result() for future in futures]
+    model_result = min(model_results, key=lambda result: result.rmse)
+
+    baseline_result = None
+    if config.row_compression and config.compression_baseline:
+        # Referencia: la mejor configuración entrenada con todas las filas
+        logger.info("🤖 Training uncompressed baseline for comparison...")
+        baseline_result = yaml_train_xgboost_model(
+            train_features=full_train_features,
+            val_features=val_features,
+            config=replace(config, model_params=model_result.params, row_compression=False),
+            parent_run_id=parent_run_id
+        )
+    # Cada task de entrenamiento ya esperó su ejecución; nada pendiente puede fallar en silencio
+    upload_errors = tracker.wait_for_uploads()
+    if upload_errors:
+        raise RuntimeError(f"{len(upload_errors)} MLflow uploads failed") from upload_errors[0]
+
+    if config.row_compression:
+        compression_table = [
+            ["📊 Metric", "Value"],
+            ["Training Rows", f"{full_train_features.num_samples:,}"],
+            ["Compressed Rows", f"{train_features.X.shape[0]:,}"],
+            ["Compression Ratio", f"{full_train_features.num_samples / train_features.X.shape[0]:.1f}x"],
+            ["Distance Resolution", config.distance_resolution if config.distance_resolution is not None else "exact"],
+            ["RMSE (compressed)", f"{model_result.rmse:.4f}"],
+            ["RMSE (uncompressed)", f"{baseline_result.rmse:.4f}" if baseline_result else "-"],
+            ["RMSE Change", f"{model_result.rmse - baseline_result.rmse:+.4f}" if baseline_result else "-"],
+            ["🏷️ Version", "YAML Config"]
+        ]
+        create_table_artifact(
+            key="yaml-row-compression",
+            table=compression_table,
+            description="🗜️ [YAML Config] Training rows and RMSE with and without row compression"
+        )
+
+    # 8. Crear resumen final del pipeline
+    train_rows = "\n".join(
+        f"| **Training** ({d.year}-{d.month:02d}) | {d.num_records:,} | {d.avg_duration:.2f} min | {d.unique_locations:,} |"
+        for d in train_data
     )
-    
-    # 9. Crear resumen final del pipeline
+    compared_section = ""
+    if len(model_results) > 1:
+        # Solo las columnas de parámetros que cambian entre los modelos
+        varying = sorted(
+            name for name in set().union(*(r.params for r in model_results))
+            if len({repr(r.params.get(name)) for r in model_results}) > 1
+        )
+        rows = "\n".join(
+            f"| {'🏆' if r is model_result else ''} | {r.rmse:.4f} | "
+            + " | ".join(str(r.params.get(name)) for name in varying)
+            + f" | `{r.run_id[:8]}` |"
+            for r in sorted(model_results, key=lambda result: result.rmse)
+        )
+        compared_section = f"""
+## 🔬 Compared Configurations ({len(model_results)})
+| Best | RMSE | {" | ".join(varying)} | Run |
+|------|------|{"|".join("---" for _ in varying)}|-----|
+{rows}
+"""
     pipeline_summary = f"""
 # 🎉 YAML-Config Pipeline Execution Complete!
 
@@ -467,13 +1192,13 @@ def taxi_duration_yaml_pipeline(
 ## 📊 Data Summary
 | Period | Records | Avg Duration | Unique Locations |
 |--------|---------|--------------|------------------|
-| **Training** ({train_data.year}-{train_data.month:02d}) | {train_data.num_records:,} | {train_data.avg_duration:.2f} min | {train_data.unique_locations:,} |
+{train_rows}
 | **Validation** ({val_data.year}-{val_data.month:02d}) | {val_data.num_records:,} | {val_data.avg_duration:.2f} min | {val_data.unique_locations:,} |
 
 ## 🎯 Model Performance
-- **RMSE**: {model_result.rmse:.4f} minutes
+- **RMSE**: {model_result.rmse:.4f} minutes{" (best of " + str(len(model_results)) + " configurations)" if len(model_results) > 1 else ""}
 - **Best Iteration**: {model_result.best_iteration}/{model_result.num_boost_rounds}
-
+{compared_section}
 ## 🔗 Results
 - **MLflow Run ID**: `{model_result.run_id}`
 - **MLflow URI**: `{config.mlflow_uri}`
@@ -534,6 +1259,50 @@ if __name__ == "__main__":
         default='config.yaml',
         help='Path to config YAML file (default: config.yaml)'
     )
+    parser.add_argument(
+        '--train-months',
+        type=int,
+        default=None,
+        help='Number of months up to --year/--month to train on (default: data.train_months in config)'
+    )
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='Only use the local data cache, never download'
+    )
+    parser.add_argument(
+        '--external-memory',
+        action='store_true',
+        help='Train XGBoost out of core, reading the months in chunks (default: model.external_memory in config)'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Add boosting rounds to the last run\'s model instead of training from scratch'
+    )
+    parser.add_argument(
+        '--parent-run-id',
+        type=str,
+        default=None,
+        help='MLflow run to continue in incremental mode (default: latest run of the experiment)'
+    )
+    parser.add_argument(
+        '--min-route-frequency',
+        type=int,
+        default=None,
+        help='Trips a route needs for its own column; rarer routes share a pickup-zone bucket (default: features.min_route_frequency)'
+    )
+    parser.add_argument(
+        '--compress-rows',
+        action='store_true',
+        help='Train on unique feature rows weighted by their trip count (default: features.compression.enabled in config)'
+    )
+    parser.add_argument(
+        '--distance-resolution',
+        type=float,
+        default=None,
+        help='Round trip_distance to this step (miles) before compressing (default: features.compression.distance_resolution)'
+    )
     args = parser.parse_args()
 
     try:
@@ -549,7 +1318,15 @@ if __name__ == "__main__":
         result = taxi_duration_yaml_pipeline(
             year=args.year,
             month=args.month,
-            config_path=args.config
+            config_path=args.config,
+            offline=args.offline,
+            train_months=args.train_months,
+            external_memory=args.external_memory,
+            incremental=args.incremental,
+            parent_run_id=args.parent_run_id,
+            row_compression=args.compress_rows,
+            distance_resolution=args.distance_resolution,
+            min_route_frequency=args.min_route_frequency
         )
         
         print("\n" + "="*70)
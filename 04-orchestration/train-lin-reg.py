@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Train the serving linear regression (lin_reg.bin) over many months.
+
+Instead of fitting LinearRegression on one month in memory, every parquet row
+group is read chunk by chunk in a worker process that only accumulates the
+sufficient statistics of the fit (taxi_common.linear); the partial statistics
+are summed and solved once. The output is the same (dv, model) tuple that
+web-service/predict.py and batch_predictor.load_model load.
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from taxi_common.data_store import DatasetStore
+from taxi_common.linear import SufficientStats
+from taxi_common.periods import format_period, month_range
+from taxi_common.streaming import DEFAULT_MEMORY_BUDGET_MB, iter_feature_chunks, iter_trip_chunks, num_row_groups
+from taxi_common.vectorizers import OTHER_ROUTE, columnar_feature_counts, select_feature_names, vectorizer_from_names
+
+DATA_URL_PATTERN = 'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
+
+CATEGORICAL = ['PULocationID', 'DOLocationID']
+NUMERICAL = ['trip_distance']
+FEATURES = ['PU_DO', 'trip_distance']
+
+
+def read_chunks(path, row_group, memory_budget_mb):
+    """Prepared trips of one row group, in chunks of at most the memory budget."""
+    return iter_trip_chunks(
+        path,
+        categorical=CATEGORICAL,
+        numerical=NUMERICAL,
+        min_duration=1,
+        max_duration=60,
+        memory_budget_mb=memory_budget_mb,
+        row_groups=[row_group]
+    )
+
+
+def row_group_counts(path, row_group, memory_budget_mb):
+    """Trips per feature name in one row group (summed across row groups to build the vocabulary)."""
+    return columnar_feature_counts(read_chunks(path, row_group, memory_budget_mb), FEATURES)
+
+
+def row_group_stats(path, row_group, dv, memory_budget_mb):
+    """Sufficient statistics of one row group over the full vocabulary."""
+    stats = SufficientStats(len(dv.feature_names_))
+    for X, y in iter_feature_chunks(read_chunks(path, row_group, memory_budget_mb), dv, FEATURES):
+        stats.update(X, y)
+    return stats
+
+
+def train(periods, store=None, workers=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, min_route_frequency=1):
+    """
+    Fits the linear model on every trip of the given months.
+
+    Two passes over the row groups, both spread over a process pool: the first
+    counts the feature values and builds the vocabulary (sorted like
+    DictVectorizer.fit; routes with fewer than min_route_frequency trips in
+    the whole range share a pickup-zone bucket), the second accumulates X'X,
+    X'y and the sums, which are merged as workers finish.
+
+    Returns:
+        Tuple (dv, model, stats)
+    """
+    if store is None:
+        store = DatasetStore.from_env()
+    paths = [store.fetch(year, month, DATA_URL_PATTERN) for year, month in periods]
+    tasks = [(path, row_group) for path in paths for row_group in range(num_row_groups(path))]
+    print(f"Training on {format_period(periods)}: {len(tasks)} row groups")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        counts = Counter()
+        for counts_part in executor.map(row_group_counts, *zip(*tasks), [memory_budget_mb] * len(tasks)):
+            counts.update(counts_part)
+        dv = vectorizer_from_names(select_feature_names(counts, min_route_frequency))
+        buckets = sum(name.endswith(f"_{OTHER_ROUTE}") for name in dv.feature_names_)
+        print(f"Vocabulary: {len(dv.feature_names_)} features ({buckets} pickup-zone buckets)")
+
+        stats = SufficientStats(len(dv.feature_names_))
+        pending = {
+            executor.submit(row_group_stats, path, row_group, dv, memory_budget_mb) for path, row_group in tasks
+        }
+        for future in as_completed(pending):
+            # Merged as they arrive; dropping the future frees its partial result
+            # (as_completed releases the futures it has yielded)
+            stats.merge(future.result())
+            pending.discard(future)
+            del future
+
+    model = stats.solve()
+    return dv, model, stats
+
+
+def save_model(dv, model, output):
+    """Pickles (dv, model) atomically, so a service never reads a half-written file."""
+    output = Path(output)
+    fd, tmp_name = tempfile.mkstemp(dir=output.parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f_out:
+        pickle.dump((dv, model), f_out)
+    os.replace(tmp_name, output)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Train the lin_reg.bin linear model over a range of months.')
+    parser.add_argument('--year', type=int, required=True, help='Year of the first month to train on')
+    parser.add_argument('--month', type=int, required=True, help='First month to train on')
+    parser.add_argument('--end-year', type=int, help='Year of the last month (default: --year)')
+    parser.add_argument('--end-month', type=int, help='Last month to train on (default: --month)')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--memory-budget-mb', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f'Memory budget per chunk in each worker (default: {DEFAULT_MEMORY_BUDGET_MB})')
+    parser.add_argument('--min-route-frequency', type=int, default=1,
+                        help='Trips a route needs for its own column; rarer routes share a pickup-zone bucket (default: 1)')
+    parser.add_argument('--cache-dir', type=str, help='Local data cache directory (default: $TAXI_DATA_CACHE_DIR or ~/.cache/nyc-taxi)')
+    parser.add_argument('--offline', action='store_true', help='Only use cached data; fail instead of downloading')
+    parser.add_argument('--output', type=str, default='lin_reg.bin', help='Output file (default: lin_reg.bin)')
+    args = parser.parse_args()
+
+    periods = month_range(
+        (args.year, args.month),
+        (args.end_year or args.year, args.end_month or args.month)
+    )
+    store = DatasetStore.from_env(cache_dir=args.cache_dir, offline=args.offline or None)
+    dv, model, stats = train(
+        periods, store=store, workers=args.workers, memory_budget_mb=args.memory_budget_mb,
+        min_route_frequency=args.min_route_frequency
+    )
+    save_model(dv, model, args.output)
+    print(f"Trained on {stats.n:,} trips, train RMSE {stats.rmse(model):.4f}")
+    print(f"Saved (dv, model) to {args.output}")
+
+# Para reentrenar el modelo del web service con un año completo:
+# uv run python train-lin-reg.py --year 2023 --month 1 --end-year 2023 --end-month 12
+# y copiar lin_reg.bin a 06-deployment/deploy/web-service/
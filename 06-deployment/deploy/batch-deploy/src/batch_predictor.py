@@ -1,6 +1,7 @@
 """Predictor simple para batch processing"""
 
 import pickle
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import sys
@@ -8,27 +9,40 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config.settings as settings
 
+# Filas por llamada a model.predict: con X en float32 y coeficientes en float64
+# scipy convierte la matriz entera a float64; por bloques la copia queda acotada
+PREDICT_CHUNK_ROWS = 100_000
+
 def load_model():
     """Carga el modelo ML"""
     print("🤖 Cargando modelo...")
     try:
         with open(settings.MODEL_PATH, 'rb') as f:
             dv, model = pickle.load(f)
+        if hasattr(dv, 'dtype'):
+            # Matriz float32 (índices int32) como en entrenamiento; los lin_reg.bin viejos traen float64
+            dv.dtype = np.float32
         print("✅ Modelo cargado correctamente")
         return dv, model
     except FileNotFoundError:
         print(f"❌ No se encontró el modelo en: {settings.MODEL_PATH}")
         raise
 
-def prepare_features(df):
+def prepare_features(df, dv):
     """Prepara las features para predicción"""
     print(f"🔧 Preparando features para {len(df)} viajes...")
     
     # Crear feature PU_DO (igual que en web service)
+    # Un preprocessor route_stats no tiene vocabulario: su lookup ya usa la zona de pickup
+    vocabulary = getattr(dv, 'vocabulary_', None)
     features = []
     for _, row in df.iterrows():
+        route = f"{row['PULocationID']}_{row['DOLocationID']}"
+        if vocabulary is not None and f"PU_DO={route}" not in vocabulary:
+            # Ruta rara o nueva: bucket de su zona de pickup (modelos con min_route_frequency)
+            route = f"{row['PULocationID']}_other"
         feature = {
-            'PU_DO': f"{row['PULocationID']}_{row['DOLocationID']}",
+            'PU_DO': route,
             'trip_distance': row['trip_distance']
         }
         features.append(feature)
@@ -44,7 +58,10 @@ def make_predictions(features, dv, model):
     
     # Transformar features y predecir
     X = dv.transform(features)
-    predictions = model.predict(X)
+    predictions = np.concatenate([
+        model.predict(X[start:start + PREDICT_CHUNK_ROWS])
+        for start in range(0, X.shape[0], PREDICT_CHUNK_ROWS)
+    ])
     
     end_time = datetime.now()
     processing_time = (end_time - start_time).total_seconds()
@@ -91,7 +108,7 @@ def process_batch_file(input_file):
     print(f"📊 Cargados {len(df)} viajes")
     
     # 3. Preparar features
-    features = prepare_features(df)
+    features = prepare_features(df, dv)
     
     # 4. Hacer predicciones
     predictions = make_predictions(features, dv, model)
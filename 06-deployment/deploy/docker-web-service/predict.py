@@ -18,6 +18,10 @@ def prepare_features(ride):
     """
     features = {}
     features['PU_DO'] = '%s_%s' % (ride['PULocationID'], ride['DOLocationID'])
+    # Un preprocessor route_stats no tiene vocabulario: su lookup ya usa la zona de pickup
+    if hasattr(dv, 'vocabulary_') and 'PU_DO=' + features['PU_DO'] not in dv.vocabulary_:
+        # Ruta rara o nueva: bucket de su zona de pickup (modelos con min_route_frequency)
+        features['PU_DO'] = '%s_other' % ride['PULocationID']
     features['trip_distance'] = ride['trip_distance']
     return features
 
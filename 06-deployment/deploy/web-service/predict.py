@@ -41,7 +41,10 @@ def prepare_features(ride):
     
     Returns:
         dict: Dictionary with processed features:
-            - PU_DO (str): Pickup-dropoff combination as string
+            - PU_DO (str): Pickup-dropoff combination as string, or the
+              pickup zone bucket ('161_other') for routes without their own
+              column in the DictVectorizer (kept as is for a route_stats
+              preprocessor)
             - trip_distance (float): Trip distance
     
     Example:
@@ -56,6 +59,13 @@ def prepare_features(ride):
     """
     features = {}
     features['PU_DO'] = '%s_%s' % (ride['PULocationID'], ride['DOLocationID'])
+    # A route_stats preprocessor (taxi_common.route_stats) has no vocabulary:
+    # its transform looks the route up in a dense table and already falls
+    # back to the pickup zone's statistics for unseen routes
+    if hasattr(dv, 'vocabulary_') and 'PU_DO=' + features['PU_DO'] not in dv.vocabulary_:
+        # Rare or unseen route: models trained with min_route_frequency have a
+        # bucket per pickup zone (older vocabularies ignore it, as before)
+        features['PU_DO'] = '%s_other' % ride['PULocationID']
     features['trip_distance'] = ride['trip_distance']
     logger.info(f"✅ Features prepared: PU_DO={features['PU_DO']}, distance={features['trip_distance']}")
     return features
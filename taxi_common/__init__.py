@@ -0,0 +1 @@
+# Shared helpers for the NYC taxi duration prediction pipelines
@@ -0,0 +1,223 @@
+"""Cache local de archivos mensuales de viajes (parquet)
+
+Los archivos se guardan por contenido (`objects/<sha256>.parquet`) y una llave
+por `(year, month, data_url_pattern)` apunta al contenido (`keys/<hash>.json`).
+No hay un índice compartido: cada escritura es atómica (archivo temporal +
+`os.replace`), así varios procesos pueden usar el mismo directorio a la vez.
+
+Configuración por variables de entorno:
+    TAXI_DATA_CACHE_DIR: directorio del cache (default ~/.cache/nyc-taxi)
+    TAXI_DATA_CACHE_MAX_GB: tamaño máximo antes de expulsar (default 5)
+    TAXI_DATA_OFFLINE: si es "1", nunca se descarga; un miss falla de inmediato
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "nyc-taxi"
+DEFAULT_MAX_SIZE_GB = 5.0
+CHUNK_SIZE = 1 << 20
+
+
+class CacheMissError(RuntimeError):
+    """El archivo no está en el cache y el modo offline impide descargarlo"""
+
+
+def file_sha256(path):
+    """Calcula el sha256 de un archivo leyendo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _env_flag(name):
+    return os.getenv(name, "").strip().lower() in ("1", "true", "yes")
+
+
+class DatasetStore:
+    """
+    Cache local de datasets mensuales con validación de checksum y expulsión LRU.
+
+    Args:
+        cache_dir: Directorio donde se guardan los archivos
+        max_size_gb: Tamaño máximo del cache; se expulsan los menos usados
+        offline: Si True, un miss lanza CacheMissError en vez de descargar
+        verify: Si True, valida el checksum en cada lectura
+    """
+
+    def __init__(self, cache_dir=None, max_size_gb=DEFAULT_MAX_SIZE_GB, offline=False, verify=True):
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR).expanduser()
+        self.max_bytes = int(max_size_gb * 1024 ** 3)
+        self.offline = offline
+        self.verify = verify
+        self.objects_dir = self.cache_dir / "objects"
+        self.keys_dir = self.cache_dir / "keys"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.keys_dir.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, cache_dir=None, max_size_gb=None, offline=None):
+        """Crea el store usando variables de entorno para lo que no se pase explícito."""
+        if cache_dir is None:
+            cache_dir = os.getenv("TAXI_DATA_CACHE_DIR", str(DEFAULT_CACHE_DIR))
+        if max_size_gb is None:
+            max_size_gb = float(os.getenv("TAXI_DATA_CACHE_MAX_GB", DEFAULT_MAX_SIZE_GB))
+        if offline is None:
+            offline = _env_flag("TAXI_DATA_OFFLINE")
+        return cls(cache_dir=cache_dir, max_size_gb=max_size_gb, offline=offline)
+
+    def _key_path(self, year, month, data_url_pattern):
+        key = f"{data_url_pattern}|{year}|{month:02d}"
+        return self.keys_dir / f"{hashlib.sha256(key.encode()).hexdigest()[:24]}.json"
+
+    def _object_path(self, sha256):
+        return self.objects_dir / f"{sha256}.parquet"
+
+    def lookup(self, year, month, data_url_pattern):
+        """
+        Busca un mes en el cache sin descargar.
+
+        Returns:
+            Path al archivo local, o None si no está (o el checksum no coincide)
+        """
+        key_path = self._key_path(year, month, data_url_pattern)
+        try:
+            entry = json.loads(key_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        path = self._object_path(entry["sha256"])
+        try:
+            if self.verify and file_sha256(path) != entry["sha256"]:
+                logger.warning(f"Checksum mismatch for {path}, discarding cached copy")
+                path.unlink(missing_ok=True)
+                return None
+            # Actualizar mtime: es el reloj del LRU
+            os.utime(path)
+        except FileNotFoundError:
+            # Expulsado (posiblemente por otro proceso)
+            return None
+        return path
+
+    def checksum(self, year, month, data_url_pattern):
+        """
+        sha256 del mes guardado, sin leer el archivo (para llaves de cache).
+
+        Returns:
+            sha256 en hexadecimal, o None si el mes no está (o fue expulsado)
+        """
+        try:
+            sha256 = json.loads(self._key_path(year, month, data_url_pattern).read_text())["sha256"]
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return sha256 if self._object_path(sha256).exists() else None
+
+    def add_file(self, year, month, data_url_pattern, source_path):
+        """
+        Copia un archivo local al cache (útil para sembrar el cache en CI).
+
+        Returns:
+            Path al archivo dentro del cache
+        """
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f_out, open(source_path, "rb") as f_in:
+            shutil.copyfileobj(f_in, f_out, CHUNK_SIZE)
+        return self._commit(year, month, data_url_pattern, Path(tmp_name))
+
+    def fetch(self, year, month, data_url_pattern):
+        """
+        Retorna la ruta local de un mes, descargándolo solo si no está en cache.
+
+        Args:
+            year: Año de los datos
+            month: Mes de los datos
+            data_url_pattern: Patrón con `{year}` y `{month:02d}`
+
+        Returns:
+            Path al archivo parquet local
+        """
+        path = self.lookup(year, month, data_url_pattern)
+        if path is not None:
+            logger.info(f"Cache hit for {year}-{month:02d}: {path}")
+            return path
+
+        url = data_url_pattern.format(year=year, month=month)
+        if self.offline:
+            raise CacheMissError(f"{url} is not in the local cache ({self.cache_dir}) and offline mode is on")
+
+        logger.info(f"Cache miss for {year}-{month:02d}, downloading {url}")
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f_out, urllib.request.urlopen(url) as response:
+                shutil.copyfileobj(response, f_out, CHUNK_SIZE)
+        except Exception:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return self._commit(year, month, data_url_pattern, Path(tmp_name), url=url)
+
+    def _commit(self, year, month, data_url_pattern, tmp_path, url=None):
+        sha256 = file_sha256(tmp_path)
+        path = self._object_path(sha256)
+        os.replace(tmp_path, path)
+
+        entry = {
+            "url": url or data_url_pattern.format(year=year, month=month),
+            "year": year,
+            "month": month,
+            "sha256": sha256,
+            "size": path.stat().st_size,
+            "stored_at": time.time(),
+        }
+        key_path = self._key_path(year, month, data_url_pattern)
+        fd, tmp_key = tempfile.mkstemp(dir=self.keys_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f_out:
+            json.dump(entry, f_out)
+        os.replace(tmp_key, key_path)
+
+        self.evict(keep=path)
+        return path
+
+    def _objects(self):
+        """Lista (mtime, size, path) de los archivos del cache, del menos al más reciente."""
+        objects = []
+        for path in self.objects_dir.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path))
+        return sorted(objects)
+
+    def size_bytes(self):
+        """Tamaño total de los archivos en el cache."""
+        return sum(size for _, size, _ in self._objects())
+
+    def evict(self, keep=None):
+        """
+        Expulsa los archivos usados hace más tiempo hasta quedar bajo `max_bytes`.
+
+        Args:
+            keep: Path que nunca se expulsa (el archivo recién agregado)
+        """
+        objects = self._objects()
+        total = sum(size for _, size, _ in objects)
+
+        for _, size, path in objects:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info(f"Evicted {path.name} from data cache")
@@ -0,0 +1,240 @@
+"""Cache local de matrices de features, direccionado por contenido
+
+Cada entrada guarda `(X, y, vectorizador)` de un paso de feature engineering
+en el formato de `matrix_store`, bajo un directorio cuyo nombre es el hash de
+todo lo que determina el resultado:
+
+- la huella de los datos de entrada (sha256 del parquet o del DataFrame),
+- la configuración de features (columnas, filtro de duración, ...),
+- el vectorizador recibido (`fit` nuevo, vocabulario de train o hasher).
+
+Cambiar solo hiperparámetros del modelo no cambia la llave, así que la
+siguiente ejecución carga las matrices en vez de recalcularlas. Igual que en
+`DatasetStore`, cada entrada se escribe en un directorio temporal y se publica
+con un rename atómico, y las menos usadas se expulsan al superar el tamaño.
+
+Configuración por variables de entorno:
+    TAXI_FEATURE_CACHE_DIR: directorio del cache (default `$TAXI_DATA_CACHE_DIR/features`)
+    TAXI_FEATURE_CACHE_MAX_GB: tamaño máximo antes de expulsar (default 5)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction import FeatureHasher
+
+from taxi_common.data_store import DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE_GB, file_sha256
+from taxi_common.matrix_store import load_array, load_vectorizer, save_dataset
+from taxi_common.route_stats import RouteStatsIndex
+
+logger = logging.getLogger(__name__)
+
+# Los objetos de DatasetStore ya se llaman por su sha256
+SHA256_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+# Cambiarlo invalida todas las entradas (por ejemplo si cambia el feature engineering)
+CACHE_VERSION = 2  # 2: matrices float32
+
+
+def data_fingerprint(path):
+    """
+    Huella del contenido de un archivo de datos.
+
+    Para los archivos de `DatasetStore` (`objects/<sha256>.parquet`) se usa el
+    nombre, que ya es el checksum validado; para cualquier otro se calcula.
+    """
+    path = Path(path)
+    if SHA256_NAME.match(path.stem):
+        return path.stem
+    return file_sha256(path)
+
+
+def array_fingerprint(array):
+    """
+    Huella del contenido de un array de numpy o de una matriz dispersa.
+
+    Returns:
+        sha256 en hexadecimal (incluye dtype y forma)
+    """
+    if sp.issparse(array):
+        X = array.tocsr()
+        digest = hashlib.sha256(f"csr|{X.shape}".encode())
+        for component in (X.data, X.indices, X.indptr):
+            digest.update(array_fingerprint(component).encode())
+        return digest.hexdigest()
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(f"{array.dtype}|{array.shape}".encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def frame_fingerprint(df, columns=None):
+    """
+    Huella del contenido de un DataFrame (para pasos que no conocen el archivo).
+
+    Args:
+        df: DataFrame preparado
+        columns: Columnas que participan en la huella (por defecto todas)
+
+    Returns:
+        sha256 en hexadecimal
+    """
+    if columns is not None:
+        df = df[columns]
+    digest = hashlib.sha256(",".join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def vectorizer_fingerprint(dv):
+    """
+    Identifica el vectorizador que recibe el paso de features.
+
+    Returns:
+        'fit' si no hay vectorizador, 'hashing:<n>' para un FeatureHasher,
+        'route_stats:<sha256>' para un RouteStatsIndex o el sha256 del
+        vocabulario de un DictVectorizer ajustado
+    """
+    if dv is None:
+        return "fit"
+    if isinstance(dv, FeatureHasher):
+        return f"hashing:{dv.n_features}"
+    if isinstance(dv, RouteStatsIndex):
+        return f"route_stats:{dv.fingerprint()}"
+    return hashlib.sha256("\n".join(dv.feature_names_).encode()).hexdigest()
+
+
+class FeatureCache:
+    """
+    Cache de matrices de features con expulsión LRU por tamaño.
+
+    Args:
+        cache_dir: Directorio donde se guardan las entradas
+        max_size_gb: Tamaño máximo del cache; se expulsan las menos usadas
+    """
+
+    def __init__(self, cache_dir=None, max_size_gb=DEFAULT_MAX_SIZE_GB):
+        self.cache_dir = Path(cache_dir or DEFAULT_CACHE_DIR / "features").expanduser()
+        self.max_bytes = int(max_size_gb * 1024 ** 3)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, cache_dir=None, max_size_gb=None):
+        """Crea el cache usando variables de entorno para lo que no se pase explícito."""
+        if cache_dir is None:
+            data_dir = os.getenv("TAXI_DATA_CACHE_DIR", str(DEFAULT_CACHE_DIR))
+            cache_dir = os.getenv("TAXI_FEATURE_CACHE_DIR", os.path.join(data_dir, "features"))
+        if max_size_gb is None:
+            max_size_gb = float(os.getenv("TAXI_FEATURE_CACHE_MAX_GB", DEFAULT_MAX_SIZE_GB))
+        return cls(cache_dir=cache_dir, max_size_gb=max_size_gb)
+
+    @staticmethod
+    def key(data, dv=None, **config):
+        """
+        Llave de una entrada.
+
+        Args:
+            data: Huellas de los datos de entrada (una por mes)
+            dv: Vectorizador recibido por el paso de features (None = fit)
+            **config: Campos de configuración que afectan las features
+
+        Returns:
+            sha256 en hexadecimal
+        """
+        content = {
+            "version": CACHE_VERSION,
+            "data": list(data),
+            "vectorizer": vectorizer_fingerprint(dv),
+            "config": config,
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def __contains__(self, key):
+        return (self.cache_dir / key).is_dir()
+
+    def load(self, key):
+        """
+        Abre una entrada del cache.
+
+        Returns:
+            Tupla (X, y, dv) con las matrices en memory-map, o None si no está
+        """
+        entry = self.cache_dir / key
+        try:
+            # Actualizar mtime: es el reloj del LRU
+            os.utime(entry)
+            X = load_array(entry, "X")
+            y = load_array(entry, "y")
+            dv = load_vectorizer(entry)
+        except (FileNotFoundError, KeyError, json.JSONDecodeError):
+            # No está, o fue expulsada (posiblemente por otro proceso)
+            return None
+        logger.info(f"Feature cache hit: {key[:12]}")
+        return X, y, dv
+
+    def store(self, key, X, y, dv):
+        """
+        Guarda `(X, y, dv)` bajo `key` y expulsa entradas si hace falta.
+
+        Returns:
+            Path al directorio de la entrada
+        """
+        entry = self.cache_dir / key
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.cache_dir, suffix=".tmp"))
+        try:
+            save_dataset(tmp_dir, dv, X=X, y=y)
+            os.replace(tmp_dir, entry)
+        except OSError:
+            # Otro proceso ya publicó la misma entrada: el contenido es idéntico
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not entry.exists():
+                raise
+        logger.info(f"Stored features in cache: {key[:12]}")
+
+        self.evict(keep=entry)
+        return entry
+
+    def _entries(self):
+        """Lista (mtime, size, path) de las entradas, de la menos a la más reciente."""
+        entries = []
+        for path in self.cache_dir.iterdir():
+            if not path.is_dir() or path.suffix == ".tmp":
+                continue
+            try:
+                size = sum(f.stat().st_size for f in path.iterdir())
+                entries.append((path.stat().st_mtime, size, path))
+            except FileNotFoundError:
+                continue
+        return sorted(entries)
+
+    def size_bytes(self):
+        """Tamaño total de las entradas en el cache."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=None):
+        """
+        Expulsa las entradas usadas hace más tiempo hasta quedar bajo `max_bytes`.
+
+        Args:
+            keep: Entrada que nunca se expulsa (la recién guardada)
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted {path.name[:12]} from feature cache")
@@ -0,0 +1,183 @@
+"""Feature engineering vectorizado para los pipelines de duración de taxis NYC
+
+Todas las operaciones trabajan sobre columnas completas (sin `.apply` ni
+concatenación de strings fila por fila), así el costo crece con el número de
+rutas únicas y no con el número de viajes.
+
+Los DataFrames usan tipos compactos: IDs de zona como enteros pequeños (int16),
+`PU_DO` como categórica y las columnas numéricas en float32. Solo el paso final
+de vectorización (`feature_frame`) los convierte en features para el
+DictVectorizer.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_float_dtype, is_integer_dtype
+
+# Los datasets green y yellow usan prefijos distintos para los timestamps
+PICKUP_COLUMNS = ('lpep_pickup_datetime', 'tpep_pickup_datetime')
+DROPOFF_COLUMNS = ('lpep_dropoff_datetime', 'tpep_dropoff_datetime')
+LOCATION_COLUMNS = ['PULocationID', 'DOLocationID']
+NUMERICAL_COLUMNS = ['trip_distance']
+
+# Las zonas de NYC van de 1 a 265, así que PU * 1000 + DO identifica la ruta
+ROUTE_BASE = 1000
+
+
+def find_column(columns, candidates):
+    """
+    Busca la primera columna disponible entre varios nombres posibles.
+
+    Args:
+        columns: Columnas disponibles (DataFrame.columns o lista)
+        candidates: Nombres aceptados, en orden de preferencia
+
+    Returns:
+        Nombre de la columna encontrada
+    """
+    for column in candidates:
+        if column in columns:
+            return column
+    raise ValueError(f"Missing required columns: one of {list(candidates)}")
+
+
+def compute_duration(df):
+    """
+    Calcula la duración del viaje en minutos.
+
+    Args:
+        df: DataFrame con los timestamps de pickup y dropoff
+
+    Returns:
+        Series float32 con la duración en minutos
+    """
+    pickup = find_column(df.columns, PICKUP_COLUMNS)
+    dropoff = find_column(df.columns, DROPOFF_COLUMNS)
+    return ((df[dropoff] - df[pickup]).dt.total_seconds() / 60).astype(np.float32)
+
+
+def filter_duration(df, min_duration=1, max_duration=60):
+    """
+    Elimina los viajes fuera del rango de duración permitido.
+
+    Args:
+        df: DataFrame con la columna `duration`
+        min_duration: Duración mínima en minutos (inclusive)
+        max_duration: Duración máxima en minutos (inclusive)
+
+    Returns:
+        DataFrame filtrado
+    """
+    mask = (df['duration'] >= min_duration) & (df['duration'] <= max_duration)
+    return df[mask]
+
+
+def build_route_key(pickup, dropoff):
+    """
+    Construye la llave de ruta `PU_DO` (por ejemplo '161_236').
+
+    Los pares se factorizan como enteros y solo se formatean las rutas únicas;
+    cada fila guarda únicamente el código (entero pequeño) de su ruta.
+
+    Args:
+        pickup: Series o array con PULocationID
+        dropoff: Series o array con DOLocationID
+
+    Returns:
+        Categorical con la ruta de cada viaje
+    """
+    pickup = np.asarray(pickup).astype(np.int64)
+    dropoff = np.asarray(dropoff).astype(np.int64)
+
+    codes, uniques = pd.factorize(pickup * ROUTE_BASE + dropoff)
+    labels = [f"{code // ROUTE_BASE}_{code % ROUTE_BASE}" for code in uniques]
+    return pd.Categorical.from_codes(codes, categories=labels)
+
+
+def compact_columns(df, categorical=None, numerical=None):
+    """
+    Convierte las columnas de features a tipos compactos.
+
+    Las categóricas enteras (IDs de zona) se reducen al entero más pequeño que
+    las contiene (int16 para zonas); las demás se vuelven `category`. Las
+    numéricas pasan a float32.
+
+    Args:
+        df: DataFrame a modificar
+        categorical: Columnas categóricas
+        numerical: Columnas numéricas
+
+    Returns:
+        El mismo DataFrame con los tipos compactos
+    """
+    for column in categorical or []:
+        if is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast='integer')
+        else:
+            df[column] = df[column].astype('category')
+    for column in numerical or []:
+        df[column] = df[column].astype(np.float32)
+    return df
+
+
+def feature_frame(df, features):
+    """
+    Prepara las columnas de features para el DictVectorizer.
+
+    Las columnas float son numéricas; el resto (IDs enteros, `PU_DO`) son
+    categóricas y se pasan como categorías con nombre string, de modo que el
+    vocabulario es el mismo de siempre ('PULocationID=161', 'PU_DO=161_236').
+    Los strings se crean una vez por categoría, no una vez por fila.
+
+    Args:
+        df: DataFrame con tipos compactos
+        features: Columnas que forman cada dict de features
+
+    Returns:
+        DataFrame con solo las columnas de features
+    """
+    columns = {}
+    for column in features:
+        values = df[column]
+        if not is_float_dtype(values):
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('category')
+            values = values.cat.rename_categories(str)
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def prepare_trips(df, min_duration=1, max_duration=60, categorical=None, numerical=None, route_key=True):
+    """
+    Aplica el feature engineering común a todos los pipelines.
+
+    Calcula la duración, filtra outliers, construye `PU_DO` y deja las
+    columnas de features en tipos compactos.
+
+    Args:
+        df: DataFrame crudo de viajes
+        min_duration: Duración mínima en minutos
+        max_duration: Duración máxima en minutos
+        categorical: Columnas categóricas (por defecto PULocationID y DOLocationID)
+        numerical: Columnas numéricas (por defecto trip_distance)
+        route_key: Si True, agrega la columna `PU_DO`
+
+    Returns:
+        DataFrame filtrado, sin timestamps, con `duration` y (opcionalmente) `PU_DO`
+    """
+    if categorical is None:
+        categorical = LOCATION_COLUMNS
+    if numerical is None:
+        numerical = NUMERICAL_COLUMNS
+
+    df['duration'] = compute_duration(df)
+    df = filter_duration(df, min_duration, max_duration)
+
+    # Los timestamps solo se usan para calcular la duración
+    timestamps = [c for c in (*PICKUP_COLUMNS, *DROPOFF_COLUMNS) if c in df.columns]
+    df = df.drop(columns=timestamps)
+
+    if route_key:
+        df['PU_DO'] = build_route_key(df['PULocationID'], df['DOLocationID'])
+
+    return compact_columns(df, categorical, numerical)
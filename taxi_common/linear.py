@@ -0,0 +1,132 @@
+"""Regresión lineal por estadísticos suficientes
+
+Para mínimos cuadrados basta con acumular, sobre todas las filas, `n`, `Σx`,
+`Σy`, `Σy²`, `XᵀX` y `Xᵀy`. Cada chunk aporta su parte y las partes se suman,
+así que un año de viajes se recorre con memoria acotada y los chunks se pueden
+procesar en paralelo y en cualquier orden. Con la feature one-hot `PU_DO`,
+`XᵀX` es dispersa: la diagonal con el conteo de cada ruta más la fila y la
+columna de `trip_distance`.
+
+`solve` resuelve las ecuaciones normales centradas (el intercepto sale de las
+medias) con MINRES, que converge a la solución de mínimos cuadrados de norma
+mínima aunque `XᵀX` sea singular, que lo es siempre con one-hot más
+intercepto. Es la misma solución que busca `LinearRegression` de sklearn sobre
+una matriz dispersa (LSQR sobre X centrada), pero sin tener X en memoria.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import LinearOperator, minres
+from sklearn.linear_model import LinearRegression
+
+DEFAULT_RTOL = 1e-12
+
+
+class SufficientStats:
+    """
+    Estadísticos suficientes de una regresión lineal con intercepto.
+
+    Args:
+        n_features: Columnas de la matriz de features (largo del vocabulario)
+    """
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+        self.n = 0
+        self.sum_x = np.zeros(n_features)
+        self.sum_y = 0.0
+        self.sum_y2 = 0.0
+        self.xtx = sp.csr_matrix((n_features, n_features))
+        self.xty = np.zeros(n_features)
+
+    def update(self, X, y):
+        """
+        Suma el aporte de un chunk.
+
+        Args:
+            X: Matriz de features del chunk (CSR)
+            y: Target del chunk
+
+        Returns:
+            self, para encadenar
+        """
+        X = sp.csr_matrix(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"Chunk has {X.shape[1]} features, expected {self.n_features}")
+        self.n += X.shape[0]
+        self.sum_x += np.asarray(X.sum(axis=0)).ravel()
+        self.sum_y += float(y.sum())
+        self.sum_y2 += float(y @ y)
+        self.xtx = (self.xtx + X.T @ X).tocsr()
+        self.xty += X.T @ y
+        return self
+
+    def merge(self, other):
+        """
+        Suma los estadísticos de otra parte (por ejemplo de otro proceso).
+
+        Args:
+            other: SufficientStats con el mismo vocabulario
+
+        Returns:
+            self, para encadenar
+        """
+        if other.n_features != self.n_features:
+            raise ValueError(f"Cannot merge stats over {other.n_features} and {self.n_features} features")
+        self.n += other.n
+        self.sum_x += other.sum_x
+        self.sum_y += other.sum_y
+        self.sum_y2 += other.sum_y2
+        self.xtx = (self.xtx + other.xtx).tocsr()
+        self.xty += other.xty
+        return self
+
+    def solve(self, rtol=DEFAULT_RTOL, maxiter=None):
+        """
+        Ajusta la regresión a partir de los estadísticos acumulados.
+
+        Args:
+            rtol: Tolerancia relativa del residuo de MINRES
+            maxiter: Máximo de iteraciones (None = default de scipy)
+
+        Returns:
+            LinearRegression de sklearn con `coef_` e `intercept_`
+        """
+        if self.n == 0:
+            raise ValueError("No rows were accumulated")
+        mean_x = self.sum_x / self.n
+        mean_y = self.sum_y / self.n
+
+        # XcᵀXc = XᵀX - n·x̄x̄ᵀ, sin formar la corrección densa
+        gram = LinearOperator(
+            (self.n_features, self.n_features),
+            matvec=lambda v: self.xtx @ v - self.sum_x * (mean_x @ v),
+            dtype=np.float64
+        )
+        coef, info = minres(gram, self.xty - self.sum_x * mean_y, rtol=rtol, maxiter=maxiter)
+        if info > 0:
+            raise RuntimeError(f"MINRES did not converge in {info} iterations")
+
+        model = LinearRegression()
+        model.coef_ = coef
+        model.intercept_ = float(mean_y - mean_x @ coef)
+        model.n_features_in_ = self.n_features
+        return model
+
+    def rmse(self, model):
+        """
+        RMSE de entrenamiento de un modelo, calculado con los estadísticos.
+
+        Args:
+            model: LinearRegression sobre el mismo vocabulario
+
+        Returns:
+            RMSE sobre todas las filas acumuladas
+        """
+        w, c = model.coef_, model.intercept_
+        sse = (
+            w @ (self.xtx @ w) + 2 * c * (w @ self.sum_x) + self.n * c * c
+            - 2 * (w @ self.xty) - 2 * c * self.sum_y + self.sum_y2
+        )
+        return float(np.sqrt(max(sse, 0.0) / self.n))
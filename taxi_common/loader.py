@@ -0,0 +1,87 @@
+"""Lectura de archivos de viajes con proyección de columnas y filtro en el scan
+
+En lugar de `pd.read_parquet(path)` seguido de filtros en pandas, se leen solo
+las columnas necesarias y el filtro de duración se evalúa dentro del scan de
+Arrow, así los viajes descartados nunca llegan a pandas.
+"""
+
+import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from taxi_common.features import DROPOFF_COLUMNS, LOCATION_COLUMNS, PICKUP_COLUMNS, find_column
+
+
+def trip_columns(schema, categorical=None, numerical=None):
+    """
+    Lista de columnas a leer: timestamps, ubicaciones y features del config.
+
+    Args:
+        schema: Schema de Arrow del archivo
+        categorical: Features categóricas (ej. PULocationID, DOLocationID)
+        numerical: Features numéricas (ej. trip_distance)
+
+    Returns:
+        Lista de nombres de columnas sin duplicados
+    """
+    columns = [
+        find_column(schema.names, PICKUP_COLUMNS),
+        find_column(schema.names, DROPOFF_COLUMNS),
+        *LOCATION_COLUMNS,
+        *(categorical or []),
+        *(numerical or []),
+    ]
+    return list(dict.fromkeys(columns))
+
+
+def duration_filter(schema, min_duration=None, max_duration=None):
+    """
+    Construye la expresión de Arrow `min_duration <= dropoff - pickup <= max_duration`.
+
+    Args:
+        schema: Schema de Arrow del archivo
+        min_duration: Duración mínima en minutos (None = sin límite)
+        max_duration: Duración máxima en minutos (None = sin límite)
+
+    Returns:
+        Expresión de filtro, o None si no hay límites
+    """
+    pickup = find_column(schema.names, PICKUP_COLUMNS)
+    dropoff = find_column(schema.names, DROPOFF_COLUMNS)
+    unit = schema.field(pickup).type.unit
+    duration = pc.subtract(ds.field(dropoff), ds.field(pickup))
+
+    def minutes(value):
+        return pa.scalar(datetime.timedelta(minutes=value)).cast(pa.duration(unit))
+
+    expression = None
+    if min_duration is not None:
+        expression = duration >= minutes(min_duration)
+    if max_duration is not None:
+        upper = duration <= minutes(max_duration)
+        expression = upper if expression is None else expression & upper
+    return expression
+
+
+def read_trips(path, categorical=None, numerical=None, min_duration=None, max_duration=None):
+    """
+    Lee un archivo de viajes con solo las columnas necesarias y el filtro aplicado.
+
+    Args:
+        path: Ruta al archivo parquet
+        categorical: Features categóricas a leer
+        numerical: Features numéricas a leer
+        min_duration: Duración mínima en minutos
+        max_duration: Duración máxima en minutos
+
+    Returns:
+        DataFrame con las columnas proyectadas y los viajes filtrados
+    """
+    dataset = ds.dataset(str(path), format="parquet")
+    table = dataset.to_table(
+        columns=trip_columns(dataset.schema, categorical, numerical),
+        filter=duration_filter(dataset.schema, min_duration, max_duration)
+    )
+    return table.to_pandas()
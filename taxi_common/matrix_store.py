@@ -0,0 +1,271 @@
+"""Formato en disco de matrices preprocesadas, abribles con memory-map
+
+Cada matriz CSR se guarda como tres arrays `.npy` (`data`, `indices`,
+`indptr`) y los targets como un `.npy`. Las formas de las matrices van en
+`metadata.json` y el vocabulario del DictVectorizer (o el tamaño del
+FeatureHasher) en `vocabulary.json`. Un índice de `route_stats` va aparte en
+`route_stats.npz`. Las matrices densas se guardan como un solo `.npy`.
+
+Al cargar con `mmap_mode='r'` nada se copia a memoria al inicio: las páginas
+se leen bajo demanda y varios procesos que abren el mismo dataset comparten el
+page cache del sistema operativo en vez de tener cada uno su propia copia.
+
+Una matriz también puede escribirse chunk por chunk (`chunks=` de
+`save_dataset`): cada bloque de filas se agrega al final de sus `.npy`, con
+`indptr` desplazado por el nnz ya escrito, y la matriz completa nunca está en
+memoria.
+"""
+
+import json
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
+
+from taxi_common.route_stats import INDEX_FILENAME, RouteStatsIndex
+from taxi_common.vectorizers import FEATURE_DTYPE, hashing_vectorizer, index_dtype, output_width
+
+CSR_COMPONENTS = ('data', 'indices', 'indptr')
+METADATA_FILENAME = 'metadata.json'
+VOCABULARY_FILENAME = 'vocabulary.json'
+# Semilla con que se barajaron las filas de entrenamiento (ausente = orden original)
+SHUFFLE_SEED_KEY = 'train_shuffle_seed'
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, content):
+    with open(path, 'w') as f:
+        json.dump(content, f)
+
+
+def save_vectorizer(output_path, dv):
+    """Guarda el vocabulario de un DictVectorizer (o el tamaño de un FeatureHasher) como JSON."""
+    if isinstance(dv, FeatureHasher):
+        content = {'type': 'hashing', 'n_features': dv.n_features}
+    elif isinstance(dv, RouteStatsIndex):
+        dv.save(os.path.join(output_path, INDEX_FILENAME))
+        content = {'type': 'route_stats', 'feature_names': list(dv.feature_names_)}
+    else:
+        content = {
+            'feature_names': list(dv.feature_names_),
+            'separator': dv.separator,
+            'sparse': dv.sparse,
+        }
+    _write_json(os.path.join(output_path, VOCABULARY_FILENAME), content)
+
+
+def load_vectorizer(data_path):
+    """Reconstruye el vectorizador a partir de `vocabulary.json`."""
+    vocabulary = _read_json(os.path.join(data_path, VOCABULARY_FILENAME))
+    if vocabulary.get('type') == 'hashing':
+        return hashing_vectorizer(vocabulary['n_features'])
+    if vocabulary.get('type') == 'route_stats':
+        return RouteStatsIndex.load(os.path.join(data_path, INDEX_FILENAME))
+    dv = DictVectorizer(separator=vocabulary['separator'], sparse=vocabulary['sparse'], dtype=FEATURE_DTYPE)
+    dv.feature_names_ = vocabulary['feature_names']
+    dv.vocabulary_ = {name: i for i, name in enumerate(dv.feature_names_)}
+    return dv
+
+
+class _NpyAppender:
+    """Archivo `.npy` 1-D que crece agregando arrays al final."""
+
+    def __init__(self, path, dtype):
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self._file = open(path, 'wb')
+        # El header se reescribe al cerrar con el largo final; numpy lo
+        # rellena a 128 bytes para cualquier largo, así que no mueve los datos
+        self._write_header()
+        self._data_offset = self._file.tell()
+
+    def _write_header(self):
+        np.lib.format.write_array_header_1_0(self._file, {
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (self.length,),
+        })
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        self._file.write(values.data)
+        self.length += len(values)
+
+    def close(self):
+        self._file.seek(0)
+        self._write_header()
+        if self._file.tell() != self._data_offset:
+            raise RuntimeError(f"Header of {self._file.name} changed size while appending")
+        self._file.close()
+
+
+def save_chunks(output_path, x_name, y_name, chunks, n_features, max_nnz):
+    """
+    Guarda una matriz CSR y su target bloque por bloque, sin apilarlos en memoria.
+
+    Args:
+        output_path: Directorio de salida
+        x_name: Nombre de la matriz (ej. 'X_train')
+        y_name: Nombre del target (ej. 'y_train')
+        chunks: Iterable de tuplas (X_chunk, y_chunk) con X_chunk CSR
+        n_features: Columnas de la matriz
+        max_nnz: Cota superior del nnz total; fija el dtype de los índices
+            antes de ver los datos (ver `index_dtype`)
+
+    Returns:
+        Dict de metadata con las entradas de `x_name` y `y_name`
+    """
+    csr_index_dtype = index_dtype(max(max_nnz, n_features))
+    data, indices, indptr = (
+        _NpyAppender(os.path.join(output_path, f"{x_name}.{component}.npy"), dtype)
+        for component, dtype in zip(CSR_COMPONENTS, (FEATURE_DTYPE, csr_index_dtype, csr_index_dtype))
+    )
+    targets = None
+    indptr.append([0])
+
+    try:
+        for X_chunk, y_chunk in chunks:
+            X_chunk = sp.csr_matrix(X_chunk)
+            if targets is None:
+                targets = _NpyAppender(os.path.join(output_path, f"{y_name}.npy"), np.asarray(y_chunk).dtype)
+            offset = data.length
+            if offset + X_chunk.nnz > np.iinfo(csr_index_dtype).max:
+                raise ValueError(f"{x_name} has more than max_nnz={max_nnz:,} entries")
+            data.append(X_chunk.data)
+            indices.append(X_chunk.indices)
+            indptr.append(X_chunk.indptr[1:].astype(np.int64) + offset)
+            targets.append(y_chunk)
+    finally:
+        for appender in (data, indices, indptr, targets):
+            if appender is not None:
+                appender.close()
+
+    if targets is None:
+        raise ValueError(f"No rows to save for {x_name}")
+    return {
+        x_name: {'format': 'csr', 'shape': [indptr.length - 1, n_features]},
+        y_name: {'format': 'array'},
+    }
+
+
+def permuted_chunks(X, y, order, rows_per_chunk):
+    """
+    Filas de (X, y) en el orden `order`, por bloques de `rows_per_chunk`.
+
+    Con X e y abiertos con memory-map solo cada bloque se copia a memoria;
+    sirve para reescribir un dataset barajado con `save_chunks`.
+
+    Yields:
+        Tuplas (X_chunk, y_chunk)
+    """
+    for start in range(0, len(order), rows_per_chunk):
+        rows = order[start:start + rows_per_chunk]
+        yield X[rows], y[rows]
+
+
+def save_dataset(output_path, dv, chunks=None, shuffle_seed=None, **arrays):
+    """
+    Guarda matrices CSR, targets y vocabulario en formato memory-mappable.
+
+    Args:
+        output_path: Directorio de salida
+        dv: DictVectorizer ajustado, FeatureHasher o RouteStatsIndex
+        chunks: Matrices a escribir por bloques, sin tenerlas enteras en
+            memoria: {sufijo: (iterable de (X_chunk, y_chunk), cota del nnz)};
+            'train' se guarda como X_train e y_train (ver `save_chunks`)
+        shuffle_seed: Semilla con que ya se barajaron las filas de
+            entrenamiento, si se barajaron (ver `load_shuffle_seed`)
+        **arrays: Matrices CSR o arrays por nombre (ej. X_train=..., y_train=...)
+    """
+    os.makedirs(output_path, exist_ok=True)
+    metadata = {}
+
+    for suffix, (split_chunks, max_nnz) in (chunks or {}).items():
+        metadata.update(save_chunks(
+            output_path, f"X_{suffix}", f"y_{suffix}", split_chunks, output_width(dv), max_nnz
+        ))
+
+    for name, value in arrays.items():
+        if sp.issparse(value):
+            X = value.tocsr()
+            # scipy reduce los índices a int32 cuando caben; si se guardan en
+            # int64, cargarlos haría una copia y se perdería el memory-map
+            index_dtype = np.int32 if max(X.nnz, X.shape[1]) < np.iinfo(np.int32).max else np.int64
+            np.save(os.path.join(output_path, f"{name}.data.npy"), X.data)
+            np.save(os.path.join(output_path, f"{name}.indices.npy"), X.indices.astype(index_dtype, copy=False))
+            np.save(os.path.join(output_path, f"{name}.indptr.npy"), X.indptr.astype(index_dtype, copy=False))
+            metadata[name] = {'format': 'csr', 'shape': list(X.shape)}
+        else:
+            np.save(os.path.join(output_path, f"{name}.npy"), np.asarray(value))
+            metadata[name] = {'format': 'array'}
+
+    if shuffle_seed is not None:
+        metadata[SHUFFLE_SEED_KEY] = shuffle_seed
+    _write_json(os.path.join(output_path, METADATA_FILENAME), metadata)
+    save_vectorizer(output_path, dv)
+
+
+def load_array(data_path, name, mmap=True):
+    """
+    Abre un array o matriz CSR guardado con `save_dataset`.
+
+    Args:
+        data_path: Directorio del dataset
+        name: Nombre del array (ej. 'X_train')
+        mmap: Si True, abre los arrays con memory-map de solo lectura
+
+    Returns:
+        Matriz CSR o array de numpy respaldados por el archivo
+    """
+    mmap_mode = 'r' if mmap else None
+    entry = _read_json(os.path.join(data_path, METADATA_FILENAME))[name]
+
+    if entry['format'] != 'csr':
+        return np.load(os.path.join(data_path, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    data, indices, indptr = (
+        np.load(os.path.join(data_path, f"{name}.{component}.npy"), mmap_mode=mmap_mode)
+        for component in CSR_COMPONENTS
+    )
+    return sp.csr_matrix((data, indices, indptr), shape=tuple(entry['shape']), copy=False)
+
+
+def load_weights(data_path, mmap=True):
+    """
+    Abre los pesos de las filas de entrenamiento (`w_train`), si el dataset se
+    guardó con filas comprimidas.
+
+    Returns:
+        Array de pesos, o None si cada fila es un viaje
+    """
+    if 'w_train' not in _read_json(os.path.join(data_path, METADATA_FILENAME)):
+        return None
+    return load_array(data_path, 'w_train', mmap)
+
+
+def load_shuffle_seed(data_path):
+    """
+    Semilla con que se barajaron las filas de entrenamiento al guardarlas.
+
+    En un dataset barajado cualquier prefijo de filas es una muestra
+    aleatoria, que se puede tomar sin copiar (slices de los arrays).
+
+    Returns:
+        La semilla, o None si las filas están en su orden original
+    """
+    return _read_json(os.path.join(data_path, METADATA_FILENAME)).get(SHUFFLE_SEED_KEY)
+
+
+def load_dataset(data_path, mmap=True):
+    """
+    Abre los cuatro arrays de entrenamiento y validación.
+
+    Returns:
+        Tupla (X_train, y_train, X_val, y_val)
+    """
+    return tuple(load_array(data_path, name, mmap) for name in ('X_train', 'y_train', 'X_val', 'y_val'))
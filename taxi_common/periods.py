@@ -0,0 +1,60 @@
+"""Aritmética de periodos (año, mes) para ventanas de entrenamiento"""
+
+
+def add_months(year, month, delta):
+    """
+    Desplaza un periodo (año, mes) en `delta` meses.
+
+    Args:
+        year: Año
+        month: Mes (1-12)
+        delta: Meses a sumar (puede ser negativo)
+
+    Returns:
+        Tupla (year, month)
+    """
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def training_window(year, month, train_months=1):
+    """
+    Meses de entrenamiento que terminan en (year, month), del más antiguo al más reciente.
+
+    Args:
+        year: Año del último mes de entrenamiento
+        month: Último mes de entrenamiento
+        train_months: Tamaño de la ventana en meses
+
+    Returns:
+        Lista de tuplas (year, month)
+    """
+    if train_months < 1:
+        raise ValueError(f"train_months must be >= 1, got {train_months}")
+    return [add_months(year, month, -offset) for offset in range(train_months - 1, -1, -1)]
+
+
+def format_period(periods):
+    """Etiqueta legible de una lista de periodos, ej. '2023-01' o '2023-01..2023-03'."""
+    first, last = periods[0], periods[-1]
+    label = f"{first[0]}-{first[1]:02d}"
+    if len(periods) > 1:
+        label += f"..{last[0]}-{last[1]:02d}"
+    return label
+
+
+def month_range(start, end):
+    """
+    Meses de `start` a `end`, ambos incluidos.
+
+    Args:
+        start: Primer periodo (year, month)
+        end: Último periodo (year, month)
+
+    Returns:
+        Lista de tuplas (year, month)
+    """
+    count = (end[0] * 12 + end[1]) - (start[0] * 12 + start[1]) + 1
+    if count < 1:
+        raise ValueError(f"end {end} is before start {start}")
+    return [add_months(*start, offset) for offset in range(count)]
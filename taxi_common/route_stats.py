@@ -0,0 +1,467 @@
+"""Índice de estadísticas por ruta: features densas en vez del one-hot de PU_DO
+
+En modo `route_stats` cada viaje no se codifica con una columna por ruta sino
+con un puñado de columnas float32 que resumen su ruta y sus zonas en los datos
+de entrenamiento: duración media y mediana, velocidad media y cantidad de
+viajes de la ruta, y duración media de la zona de pickup y de la de dropoff.
+
+Los agregados se suavizan (m-estimate) hacia un nivel más general: la ruta
+hacia su zona de pickup y la zona hacia el promedio global, con `smoothing`
+viajes de peso. Una ruta con pocos viajes queda cerca de su zona y una ruta
+nueva toma directamente los valores de la zona.
+
+El ajuste solo acumula sumas por ruta y un histograma de duraciones (bins de
+un minuto, de donde sale la mediana), así que se puede hacer chunk por chunk y
+las partes se suman con `merge`. El índice se guarda como unos pocos arrays
+(`save` / `load`, un `.npz` chico) y al cargarlo se arma una tabla densa
+(pickup, dropoff) -> features: transformar un viaje es una indexación, de
+costo constante, sin diccionarios de vocabulario.
+
+Las filas de entrenamiento no se transforman con el índice completo: su propia
+duración estaría dentro del promedio de su ruta (fuga del target, grave en
+rutas con pocos viajes) y el modelo aprendería a copiarla. Se usan índices
+out-of-fold (`fit_route_stats` / `iter_out_of_fold`): cada fila toma las
+estadísticas de las otras `n_folds - 1` partes. Validación y serving usan el
+índice completo.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pandas.api.types import is_numeric_dtype
+
+# Zonas de NYC 1..265; el índice N_ZONES agrupa IDs desconocidos o nulos
+N_ZONES = 266
+TABLE_SIZE = N_ZONES + 1
+
+DURATION_BIN_MINUTES = 1.0
+N_DURATION_BINS = 180  # duraciones mayores caen en el último bin
+DEFAULT_SMOOTHING = 20.0
+DEFAULT_FOLDS = 5
+INDEX_FILENAME = 'route_stats.npz'
+
+# Columnas de cada estadístico por nivel (ruta, zona, global)
+STAT_NAMES = ('duration_mean', 'duration_median', 'speed_mph', 'trip_count')
+FEATURE_NAMES = [
+    'trip_distance',
+    'route_duration_mean',
+    'route_duration_median',
+    'route_speed_mph',
+    'route_trip_count',
+    'pickup_duration_mean',
+    'dropoff_duration_mean',
+    'route_expected_duration',
+]
+
+
+def zone_index(values):
+    """
+    Índice de tabla de cada ID de zona: el mismo ID, o N_ZONES si es desconocido.
+
+    Args:
+        values: Series, array o lista de IDs (pueden venir como string o nulos)
+
+    Returns:
+        Array int64
+    """
+    values = values if isinstance(values, pd.Series) else pd.Series(list(values), dtype=object)
+    if not is_numeric_dtype(values):
+        values = pd.to_numeric(values.astype(object), errors='coerce')
+    ids = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = np.isfinite(ids) & (ids >= 0) & (ids < N_ZONES)
+    return np.where(valid, ids, N_ZONES).astype(np.int64)
+
+
+def _zone(value):
+    """Índice de tabla de un ID de zona suelto (serving)."""
+    try:
+        zone = int(value)
+    except (TypeError, ValueError):
+        return N_ZONES
+    return zone if 0 <= zone < N_ZONES else N_ZONES
+
+
+def _record_zones(record):
+    """Índices (pickup, dropoff) de un dict de features, desde los IDs o desde `PU_DO`."""
+    if 'PULocationID' in record and 'DOLocationID' in record:
+        return _zone(record['PULocationID']), _zone(record['DOLocationID'])
+    pickup, _, dropoff = str(record['PU_DO']).partition('_')
+    return _zone(pickup), _zone(dropoff)
+
+
+def _route_zones(df):
+    """Índices (pickup, dropoff) de cada viaje, desde los IDs o desde `PU_DO`."""
+    if 'PULocationID' in df.columns and 'DOLocationID' in df.columns:
+        return zone_index(df['PULocationID']), zone_index(df['DOLocationID'])
+    # Solo la llave de ruta: se parsea una vez por categoría ('161_236')
+    routes = df['PU_DO'].astype('category')
+    parts = [str(label).split('_', 1) + [''] for label in routes.cat.categories]
+    pickup = np.append(zone_index([p[0] for p in parts]), N_ZONES)
+    dropoff = np.append(zone_index([p[1] for p in parts]), N_ZONES)
+    codes = routes.cat.codes.to_numpy()
+    return pickup[codes], dropoff[codes]
+
+
+def _divide(numerator, denominator):
+    """Cociente elemento a elemento, 0 donde el denominador es 0."""
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator)), where=denominator > 0)
+
+
+def _blend(count, value, prior, smoothing):
+    """m-estimate: promedio de `value` (con peso `count`) y `prior` (con peso `smoothing`)."""
+    weight = _divide(count, count + smoothing)
+    return weight * value + (1 - weight) * prior
+
+
+def histogram_medians(hist, counts):
+    """
+    Mediana de cada fila de un histograma de duraciones, interpolada dentro del bin.
+
+    Args:
+        hist: Matriz CSR (filas × bins) con la cantidad de viajes por bin
+        counts: Viajes por fila (suma de cada fila)
+
+    Returns:
+        Array con la mediana en minutos (0 en las filas vacías)
+    """
+    hist = sp.csr_matrix(hist, dtype=np.float64)
+    hist.sort_indices()
+    medians = np.zeros(hist.shape[0])
+    row_nnz = np.diff(hist.indptr)
+    rows = np.flatnonzero(row_nnz)
+    if not len(rows):
+        return medians
+
+    # Acumulado dentro de cada fila: acumulado global menos lo de las filas anteriores
+    cumulative = np.cumsum(hist.data)
+    before_row = np.concatenate(([0.0], cumulative))[hist.indptr[:-1]]
+    row_cumulative = cumulative - np.repeat(before_row, row_nnz)
+    half = np.repeat(np.asarray(counts, dtype=np.float64) / 2, row_nnz)
+
+    # Primer bin de cada fila donde el acumulado alcanza la mitad
+    starts = hist.indptr[:-1][rows]
+    position = starts + np.add.reduceat((row_cumulative < half).astype(np.int64), starts)
+    in_bin = hist.data[position]
+    fraction = (half[position] - (row_cumulative[position] - in_bin)) / in_bin
+    medians[rows] = (hist.indices[position] + fraction) * DURATION_BIN_MINUTES
+    return medians
+
+
+class RouteStatsIndex:
+    """
+    Estadísticas suavizadas por ruta y por zona para featurizar viajes.
+
+    Se ajusta con `fit` (o `partial_fit` + `merge` + `finalize`) y se usa como
+    vectorizador: `transform_frame(df)` para DataFrames y `transform(dicts)`
+    con la misma interfaz que `DictVectorizer.transform` (serving).
+
+    Args:
+        smoothing: Viajes de peso del nivel más general al suavizar (0 = sin suavizar)
+    """
+
+    feature_names_ = FEATURE_NAMES
+
+    def __init__(self, smoothing=DEFAULT_SMOOTHING):
+        self.smoothing = float(smoothing)
+        self._reset_sums()
+
+    def _reset_sums(self):
+        routes = TABLE_SIZE * TABLE_SIZE
+        self._count = np.zeros(routes)
+        self._sum_duration = np.zeros(routes)
+        self._sum_distance = np.zeros(routes)
+        self._hist = sp.csr_matrix((routes, N_DURATION_BINS))
+
+    def partial_fit(self, df, target='duration'):
+        """
+        Suma los viajes de un chunk a los acumuladores.
+
+        Args:
+            df: DataFrame preparado (zonas o `PU_DO`, `trip_distance` y target)
+            target: Columna de duración en minutos
+
+        Returns:
+            self, para encadenar
+        """
+        pickup, dropoff = _route_zones(df)
+        route = pickup * TABLE_SIZE + dropoff
+        duration = df[target].to_numpy(dtype=np.float64)
+        distance = df['trip_distance'].to_numpy(dtype=np.float64)
+
+        size = len(self._count)
+        self._count += np.bincount(route, minlength=size)
+        self._sum_duration += np.bincount(route, weights=duration, minlength=size)
+        self._sum_distance += np.bincount(route, weights=distance, minlength=size)
+        duration_bin = np.clip((duration / DURATION_BIN_MINUTES).astype(np.int64), 0, N_DURATION_BINS - 1)
+        self._hist = self._hist + sp.csr_matrix(
+            (np.ones(len(route)), (route, duration_bin)), shape=self._hist.shape
+        )
+        return self
+
+    def merge(self, other):
+        """
+        Suma los acumuladores de otra parte (por ejemplo de otro proceso).
+
+        Returns:
+            self, para encadenar
+        """
+        self._count += other._count
+        self._sum_duration += other._sum_duration
+        self._sum_distance += other._sum_distance
+        self._hist = self._hist + other._hist
+        return self
+
+    def finalize(self):
+        """
+        Calcula las estadísticas suavizadas y libera los acumuladores.
+
+        Returns:
+            self, listo para transformar
+        """
+        count, sum_duration, sum_distance = self._count, self._sum_duration, self._sum_distance
+        if not count.sum():
+            raise ValueError("No trips were accumulated")
+        hist = self._hist.tocsr()
+
+        def level_stats(level_count, level_duration, level_distance, level_hist):
+            # Columnas de STAT_NAMES, sin suavizar
+            return np.column_stack([
+                _divide(level_duration, level_count),
+                histogram_medians(level_hist, level_count),
+                _divide(level_distance * 60, level_duration),
+                level_count,
+            ])
+
+        # Agregación de rutas a zona de pickup (filas) y de dropoff (columnas)
+        route_zone = np.arange(len(count))
+        by_pickup = sp.csr_matrix((np.ones(len(count)), (route_zone // TABLE_SIZE, route_zone)))
+        by_dropoff = sp.csr_matrix((np.ones(len(count)), (route_zone % TABLE_SIZE, route_zone)))
+
+        global_stats = level_stats(
+            count.sum(keepdims=True), sum_duration.sum(keepdims=True), sum_distance.sum(keepdims=True),
+            sp.csr_matrix(hist.sum(axis=0))
+        )[0]
+        pickup_stats, dropoff_stats = (
+            level_stats(agg @ count, agg @ sum_duration, agg @ sum_distance, agg @ hist)
+            for agg in (by_pickup, by_dropoff)
+        )
+        for stats in (pickup_stats, dropoff_stats):
+            stats[:, :3] = _blend(stats[:, 3:], stats[:, :3], global_stats[:3], self.smoothing)
+
+        # Solo las rutas vistas; las demás toman los valores de su zona de pickup
+        seen = np.flatnonzero(count)
+        route_stats = level_stats(count[seen], sum_duration[seen], sum_distance[seen], hist[seen])
+        prior = pickup_stats[seen // TABLE_SIZE, :3]
+        route_stats[:, :3] = _blend(route_stats[:, 3:], route_stats[:, :3], prior, self.smoothing)
+
+        self.route_ids_ = seen.astype(np.int32)
+        self.route_stats_ = route_stats.astype(np.float32)
+        self.pickup_stats_ = pickup_stats.astype(np.float32)
+        self.dropoff_stats_ = dropoff_stats.astype(np.float32)
+        self.global_stats_ = global_stats.astype(np.float32)
+        del self._count, self._sum_duration, self._sum_distance, self._hist
+        self._build_table()
+        return self
+
+    def fit(self, frames, target='duration'):
+        """
+        Ajusta el índice con todos los chunks (o meses) de entrenamiento.
+
+        Args:
+            frames: Iterable de DataFrames preparados
+            target: Columna de duración en minutos
+
+        Returns:
+            self, listo para transformar
+        """
+        for df in frames:
+            self.partial_fit(df, target)
+        return self.finalize()
+
+    def _build_table(self):
+        """Tabla densa (pickup, dropoff) -> columnas de ruta y zona (sin las del viaje)."""
+        pickup, dropoff = self.pickup_stats_, self.dropoff_stats_
+        table = np.empty((TABLE_SIZE, TABLE_SIZE, 6), dtype=np.float32)
+        # Rutas sin viajes: valores de la zona de pickup, con cantidad 0
+        table[:, :, :3] = pickup[:, None, :3]
+        table[:, :, 3] = 0
+        table[:, :, 4] = pickup[:, None, 0]
+        table[:, :, 5] = dropoff[None, :, 0]
+        table.reshape(-1, 6)[self.route_ids_, :4] = self.route_stats_
+        self._table = table
+
+    def lookup(self, pickup, dropoff, trip_distance):
+        """
+        Features de viajes ya traducidos a índices de zona (ver `zone_index`).
+
+        Returns:
+            Array float32 (n, len(FEATURE_NAMES))
+        """
+        route = self._table[pickup, dropoff]
+        distance = np.asarray(trip_distance, dtype=np.float32)
+        speed = route[:, 2]
+        expected = np.full(len(route), np.nan, dtype=np.float32)
+        np.divide(distance * 60, speed, out=expected, where=speed > 0)
+        return np.column_stack([distance, route, expected])
+
+    def transform_frame(self, df):
+        """
+        Features densas de un DataFrame preparado.
+
+        Returns:
+            Array float32 (len(df), len(FEATURE_NAMES))
+        """
+        pickup, dropoff = _route_zones(df)
+        return self.lookup(pickup, dropoff, df['trip_distance'].to_numpy())
+
+    def transform(self, X):
+        """
+        Igual que `DictVectorizer.transform`: dicts con `PU_DO` (o
+        `PULocationID`/`DOLocationID`) y `trip_distance`.
+
+        Args:
+            X: Un dict o una lista de dicts
+
+        Returns:
+            Array float32 (n, len(FEATURE_NAMES))
+        """
+        records = [X] if isinstance(X, dict) else list(X)
+        # Sin DataFrame intermedio: en serving cada request es un dict
+        zones = np.array([_record_zones(record) for record in records], dtype=np.int64).reshape(-1, 2)
+        distance = [record['trip_distance'] for record in records]
+        return self.lookup(zones[:, 0], zones[:, 1], distance)
+
+    def get_feature_names_out(self, input_features=None):
+        """Nombres de las columnas producidas (como en sklearn)."""
+        return np.asarray(FEATURE_NAMES, dtype=object)
+
+    def _arrays(self):
+        return {
+            'route_ids': self.route_ids_,
+            'route_stats': self.route_stats_,
+            'pickup_stats': self.pickup_stats_,
+            'dropoff_stats': self.dropoff_stats_,
+            'global_stats': self.global_stats_,
+            'smoothing': np.float64(self.smoothing),
+        }
+
+    def fingerprint(self):
+        """sha256 del índice ajustado (llave de caches)."""
+        digest = hashlib.sha256(b"route_stats")
+        for name, array in sorted(self._arrays().items()):
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def save(self, path):
+        """Guarda el índice ajustado como arrays en un `.npz`."""
+        with open(path, 'wb') as f_out:
+            np.savez(f_out, **self._arrays())
+
+    @classmethod
+    def load(cls, path):
+        """Carga un índice guardado con `save` y arma su tabla de búsqueda."""
+        with np.load(path) as arrays:
+            index = cls(smoothing=float(arrays['smoothing']))
+            index.__setstate__({name: arrays[name] for name in arrays.files})
+        return index
+
+    def __getstate__(self):
+        if hasattr(self, '_count'):
+            # Sin finalizar (ej. una parte que vuelve de otro proceso): los acumuladores
+            return dict(self.__dict__)
+        # Solo los arrays compactos: la tabla densa se rearma al cargar
+        return self._arrays()
+
+    def __setstate__(self, state):
+        if '_count' in state:
+            self.__dict__.update(state)
+            return
+        self.smoothing = float(state['smoothing'])
+        self.route_ids_ = state['route_ids']
+        self.route_stats_ = state['route_stats']
+        self.pickup_stats_ = state['pickup_stats']
+        self.dropoff_stats_ = state['dropoff_stats']
+        self.global_stats_ = state['global_stats']
+        self._build_table()
+
+
+def fold_ids(num_rows, n_folds, offset=0):
+    """
+    Parte out-of-fold de cada fila, por posición: la fila i va a la parte i % n_folds.
+
+    Args:
+        num_rows: Filas del chunk
+        n_folds: Cantidad de partes
+        offset: Filas de los chunks anteriores (la asignación no depende del chunking)
+
+    Returns:
+        Array int64
+    """
+    return np.arange(offset, offset + num_rows) % n_folds
+
+
+def fit_route_stats(frames, smoothing=DEFAULT_SMOOTHING, n_folds=DEFAULT_FOLDS, target='duration'):
+    """
+    Ajusta en una pasada el índice completo y los índices out-of-fold.
+
+    Args:
+        frames: Iterable de DataFrames preparados (chunks o meses)
+        smoothing: Ver `RouteStatsIndex`
+        n_folds: Partes out-of-fold (al menos 2)
+        target: Columna de duración en minutos
+
+    Returns:
+        Tupla (index, fold_indices): el índice con todos los viajes y, para
+        cada parte, uno ajustado sin sus viajes
+    """
+    if n_folds < 2:
+        raise ValueError(f"n_folds must be at least 2, got {n_folds}")
+    parts = [RouteStatsIndex(smoothing) for _ in range(n_folds)]
+    offset = 0
+    for df in frames:
+        folds = fold_ids(len(df), n_folds, offset)
+        offset += len(df)
+        for k, part in enumerate(parts):
+            part.partial_fit(df[folds == k], target)
+
+    index = RouteStatsIndex(smoothing)
+    for part in parts:
+        index.merge(part)
+    fold_indices = []
+    for k in range(n_folds):
+        fold_index = RouteStatsIndex(smoothing)
+        for other in parts[:k] + parts[k + 1:]:
+            fold_index.merge(other)
+        fold_indices.append(fold_index.finalize())
+    return index.finalize(), fold_indices
+
+
+def iter_out_of_fold(frames, fold_indices, target='duration'):
+    """
+    Transforma las filas de entrenamiento con el índice que no las vio.
+
+    Los chunks deben llegar en el mismo orden que al ajustar con `fit_route_stats`.
+
+    Args:
+        frames: Iterable de DataFrames preparados
+        fold_indices: Índices out-of-fold de `fit_route_stats`
+        target: Columna objetivo
+
+    Yields:
+        Tuplas (X_chunk float32, y_chunk)
+    """
+    n_folds = len(fold_indices)
+    offset = 0
+    for df in frames:
+        folds = fold_ids(len(df), n_folds, offset)
+        offset += len(df)
+        pickup, dropoff = _route_zones(df)
+        distance = df['trip_distance'].to_numpy()
+        X = np.empty((len(df), len(FEATURE_NAMES)), dtype=np.float32)
+        for k, fold_index in enumerate(fold_indices):
+            rows = folds == k
+            X[rows] = fold_index.lookup(pickup[rows], dropoff[rows], distance[rows])
+        yield X, df[target].to_numpy()
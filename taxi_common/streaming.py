@@ -0,0 +1,252 @@
+"""Preprocesamiento por chunks con memoria acotada
+
+El archivo se recorre por row groups (en lotes de a lo sumo `rows_per_chunk`
+filas) y cada chunk se convierte en su parte de la matriz de features. Así el
+pico de memoria de cada chunk depende del presupuesto configurado y no del
+tamaño del mes. Para que tampoco la matriz completa esté en memoria, los
+bloques de `iter_file_features` se escriben directo a disco con
+`taxi_common.matrix_store.save_chunks`; `stream_features` en cambio los apila
+para quien necesita la matriz entera.
+
+El DictVectorizer se ajusta en una pasada previa que solo acumula los valores
+únicos de cada feature categórica; como el DictVectorizer ordena los nombres
+de features, el vocabulario resultante es idéntico al de un `fit` completo.
+"""
+
+import itertools
+
+import numpy as np
+import pyarrow.dataset as ds
+
+from taxi_common.features import prepare_trips
+from taxi_common.loader import duration_filter, trip_columns
+from taxi_common.vectorizers import fit_columnar, stack_matrices, transform_frame
+
+DEFAULT_MEMORY_BUDGET_MB = 512
+
+# Bytes por fila de un chunk en su punto más caro: columnas de Arrow y pandas,
+# la llave PU_DO, los índices por feature y las entradas del CSR
+BYTES_PER_ROW = 640
+
+
+def rows_per_chunk(memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    Número máximo de filas por chunk para un presupuesto de memoria.
+
+    Args:
+        memory_budget_mb: Memoria disponible para un chunk en MB
+
+    Returns:
+        Filas por chunk (al menos 1.000)
+    """
+    return max(1_000, int(memory_budget_mb * 1024 ** 2 // BYTES_PER_ROW))
+
+
+def iter_trip_chunks(
+    path,
+    categorical=None,
+    numerical=None,
+    min_duration=1,
+    max_duration=60,
+    memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB,
+    route_key=True,
+    row_groups=None
+):
+    """
+    Recorre un archivo de viajes por chunks ya preparados (`prepare_trips`).
+
+    Args:
+        path: Ruta al archivo parquet
+        categorical: Columnas categóricas a leer
+        numerical: Columnas numéricas a leer
+        min_duration: Duración mínima en minutos
+        max_duration: Duración máxima en minutos
+        memory_budget_mb: Presupuesto de memoria por chunk
+        route_key: Si True, cada chunk incluye `PU_DO`
+        row_groups: Solo estos row groups del archivo (None = todos); permite
+            repartir un archivo entre varios procesos
+
+    Yields:
+        DataFrames con los viajes filtrados de cada chunk
+    """
+    dataset = ds.dataset(str(path), format="parquet")
+    source = dataset
+    if row_groups is not None:
+        (fragment,) = dataset.get_fragments()
+        source = fragment.subset(row_group_ids=list(row_groups))
+    batches = source.to_batches(
+        columns=trip_columns(dataset.schema, categorical, numerical),
+        filter=duration_filter(dataset.schema, min_duration, max_duration),
+        batch_size=rows_per_chunk(memory_budget_mb),
+        # Sin lectura anticipada: un solo row group en memoria a la vez
+        batch_readahead=0,
+        fragment_readahead=0
+    )
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        yield prepare_trips(
+            batch.to_pandas(),
+            min_duration=min_duration,
+            max_duration=max_duration,
+            categorical=categorical,
+            numerical=numerical,
+            route_key=route_key
+        )
+
+
+def num_row_groups(path):
+    """Número de row groups de un archivo parquet (la unidad de trabajo en paralelo)."""
+    (fragment,) = ds.dataset(str(path), format="parquet").get_fragments()
+    return fragment.num_row_groups
+
+
+def num_rows(path):
+    """Filas de un archivo parquet según su metadata, antes de filtrar (cota del tamaño de la matriz)."""
+    return ds.dataset(str(path), format="parquet").count_rows()
+
+
+def fit_vectorizer(chunks, features, min_route_frequency=1):
+    """
+    Ajusta un DictVectorizer acumulando solo los valores únicos de cada chunk.
+
+    Args:
+        chunks: Iterable de DataFrames (por ejemplo `iter_trip_chunks(...)`)
+        features: Columnas que forman cada dict de features
+        min_route_frequency: Viajes mínimos para que una ruta tenga columna propia
+
+    Returns:
+        DictVectorizer ajustado (con 1, equivalente a `fit` sobre todos los registros)
+    """
+    return fit_columnar(chunks, features, min_route_frequency)
+
+
+def iter_feature_chunks(chunks, dv, features, target='duration'):
+    """
+    Transforma cada chunk en su bloque de la matriz de features.
+
+    Args:
+        chunks: Iterable de DataFrames preparados
+        dv: DictVectorizer ya ajustado (o FeatureHasher)
+        features: Columnas que forman cada dict de features
+        target: Columna objetivo
+
+    Yields:
+        Tuplas (X_chunk, y_chunk)
+    """
+    for df in chunks:
+        yield transform_frame(df, dv, features), df[target].values
+
+
+def iter_file_features(paths, dv, features, target='duration', **chunk_kwargs):
+    """
+    Recorre varios archivos chunk por chunk, ya transformados a (X, y).
+
+    Args:
+        paths: Rutas a los archivos parquet (por ejemplo los meses de la ventana)
+        dv: DictVectorizer ya ajustado (o FeatureHasher)
+        features: Columnas que forman cada dict de features
+        target: Columna objetivo
+        **chunk_kwargs: Argumentos para `iter_trip_chunks`
+
+    Yields:
+        Tuplas (X_chunk, y_chunk)
+    """
+    chunks = itertools.chain.from_iterable(iter_trip_chunks(path, **chunk_kwargs) for path in paths)
+    yield from iter_feature_chunks(chunks, dv, features, target)
+
+
+def stream_features(path, features, dv=None, target='duration', min_route_frequency=1, **chunk_kwargs):
+    """
+    Construye (X, y, dv) de un archivo completo sin materializar el mes en pandas.
+
+    Un solo chunk de viajes vive en memoria a la vez, pero los bloques de la
+    matriz se apilan: la matriz CSR final crece con el archivo. Para no tenerla
+    entera en memoria, escribir `iter_file_features` con
+    `matrix_store.save_chunks`.
+
+    Args:
+        path: Ruta al archivo parquet
+        features: Columnas que forman cada dict de features
+        dv: DictVectorizer ya ajustado; si es None se ajusta en una primera pasada
+        target: Columna objetivo
+        min_route_frequency: Viajes mínimos por ruta al ajustar (ver `fit_columnar`)
+        **chunk_kwargs: Argumentos para `iter_trip_chunks`
+
+    Returns:
+        Tupla (X, y, dv)
+    """
+    if dv is None:
+        dv = fit_vectorizer(iter_trip_chunks(path, **chunk_kwargs), features, min_route_frequency)
+
+    X_parts, y_parts = [], []
+    for X_chunk, y_chunk in iter_feature_chunks(iter_trip_chunks(path, **chunk_kwargs), dv, features, target):
+        X_parts.append(X_chunk)
+        y_parts.append(y_chunk)
+
+    if not X_parts:
+        raise ValueError(f"No trips left in {path} after filtering")
+
+    X = stack_matrices(X_parts)
+    y = np.concatenate(y_parts)
+    return X, y, dv
+
+
+def summarize_chunks(chunks):
+    """
+    Estadísticas de un mes calculadas chunk por chunk.
+
+    Args:
+        chunks: Iterable de DataFrames preparados (con `duration` y `PU_DO`)
+
+    Returns:
+        Dict con num_records, avg_duration, min_duration, max_duration y unique_routes
+    """
+    num_records = 0
+    total_duration = 0.0
+    min_duration = float('inf')
+    max_duration = float('-inf')
+    routes = set()
+
+    for df in chunks:
+        num_records += len(df)
+        total_duration += float(df['duration'].sum())
+        min_duration = min(min_duration, float(df['duration'].min()))
+        max_duration = max(max_duration, float(df['duration'].max()))
+        routes.update(df['PU_DO'].unique())
+
+    return {
+        'num_records': num_records,
+        'avg_duration': total_duration / num_records if num_records else float('nan'),
+        'min_duration': min_duration,
+        'max_duration': max_duration,
+        'unique_routes': len(routes),
+    }
+
+
+def stack_features(dfs, features, dv=None, target='duration', min_route_frequency=1):
+    """
+    Construye (X, y, dv) para varios meses sin concatenar sus DataFrames.
+
+    El vocabulario se ajusta sobre los valores únicos de todos los meses y cada
+    mes se transforma por separado; solo se apilan las matrices CSR.
+
+    Args:
+        dfs: Lista de DataFrames preparados (uno por mes)
+        features: Columnas que forman cada dict de features
+        dv: DictVectorizer ya ajustado; si es None se ajusta sobre todos los meses
+        target: Columna objetivo
+        min_route_frequency: Viajes mínimos por ruta al ajustar (ver `fit_columnar`)
+
+    Returns:
+        Tupla (X, y, dv)
+    """
+    if dv is None:
+        dv = fit_vectorizer(dfs, features, min_route_frequency)
+
+    X_parts, y_parts = [], []
+    for X_part, y_part in iter_feature_chunks(dfs, dv, features, target):
+        X_parts.append(X_part)
+        y_parts.append(y_part)
+
+    return stack_matrices(X_parts), np.concatenate(y_parts), dv
@@ -0,0 +1,120 @@
+"""Cache de tasks de Prefect para los flows de duración
+
+Las tasks de carga, features y entrenamiento declaran una llave de cache hecha
+con el código de la task (`TASK_SOURCE`) y una huella de sus inputs, y
+persisten su resultado en el storage local de Prefect
+(`PREFECT_LOCAL_STORAGE_PATH`, por defecto `~/.prefect/storage`).
+
+Los meses y las matrices de features ya tienen su cache con límite de tamaño
+(`DatasetStore` y `FeatureCache`), así que no se duplican en el storage de
+Prefect: los resultados de carga y features exponen `cache_fingerprint()` (el
+sha256 del mes, la llave del FeatureCache), se persisten sin los DataFrames ni
+las matrices y se releen del store al usarlos. Esas mismas huellas forman la
+llave de las tasks que los reciben, en vez de recorrer su contenido.
+
+Del `PipelineConfig` solo entran en la llave los campos que afectan a cada
+task: cambiar un hiperparámetro del modelo no invalida la carga ni las
+features, así que un reintento o una nueva ejecución retoma en la primera task
+cuyos inputs cambiaron. Para forzar el recálculo de todo:
+`PREFECT_TASKS_REFRESH_CACHE=true`.
+"""
+
+import dataclasses
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from prefect.cache_policies import TASK_SOURCE, CachePolicy
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
+
+from taxi_common.feature_cache import CACHE_VERSION, array_fingerprint, frame_fingerprint, vectorizer_fingerprint
+from taxi_common.route_stats import RouteStatsIndex
+
+
+def fingerprint(value):
+    """
+    Huella estable (serializable a JSON) de un input de task.
+
+    Los resultados de otras tasks se identifican por su `cache_fingerprint()`;
+    los vectorizadores por su vocabulario; los dataclasses campo por campo.
+    DataFrames, arrays y matrices sueltos (sin un store que los identifique)
+    se resumen con un sha256 de su contenido.
+    """
+    cache_fingerprint = getattr(value, "cache_fingerprint", None)
+    if callable(cache_fingerprint):
+        return cache_fingerprint()
+    if isinstance(value, pd.DataFrame):
+        return frame_fingerprint(value)
+    if sp.issparse(value) or isinstance(value, np.ndarray):
+        return array_fingerprint(value)
+    if isinstance(value, pd.Series):
+        return array_fingerprint(value.to_numpy())
+    if isinstance(value, (DictVectorizer, FeatureHasher, RouteStatsIndex)):
+        return vectorizer_fingerprint(value)
+    if dataclasses.is_dataclass(value):
+        return {f.name: fingerprint(getattr(value, f.name)) for f in dataclasses.fields(value)}
+    if isinstance(value, (list, tuple)):
+        return [fingerprint(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): fingerprint(v) for k, v in value.items()}
+    return value
+
+
+@dataclass
+class InputFingerprints(CachePolicy):
+    """
+    Llave de cache a partir del código de la task y de la huella de sus inputs.
+
+    Args:
+        config_fields: Campos del input `config` que entran en la llave
+        exclude: Inputs que no afectan el resultado (ej. `offline`)
+        stored: Función que recibe los inputs y retorna la llave del store
+            donde vivirá el resultado (sha256 del mes, llave del FeatureCache),
+            o None si ahí no está: como el resultado persistido es solo una
+            referencia, la task corre entonces sin cache de Prefect
+    """
+
+    config_fields: tuple = ()
+    exclude: tuple = ()
+    stored: Optional[Callable] = None
+
+    def compute_key(self, task_ctx, inputs, flow_parameters, **kwargs):
+        inputs = inputs or {}
+        # La versión del feature engineering (dtypes, ...) invalida también los resultados persistidos
+        content = {
+            "feature_cache_version": CACHE_VERSION,
+            "task_source": TASK_SOURCE.compute_key(task_ctx, inputs, flow_parameters, **kwargs)
+        }
+        if self.stored is not None:
+            content["stored"] = self.stored(inputs)
+            if content["stored"] is None:
+                return None
+        for name, value in inputs.items():
+            if name in self.exclude:
+                continue
+            if name == "config":
+                value = {f: getattr(value, f) for f in self.config_fields}
+            content[name] = fingerprint(value)
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def cached_task_options(config_fields=(), exclude=(), stored=None):
+    """
+    Opciones de `@task` para cachear y persistir el resultado entre ejecuciones.
+
+    Args:
+        config_fields: Campos de `config` que afectan el resultado de la task
+        exclude: Inputs que no afectan el resultado
+        stored: Ver `InputFingerprints` (tasks cuyo resultado se relee de un store)
+
+    Returns:
+        Dict para pasar a `@task(**cached_task_options(...))`
+    """
+    return dict(
+        cache_policy=InputFingerprints(config_fields=tuple(config_fields), exclude=tuple(exclude), stored=stored),
+        persist_result=True
+    )
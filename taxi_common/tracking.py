@@ -0,0 +1,320 @@
+"""Tracking de MLflow que no bloquea el entrenamiento
+
+- La conexión es perezosa: importar un script o definir un flow no habla con
+  el servidor. La primera ejecución que registra algo prueba el servidor con un
+  timeout corto (`/health`) y, si no responde, usa el SQLite local.
+- La conexión y la creación de la ejecución también corren en el worker:
+  `start_run` vuelve de inmediato y `run.run_id` solo espera al servidor si
+  se lo pide (normalmente al final, para reportarlo).
+- Params, métricas y tags se acumulan en memoria y se envían con `log_batch`
+  al cerrar la ejecución, en vez de una llamada por valor.
+- Artifacts y modelos se suben en un worker en segundo plano, junto con el
+  batch y el estado final de la ejecución. Quien necesita el modelo ya en
+  MLflow (ej. una task cacheada que devuelve el run_id) espera su ejecución
+  con `run.wait()`; el resto al final con `Tracker.wait_for_uploads()`.
+
+Ejemplo:
+    tracker = Tracker.from_env("nyc-taxi-experiment")
+    with tracker.start_run() as run:
+        run.log_params(params)
+        run.log_metric("rmse", rmse)
+        run.log_model(mlflow.xgboost, booster, "models_mlflow")
+    tracker.wait_for_uploads()
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mlflow
+from mlflow import MlflowClient
+from mlflow.entities import Metric, Param, RunStatus, RunTag
+from mlflow.utils.mlflow_tags import MLFLOW_PARENT_RUN_ID, MLFLOW_RUN_NAME
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_TRACKING_URI = "sqlite:///mlflow.db"
+DEFAULT_PROBE_TIMEOUT = 2.0
+
+# Límites de MLflow por llamada a log_batch
+MAX_PARAMS_PER_BATCH = 100
+MAX_TAGS_PER_BATCH = 100
+MAX_METRICS_PER_BATCH = 1000
+
+
+def probe(tracking_uri, timeout=DEFAULT_PROBE_TIMEOUT):
+    """
+    Verifica que el servidor de tracking responda antes de usarlo.
+
+    Los URIs locales (sqlite, file, ...) no se prueban.
+
+    Args:
+        tracking_uri: URI de tracking de MLflow
+        timeout: Segundos máximos de espera
+
+    Returns:
+        True si se puede usar el URI
+    """
+    if not tracking_uri.startswith(("http://", "https://")):
+        return True
+    try:
+        with urllib.request.urlopen(f"{tracking_uri.rstrip('/')}/health", timeout=timeout) as response:
+            return response.status == 200
+    except (OSError, ValueError):
+        return False
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class TrackedRun:
+    """
+    Ejecución de MLflow con logging diferido (ver `Tracker.start_run`).
+
+    Los métodos imitan a los de `mlflow` pero no hacen llamadas de red: todo
+    se envía en segundo plano al cerrar el bloque `with`.
+    """
+
+    def __init__(self, tracker, run_future):
+        self.tracker = tracker
+        self._run_future = run_future
+        self._params = {}
+        self._tags = {}
+        self._metrics = []
+        self._uploads = []
+        self._tmp_dir = None
+        self._finish_future = None
+
+    @property
+    def run_id(self):
+        """ID de la ejecución; espera a que el worker la cree (o relanza su error)."""
+        return self._run_future.result()
+
+    def wait(self):
+        """
+        Espera a que la ejecución (cerrada con `with`) quede subida a MLflow.
+
+        Returns:
+            ID de la ejecución
+
+        Raises:
+            La excepción de la subida, si falló
+        """
+        if self._finish_future is None:
+            raise RuntimeError("The run is still open; call wait() after its `with` block")
+        self._finish_future.result()
+        return self.run_id
+
+    def log_param(self, key, value):
+        self._params[key] = str(value)
+
+    def log_params(self, params):
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def log_metric(self, key, value, step=0):
+        self._metrics.append(Metric(key, float(value), int(time.time() * 1000), step))
+
+    def log_metrics(self, metrics, step=0):
+        for key, value in metrics.items():
+            self.log_metric(key, value, step)
+
+    def set_tag(self, key, value):
+        self._tags[key] = str(value)
+
+    def set_tags(self, tags):
+        for key, value in tags.items():
+            self.set_tag(key, value)
+
+    def _snapshot_dir(self):
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix="mlflow-upload-")
+        return Path(tempfile.mkdtemp(dir=self._tmp_dir))
+
+    def log_artifact(self, local_path, artifact_path=None):
+        """Copia el archivo (puede cambiar después) y lo sube en segundo plano."""
+        snapshot = self._snapshot_dir() / Path(local_path).name
+        shutil.copy2(local_path, snapshot)
+        self._uploads.append(
+            lambda client: client.log_artifact(self.run_id, str(snapshot), artifact_path)
+        )
+
+    def log_model(self, flavor, model, artifact_path):
+        """
+        Guarda y sube un modelo en segundo plano.
+
+        Args:
+            flavor: Módulo de MLflow del modelo (ej. `mlflow.xgboost`)
+            model: Modelo entrenado (no se debe modificar después)
+            artifact_path: Carpeta del modelo en los artifacts (ej. `models_mlflow`)
+        """
+        model_dir = self._snapshot_dir() / artifact_path
+
+        def upload(client):
+            flavor.save_model(model, str(model_dir))
+            client.log_artifacts(self.run_id, str(model_dir), artifact_path)
+
+        self._uploads.append(upload)
+
+    def _finish(self, client, status):
+        """Sube artifacts, envía el batch y cierra la ejecución (corre en el worker)."""
+        # Si la ejecución no se pudo crear no hay nada que cerrar: el error queda en este future
+        run_id = self.run_id
+        try:
+            for upload in self._uploads:
+                upload(client)
+            params = [Param(key, value) for key, value in self._params.items()]
+            tags = [RunTag(key, value) for key, value in self._tags.items()]
+            for batch in _chunks(params, MAX_PARAMS_PER_BATCH):
+                client.log_batch(self.run_id, params=batch)
+            for batch in _chunks(tags, MAX_TAGS_PER_BATCH):
+                client.log_batch(self.run_id, tags=batch)
+            for batch in _chunks(self._metrics, MAX_METRICS_PER_BATCH):
+                client.log_batch(self.run_id, metrics=batch)
+        except Exception:
+            status = RunStatus.to_string(RunStatus.FAILED)
+            raise
+        finally:
+            client.set_terminated(run_id, status)
+            if self._tmp_dir is not None:
+                shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        status = RunStatus.to_string(RunStatus.FINISHED if exc_type is None else RunStatus.FAILED)
+        self._finish_future = self.tracker.submit(self._finish, status)
+        return False
+
+
+class Tracker:
+    """
+    Punto de acceso a MLflow compartido por los scripts y flows de entrenamiento.
+
+    Crear el tracker no hace I/O; la conexión se establece en la primera
+    ejecución (`start_run`) o al llamar `connect()`.
+
+    Args:
+        tracking_uri: URI de tracking (None = $MLFLOW_TRACKING_URI o SQLite local)
+        experiment_name: Experimento donde se crean las ejecuciones
+        fallback_uri: URI a usar si el servidor no responde a la prueba
+        probe_timeout: Segundos de espera de la prueba de conexión
+        upload_workers: Hilos que suben ejecuciones en segundo plano
+    """
+
+    def __init__(
+        self,
+        tracking_uri=None,
+        experiment_name="Default",
+        fallback_uri=FALLBACK_TRACKING_URI,
+        probe_timeout=DEFAULT_PROBE_TIMEOUT,
+        upload_workers=2
+    ):
+        self.fallback_uri = fallback_uri
+        self.probe_timeout = probe_timeout
+        self.upload_workers = upload_workers
+        self._lock = threading.Lock()
+        # Aparte de `_lock`: la prueba de conexión (en el worker) no debe frenar a `submit`
+        self._connect_lock = threading.Lock()
+        self._executor = None
+        self._pending = []
+        self.configure(tracking_uri, experiment_name)
+
+    @classmethod
+    def from_env(cls, experiment_name, tracking_uri=None, **kwargs):
+        """Crea el tracker usando $MLFLOW_TRACKING_URI si no se pasa un URI."""
+        return cls(tracking_uri or os.getenv("MLFLOW_TRACKING_URI", FALLBACK_TRACKING_URI), experiment_name, **kwargs)
+
+    def configure(self, tracking_uri=None, experiment_name=None):
+        """Cambia URI y/o experimento; la conexión se vuelve a establecer al usarla."""
+        with self._connect_lock:
+            if tracking_uri is not None or not hasattr(self, "tracking_uri"):
+                self.tracking_uri = tracking_uri or FALLBACK_TRACKING_URI
+            if experiment_name is not None:
+                self.experiment_name = experiment_name
+            self._client = None
+            self._experiment_id = None
+
+    def connect(self):
+        """
+        Conecta con el servidor (una sola vez) y activa el experimento.
+
+        Returns:
+            Tupla (MlflowClient, experiment_id)
+        """
+        with self._connect_lock:
+            if self._experiment_id is None:
+                uri = self.tracking_uri
+                if not probe(uri, self.probe_timeout):
+                    logger.warning(f"MLflow at {uri} did not answer in {self.probe_timeout}s, using {self.fallback_uri}")
+                    uri = self.fallback_uri
+                mlflow.set_tracking_uri(uri)
+                experiment = mlflow.set_experiment(self.experiment_name)
+                self._client = MlflowClient(uri)
+                self._experiment_id = experiment.experiment_id
+                logger.info(f"Tracking to {uri}, experiment '{self.experiment_name}'")
+            return self._client, self._experiment_id
+
+    def start_run(self, run_name=None, parent=None, tags=None):
+        """
+        Crea una ejecución con logging diferido, sin esperar al servidor.
+
+        La conexión y `create_run` corren en el worker de subidas; el
+        `TrackedRun` se usa de inmediato y su `run_id` se resuelve al pedirlo.
+
+        Args:
+            run_name: Nombre de la ejecución
+            parent: TrackedRun padre (ejecución anidada, ej. un trial de HPO)
+            tags: Tags iniciales
+
+        Returns:
+            TrackedRun para usar con `with`
+        """
+        run_tags = dict(tags or {})
+        if run_name is not None:
+            run_tags[MLFLOW_RUN_NAME] = run_name
+
+        def create(client):
+            _, experiment_id = self.connect()
+            if parent is not None:
+                # El padre se envió antes, así que el worker ya lo está creando
+                run_tags[MLFLOW_PARENT_RUN_ID] = parent.run_id
+            return client.create_run(experiment_id, tags=run_tags, run_name=run_name).info.run_id
+
+        return TrackedRun(self, self.submit(create))
+
+    def _call(self, fn, *args):
+        client, _ = self.connect()
+        return fn(client, *args)
+
+    def submit(self, fn, *args):
+        """Ejecuta `fn(client, *args)` en el worker de subidas (que también se conecta)."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.upload_workers, thread_name_prefix="mlflow-upload")
+            future = self._executor.submit(self._call, fn, *args)
+            self._pending.append(future)
+        return future
+
+    def wait_for_uploads(self):
+        """
+        Espera a que terminen las subidas pendientes.
+
+        Returns:
+            Lista de excepciones de las subidas que fallaron (también se loguean)
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        errors = [future.exception() for future in pending]
+        errors = [error for error in errors if error is not None]
+        for error in errors:
+            logger.warning(f"Failed to upload to MLflow: {error}")
+        return errors
@@ -0,0 +1,407 @@
+"""Vectorizadores de features para los pipelines de duración
+
+`dictvectorizer` ajusta un vocabulario (una pasada completa sobre los datos y
+un preprocessor que hay que guardar junto al modelo). `hashing` usa el truco
+de hashing: no tiene estado, así que train y validación (o cada chunk en modo
+streaming) se vectorizan de forma independiente y sin paso de `fit`.
+`route_stats` reemplaza el one-hot de rutas por unas pocas columnas densas
+con estadísticas de la ruta y sus zonas (`taxi_common.route_stats`).
+
+El DictVectorizer se ajusta y aplica por columnas (`fit_columnar` /
+`transform_columnar`): los códigos de las categóricas dan directamente los
+índices de columna del CSR, sin crear un dict de Python por viaje. El
+resultado es un `DictVectorizer` normal, con el mismo `feature_names_` y
+`vocabulary_` que un `fit` sobre los dicts, así que los `preprocessor.b` ya
+guardados siguen funcionando. El hasher se aplica igual (`transform_hashing`):
+cada valor distinto de una columna se hashea una sola vez.
+
+El ancho del hasher (`n_features`) es también el número de columnas que ve
+XGBoost, y la memoria de sus histogramas crece con columnas por nodos: con
+árboles profundos (`max_depth` 30 en los pipelines) 2^14 columnas usan ~0.7 GB
+y 2^18 no entran en un worker de 8 GB. Con 2^14 algunas rutas `PU_DO` comparten
+columna (colisiones), a cambio de entrenar en memoria acotada; más ancho solo
+conviene con árboles bajos (`hashing_memory_warning`).
+
+Las matrices salen en float32 con índices int32 (`FEATURE_DTYPE`): es el tipo
+con que XGBoost y los árboles de sklearn guardan los valores, así que la
+matriz más grande de cada pipeline ocupa la mitad y no hay conversiones
+implícitas al entrenar.
+
+Con `min_route_frequency` las rutas `PU_DO` con menos viajes que el umbral no
+tienen columna propia: comparten la de su zona de pickup (`PU_DO=161_other`).
+Al transformar, toda ruta fuera del vocabulario (rara o nueva) cae en ese
+bucket si existe; con vocabularios sin buckets se ignora, como siempre.
+"""
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pandas.api.types import is_float_dtype
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
+
+from taxi_common.route_stats import RouteStatsIndex
+
+FEATURE_MODES = ('dictvectorizer', 'hashing', 'route_stats')
+DEFAULT_N_FEATURES = 2 ** 14
+FEATURE_DTYPE = np.float32
+
+# Ancho del hasher por encima del cual árboles más profundos que
+# DEEP_TREE_DEPTH agotan la memoria de un worker de 8 GB
+MAX_DEEP_HASHING_FEATURES = 2 ** 16
+DEEP_TREE_DEPTH = 12
+
+# Columna de rutas que se poda con `min_route_frequency` y sufijo de sus buckets
+ROUTE_COLUMN = 'PU_DO'
+OTHER_ROUTE = 'other'
+
+
+def route_fallback(route):
+    """Bucket de una ruta rara o nueva: la zona de pickup ('161_236' -> '161_other')."""
+    return f"{str(route).split('_', 1)[0]}_{OTHER_ROUTE}"
+
+
+def hashing_vectorizer(n_features=DEFAULT_N_FEATURES):
+    """
+    Crea un vectorizador sin estado para dicts de features.
+
+    Los valores string se codifican como 'columna=valor' (igual que el
+    DictVectorizer) y los numéricos con el nombre de la columna.
+
+    Args:
+        n_features: Número de columnas de la matriz (potencia de 2 recomendada;
+            ver `hashing_memory_warning` antes de subirlo)
+
+    Returns:
+        FeatureHasher listo para `transform`
+    """
+    return FeatureHasher(n_features=n_features, input_type='dict', alternate_sign=False, dtype=FEATURE_DTYPE)
+
+
+def initial_vectorizer(mode='dictvectorizer', n_features=DEFAULT_N_FEATURES):
+    """
+    Vectorizador con el que arranca un pipeline según el modo configurado.
+
+    Args:
+        mode: 'dictvectorizer', 'hashing' o 'route_stats'
+        n_features: Columnas del hasher (solo modo hashing)
+
+    Returns:
+        None en modo dictvectorizer o route_stats (hay que ajustarlo con los
+        datos de entrenamiento) o un FeatureHasher en modo hashing
+    """
+    if mode not in FEATURE_MODES:
+        raise ValueError(f"Unknown feature mode '{mode}', expected one of {FEATURE_MODES}")
+    if mode == 'hashing':
+        return hashing_vectorizer(n_features)
+    return None
+
+
+def hashing_memory_warning(n_features, max_depth):
+    """
+    Aviso si el ancho del hasher no entra en memoria con árboles de esa profundidad.
+
+    Los histogramas de XGBoost (`tree_method: hist`) ocupan columnas × bins
+    por nodo, así que el ancho y la profundidad se multiplican: a
+    `max_depth` 30 el pico pasa de ~0.7 GB con 2^14 columnas a ~2 GB con
+    2^16, y con 2^18 el kernel mata el proceso en un worker de 8 GB.
+
+    Args:
+        n_features: Columnas del hasher
+        max_depth: Profundidad máxima de los árboles (None = sin dato)
+
+    Returns:
+        Mensaje para el log, o None si la combinación es razonable
+    """
+    if max_depth is None or n_features <= MAX_DEEP_HASHING_FEATURES or max_depth <= DEEP_TREE_DEPTH:
+        return None
+    return (f"n_features={n_features:,} with max_depth={max_depth} needs several GB of XGBoost histograms "
+            f"(2^18 columns at depth 30 does not fit in 8 GB); use n_features <= {MAX_DEEP_HASHING_FEATURES:,} "
+            f"or max_depth <= {DEEP_TREE_DEPTH}")
+
+
+def is_stateless(vectorizer):
+    """True si el vectorizador no necesita `fit` (modo hashing)."""
+    return isinstance(vectorizer, FeatureHasher)
+
+
+def vectorizer_mode(vectorizer):
+    """Modo de features ('dictvectorizer', 'hashing' o 'route_stats') de un vectorizador ajustado."""
+    if is_stateless(vectorizer):
+        return 'hashing'
+    if isinstance(vectorizer, RouteStatsIndex):
+        return 'route_stats'
+    return 'dictvectorizer'
+
+
+def output_width(vectorizer):
+    """Número de columnas de la matriz que produce un vectorizador ajustado (o hasher)."""
+    if is_stateless(vectorizer):
+        return vectorizer.n_features
+    return len(vectorizer.feature_names_)
+
+
+def index_dtype(maxval):
+    """
+    Dtype de índices de un CSR que debe representar valores hasta `maxval`.
+
+    Igual criterio que `get_index_dtype(maxval=...)` de scipy: int32 si
+    alcanza, int64 si no. `indices` e `indptr` comparten dtype, así que
+    `maxval` debe cubrir tanto el ancho como el nnz acumulado.
+    """
+    return np.int32 if maxval <= np.iinfo(np.int32).max else np.int64
+
+
+def _category_codes(values):
+    """
+    Códigos enteros y valores de una columna categórica (o de IDs enteros).
+
+    Returns:
+        Tupla (codes, labels): `codes` indexa `labels` y vale -1 en los nulos
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories.tolist()
+    codes, uniques = pd.factorize(values.to_numpy())
+    return codes, uniques.tolist()
+
+
+def columnar_feature_counts(frames, features, separator='='):
+    """
+    Cantidad de filas en que aparece cada feature que produciría un DictVectorizer.
+
+    Los conteos de distintos chunks (o procesos) se combinan sumando los Counter.
+
+    Args:
+        frames: Iterable de DataFrames preparados (uno por mes o por chunk)
+        features: Columnas que forman cada dict de features
+        separator: Separador entre columna y valor (el del DictVectorizer)
+
+    Returns:
+        Counter {nombre: filas} ('PU_DO=161_236', 'trip_distance', ...)
+    """
+    counts = Counter()
+    for df in frames:
+        for column in features:
+            if is_float_dtype(df[column]):
+                counts[column] += len(df)
+                continue
+            # Solo las categorías que aparecen (un filtro puede dejar categorías sin uso)
+            codes, labels = _category_codes(df[column])
+            label_counts = np.bincount(codes[codes >= 0], minlength=len(labels))
+            for i in np.flatnonzero(label_counts):
+                counts[f"{column}{separator}{labels[i]}"] += int(label_counts[i])
+    return counts
+
+
+def select_feature_names(counts, min_route_frequency=1, separator='='):
+    """
+    Vocabulario a partir de los conteos, con las rutas raras en buckets por zona.
+
+    Args:
+        counts: Conteos de `columnar_feature_counts`
+        min_route_frequency: Viajes mínimos para que una ruta tenga columna propia
+        separator: Separador entre columna y valor (el del DictVectorizer)
+
+    Returns:
+        Lista ordenada de nombres
+    """
+    prefix = f"{ROUTE_COLUMN}{separator}"
+    names = set()
+    for name, count in counts.items():
+        if name.startswith(prefix) and count < min_route_frequency:
+            names.add(prefix + route_fallback(name[len(prefix):]))
+        else:
+            names.add(name)
+    return sorted(names)
+
+
+def columnar_feature_names(frames, features, separator='=', min_route_frequency=1):
+    """
+    Nombres de features que produciría un DictVectorizer sobre estos DataFrames.
+
+    Args:
+        frames: Iterable de DataFrames preparados (uno por mes o por chunk)
+        features: Columnas que forman cada dict de features
+        separator: Separador entre columna y valor (el del DictVectorizer)
+        min_route_frequency: Viajes mínimos para que una ruta tenga columna propia
+
+    Returns:
+        Lista ordenada de nombres ('PU_DO=161_236', 'trip_distance', ...)
+    """
+    counts = columnar_feature_counts(frames, features, separator)
+    return select_feature_names(counts, min_route_frequency, separator)
+
+
+def vectorizer_from_names(feature_names):
+    """
+    DictVectorizer ajustado con un vocabulario ya calculado.
+
+    Args:
+        feature_names: Nombres de features (se ordenan, como en `fit`)
+
+    Returns:
+        DictVectorizer listo para `transform`
+    """
+    dv = DictVectorizer(sparse=True, dtype=FEATURE_DTYPE)
+    dv.feature_names_ = sorted(feature_names)
+    dv.vocabulary_ = {name: i for i, name in enumerate(dv.feature_names_)}
+    return dv
+
+
+def fit_columnar(frames, features, min_route_frequency=1):
+    """
+    Ajusta un DictVectorizer a partir de las columnas, sin construir dicts.
+
+    Args:
+        frames: Iterable de DataFrames preparados
+        features: Columnas que forman cada dict de features
+        min_route_frequency: Viajes mínimos para que una ruta tenga columna
+            propia (1 = todas, equivalente a `fit` sobre todos los registros)
+
+    Returns:
+        DictVectorizer ajustado
+    """
+    separator = DictVectorizer().separator
+    return vectorizer_from_names(columnar_feature_names(frames, features, separator, min_route_frequency))
+
+
+def transform_columnar(df, dv, features):
+    """
+    Construye la matriz CSR de un DataFrame con el vocabulario de `dv`.
+
+    Igual que `dv.transform(dicts)`: una entrada por feature y fila, en el
+    orden de `features`; los valores categóricos que no están en el
+    vocabulario se ignoran, salvo las rutas con bucket de su zona de pickup.
+
+    Args:
+        df: DataFrame preparado
+        dv: DictVectorizer ajustado
+        features: Columnas que forman cada dict de features
+
+    Returns:
+        Matriz CSR float32 de forma (len(df), len(dv.feature_names_)), también
+        con preprocessors guardados con el dtype float64 por defecto
+    """
+    vocabulary = dv.vocabulary_
+    num_rows = len(df)
+    # indptr acumula hasta una entrada por fila y feature
+    csr_index_dtype = index_dtype(max(len(vocabulary), num_rows * len(features)))
+
+    # Una columna por feature: índice en el vocabulario (-1 = sin entrada) y valor,
+    # ya en los dtypes del CSR para no copiarlos al armarlo
+    indices = np.empty((num_rows, len(features)), dtype=csr_index_dtype)
+    values = np.ones((num_rows, len(features)), dtype=FEATURE_DTYPE)
+    for j, column in enumerate(features):
+        if is_float_dtype(df[column]):
+            indices[:, j] = vocabulary.get(column, -1)
+            values[:, j] = df[column].to_numpy()
+        else:
+            # Índice de cada categoría; el -1 final atiende los códigos nulos (-1)
+            codes, labels = _category_codes(df[column])
+            if column == ROUTE_COLUMN:
+                lookup = [
+                    vocabulary.get(f"{column}{dv.separator}{label}",
+                                   vocabulary.get(f"{column}{dv.separator}{route_fallback(label)}", -1))
+                    for label in labels
+                ]
+            else:
+                lookup = [vocabulary.get(f"{column}{dv.separator}{label}", -1) for label in labels]
+            lookup = np.array(lookup + [-1], dtype=csr_index_dtype)
+            indices[:, j] = lookup[codes]
+
+    present = indices >= 0
+    indptr = np.zeros(num_rows + 1, dtype=csr_index_dtype)
+    np.cumsum(present.sum(axis=1), out=indptr[1:])
+    return sp.csr_matrix(
+        (values[present], indices[present], indptr),
+        shape=(num_rows, len(vocabulary)),
+        copy=False
+    )
+
+
+def _hash_names(hasher, names):
+    """Columna y signo que `hasher` asigna a cada nombre de feature (un hash por nombre)."""
+    if not names:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=FEATURE_DTYPE)
+    # Cada nombre tiene valor 1, así que su fila tiene exactamente una entrada
+    hashed = FeatureHasher(
+        n_features=hasher.n_features, input_type='string',
+        alternate_sign=hasher.alternate_sign, dtype=FEATURE_DTYPE
+    ).transform([[name] for name in names])
+    return hashed.indices, hashed.data
+
+
+def transform_hashing(df, hasher, features):
+    """
+    Construye la matriz CSR de un DataFrame con el truco de hashing, por columnas.
+
+    Igual que `hasher.transform(dicts)`: las categóricas suman 1 en la columna
+    de 'columna=valor' y las numéricas su valor en la de 'columna' (con el
+    signo del hash si `alternate_sign`); los ceros no se guardan y las
+    colisiones dentro de una fila se suman. Cada valor distinto se hashea una
+    sola vez, en lugar de una vez por fila.
+
+    Args:
+        df: DataFrame preparado
+        hasher: FeatureHasher de `hashing_vectorizer`
+        features: Columnas que forman cada dict de features
+
+    Returns:
+        Matriz CSR float32 de forma (len(df), hasher.n_features)
+    """
+    num_rows = len(df)
+    csr_index_dtype = index_dtype(max(hasher.n_features, num_rows * len(features)))
+
+    # Una columna por feature: índice hasheado (-1 = sin entrada) y valor con signo
+    indices = np.empty((num_rows, len(features)), dtype=csr_index_dtype)
+    values = np.empty((num_rows, len(features)), dtype=FEATURE_DTYPE)
+    for j, column in enumerate(features):
+        if is_float_dtype(df[column]):
+            (column_index,), (sign,) = _hash_names(hasher, [column])
+            indices[:, j] = column_index
+            values[:, j] = df[column].to_numpy()
+            values[:, j] *= sign
+        else:
+            # El -1 final atiende los códigos nulos (-1)
+            codes, labels = _category_codes(df[column])
+            label_indices, signs = _hash_names(hasher, [f"{column}={label}" for label in labels])
+            indices[:, j] = np.append(label_indices, -1).astype(csr_index_dtype)[codes]
+            values[:, j] = np.append(signs, 0).astype(FEATURE_DTYPE)[codes]
+
+    # FeatureHasher descarta los valores cero
+    present = (indices >= 0) & (values != 0)
+    indptr = np.zeros(num_rows + 1, dtype=csr_index_dtype)
+    np.cumsum(present.sum(axis=1), out=indptr[1:])
+    X = sp.csr_matrix(
+        (values[present], indices[present], indptr),
+        shape=(num_rows, hasher.n_features), copy=False
+    )
+    X.sum_duplicates()  # colisiones dentro de la fila; también ordena los índices
+    return X
+
+
+def stack_matrices(parts):
+    """Apila bloques de filas de features: CSR si son dispersos, array si son densos."""
+    if all(sp.issparse(part) for part in parts):
+        return sp.vstack(parts, format='csr')
+    return np.vstack(parts)
+
+
+def transform_frame(df, dv, features):
+    """
+    Vectoriza un DataFrame con el vectorizador de cualquiera de los modos.
+
+    Args:
+        df: DataFrame preparado
+        dv: DictVectorizer ajustado, FeatureHasher o RouteStatsIndex
+        features: Columnas que forman cada dict de features
+
+    Returns:
+        Matriz CSR de features (array float32 denso con RouteStatsIndex)
+    """
+    if isinstance(dv, DictVectorizer):
+        return transform_columnar(df, dv, features)
+    if isinstance(dv, RouteStatsIndex):
+        return dv.transform_frame(df)
+    return transform_hashing(df, dv, features)
@@ -0,0 +1,98 @@
+"""Entrenamiento incremental desde el modelo de una ejecución anterior
+
+En vez de entrenar desde cero cada mes, se carga de MLflow el booster
+(`models_mlflow`) y el preprocesador (`preprocessor/<archivo>`) de la ejecución
+padre y se agregan rondas de boosting con los datos nuevos. El vectorizador del
+padre se reutiliza sin `fit`, así el espacio de features no cambia y el booster
+sigue siendo válido. La ejecución hija guarda el id del padre en el tag
+`parent_run_id` para poder reconstruir la cadena de modelos.
+"""
+
+import logging
+import pickle
+
+import mlflow
+
+logger = logging.getLogger(__name__)
+
+MODEL_ARTIFACT_PATH = "models_mlflow"
+PREPROCESSOR_ARTIFACT_PATH = "preprocessor"
+PARENT_RUN_TAG = "parent_run_id"
+
+# Rondas que se agregan por defecto sobre el modelo padre
+DEFAULT_INCREMENTAL_ROUNDS = 10
+
+
+def latest_model_run(experiment_name):
+    """
+    Última ejecución terminada de un experimento que registró un modelo.
+
+    Se ignoran las ejecuciones anidadas (por ejemplo los trials de una búsqueda
+    de hiperparámetros), que no guardan el modelo.
+
+    Args:
+        experiment_name: Nombre del experimento de MLflow
+
+    Returns:
+        run_id de la ejecución
+
+    Raises:
+        LookupError: Si el experimento no tiene ninguna ejecución utilizable
+    """
+    runs = mlflow.search_runs(
+        experiment_names=[experiment_name],
+        filter_string="attributes.status = 'FINISHED' and metrics.rmse > 0",
+        order_by=["attributes.start_time DESC"],
+        max_results=50,
+        output_format="list"
+    )
+    for run in runs:
+        if "mlflow.parentRunId" not in run.data.tags:
+            return run.info.run_id
+    raise LookupError(f"No finished training run with a model in experiment '{experiment_name}'")
+
+
+def load_preprocessor(run_id, filename="preprocessor.b"):
+    """
+    Descarga y abre el vectorizador guardado por una ejecución.
+
+    Args:
+        run_id: Ejecución padre
+        filename: Nombre del archivo dentro de `preprocessor/`
+
+    Returns:
+        DictVectorizer o FeatureHasher de la ejecución
+    """
+    path = mlflow.artifacts.download_artifacts(
+        run_id=run_id,
+        artifact_path=f"{PREPROCESSOR_ARTIFACT_PATH}/{filename}"
+    )
+    with open(path, "rb") as f_in:
+        return pickle.load(f_in)
+
+
+def load_booster(run_id):
+    """
+    Carga el booster de XGBoost registrado por una ejecución.
+
+    Args:
+        run_id: Ejecución padre
+
+    Returns:
+        xgb.Booster listo para pasar como `xgb_model` a `xgb.train`
+    """
+    booster = mlflow.xgboost.load_model(f"runs:/{run_id}/{MODEL_ARTIFACT_PATH}")
+    logger.info(f"Warm start from run {run_id} ({booster.num_boosted_rounds()} rounds)")
+    return booster
+
+
+def log_lineage(parent_run_id, run=mlflow):
+    """
+    Registra de qué modelo se continuó el entrenamiento.
+
+    Args:
+        parent_run_id: Ejecución padre
+        run: Ejecución donde se registra (un `TrackedRun`, o `mlflow` para la activa)
+    """
+    run.set_tag(PARENT_RUN_TAG, parent_run_id)
+    run.log_param("incremental", True)
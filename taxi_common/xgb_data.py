@@ -0,0 +1,185 @@
+"""Construcción de matrices de XGBoost para entrenamiento
+
+Con `tree_method='hist'` (el default de XGBoost) la matriz de entrenamiento
+se convierte directamente a un `QuantileDMatrix`: solo se guardan los índices
+de bin de cada valor, no una copia float del CSR, así que construirlo es más
+rápido y el pico de memoria es menor. Si la validación es densa
+(`route_stats`), también es un `QuantileDMatrix`, construido con
+`ref=dtrain`: reutiliza los cortes de bin del entrenamiento en vez de calcular
+su propio sketch. Si es dispersa (one-hot de `PU_DO`, hashing) sigue siendo un
+`DMatrix`: evaluar cada ronda sobre un `QuantileDMatrix` con miles de columnas
+dispersas es ~70 veces más lento que sobre el CSR, con la misma RMSE. Por lo
+mismo, al continuar un modelo previo (`warm_start`) la de entrenamiento
+también es un `DMatrix`: XGBoost predice primero los árboles existentes sobre
+ella.
+
+Opcionalmente, las matrices construidas se guardan en el formato binario de
+XGBoost (`<fingerprint>.dmatrix`) y las ejecuciones siguientes las cargan sin
+volver a construirlas. XGBoost solo guarda en binario un `DMatrix` normal, así
+que con el cache activado se usa ese tipo de matriz.
+
+Para ventanas que no caben en RAM, `build_external_dmatrices` entrena en modo
+external memory: XGBoost recorre un iterador de chunks `(X, y)` (por ejemplo
+los row groups de los parquet mensuales) y guarda en disco, bajo
+`cache_dir`, las páginas ya procesadas. Solo un chunk y la página en uso viven
+en memoria a la vez.
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import scipy.sparse as sp
+import xgboost as xgb
+
+from taxi_common.feature_cache import array_fingerprint
+
+logger = logging.getLogger(__name__)
+
+QUANTILE_TREE_METHODS = ('hist', 'auto')
+
+
+def supports_quantile(params, warm_start=False):
+    """True si conviene entrenar con QuantileDMatrix según `tree_method` y el warm start."""
+    return not warm_start and params.get('tree_method', 'hist') in QUANTILE_TREE_METHODS
+
+
+class ChunkIterator(xgb.DataIter):
+    """
+    `DataIter` de XGBoost sobre chunks `(X, y)`.
+
+    XGBoost recorre los datos más de una vez (sketch de cuantiles y luego las
+    páginas), así que en cada `reset` se vuelve a llamar a `make_chunks`.
+
+    Args:
+        make_chunks: Función sin argumentos que devuelve un iterable de (X, y)
+        cache_prefix: Prefijo de los archivos de páginas en disco
+    """
+
+    def __init__(self, make_chunks, cache_prefix):
+        self._make_chunks = make_chunks
+        self._chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._chunks is None:
+            self._chunks = iter(self._make_chunks())
+        try:
+            X, y = next(self._chunks)
+        except StopIteration:
+            return False
+        input_data(data=X, label=y)
+        return True
+
+    def reset(self):
+        self._chunks = None
+
+
+def matrix_fingerprint(X, y, weight=None):
+    """Huella del contenido de (X, y[, weight]) para nombrar el archivo binario."""
+    fingerprint = array_fingerprint(X)[:32] + array_fingerprint(y)[:32]
+    if weight is not None:
+        fingerprint += array_fingerprint(weight)[:32]
+    return fingerprint
+
+
+def load_or_build_dmatrix(X, y, cache_dir, fingerprint=None, weight=None):
+    """
+    Carga un DMatrix binario del cache, o lo construye y lo guarda.
+
+    Args:
+        X: Matriz de features
+        y: Target
+        cache_dir: Directorio de los archivos binarios
+        fingerprint: Llave de los datos (por defecto se calcula de X, y y weight)
+        weight: Pesos de las filas (ej. filas comprimidas), o None
+
+    Returns:
+        xgb.DMatrix
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{fingerprint or matrix_fingerprint(X, y, weight)}.dmatrix"
+
+    if path.exists():
+        logger.info(f"Loading binary DMatrix from {path}")
+        return xgb.DMatrix(str(path))
+
+    dmatrix = xgb.DMatrix(X, label=y, weight=weight)
+    # Escritura atómica: otro proceso puede estar leyendo el mismo archivo
+    fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    os.close(fd)
+    try:
+        dmatrix.save_binary(tmp_name, silent=True)
+        os.replace(tmp_name, path)
+    finally:
+        Path(tmp_name).unlink(missing_ok=True)
+    logger.info(f"Saved binary DMatrix to {path}")
+    return dmatrix
+
+
+def build_dmatrices(X_train, y_train, X_val, y_val, params, cache_dir=None, fingerprints=None, warm_start=False,
+                    weight=None):
+    """
+    Construye las matrices de entrenamiento y validación para `xgb.train`.
+
+    Args:
+        X_train: Features de entrenamiento
+        y_train: Target de entrenamiento
+        X_val: Features de validación
+        y_val: Target de validación
+        params: Parámetros de XGBoost (se usan `tree_method` y `max_bin`)
+        cache_dir: Si se indica, guarda/carga las matrices en binario ahí
+        fingerprints: Tupla (train, val) con las llaves de los datos
+        warm_start: True si se continúa un booster existente (`xgb_model`)
+        weight: Pesos de las filas de entrenamiento (ej. de `compress_rows`)
+
+    Returns:
+        Tupla (dtrain, dvalid)
+    """
+    if cache_dir is not None:
+        train_key, val_key = fingerprints or (None, None)
+        return (
+            load_or_build_dmatrix(X_train, y_train, cache_dir, train_key, weight=weight),
+            load_or_build_dmatrix(X_val, y_val, cache_dir, val_key),
+        )
+
+    if supports_quantile(params, warm_start):
+        max_bin = params.get('max_bin', 256)
+        dtrain = xgb.QuantileDMatrix(X_train, label=y_train, weight=weight, max_bin=max_bin)
+        if sp.issparse(X_val):
+            return dtrain, xgb.DMatrix(X_val, label=y_val)
+        return dtrain, xgb.QuantileDMatrix(X_val, label=y_val, ref=dtrain, max_bin=max_bin)
+
+    return xgb.DMatrix(X_train, label=y_train, weight=weight), xgb.DMatrix(X_val, label=y_val)
+
+
+def build_external_dmatrices(train_chunks, val_chunks, params, cache_dir, warm_start=False):
+    """
+    Construye matrices external memory de entrenamiento y validación.
+
+    Args:
+        train_chunks: Función que devuelve un iterable de (X, y) de entrenamiento
+        val_chunks: Función que devuelve un iterable de (X, y) de validación
+        params: Parámetros de XGBoost (se usan `tree_method` y `max_bin`)
+        cache_dir: Directorio donde XGBoost escribe las páginas
+        warm_start: True si se continúa un booster existente (`xgb_model`)
+
+    Returns:
+        Tupla (dtrain, dvalid)
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    train_iter = ChunkIterator(train_chunks, str(cache_dir / "train"))
+    val_iter = ChunkIterator(val_chunks, str(cache_dir / "valid"))
+
+    if supports_quantile(params, warm_start):
+        dtrain = xgb.ExtMemQuantileDMatrix(train_iter, max_bin=params.get('max_bin', 256))
+    else:
+        dtrain = xgb.DMatrix(train_iter)
+    # Validación como DMatrix de páginas dispersas, por la misma razón que en memoria
+    # (con ExtMemQuantileDMatrix y ref=dtrain una ventana one-hot tarda ~15 veces más)
+    dvalid = xgb.DMatrix(val_iter)
+    logger.info(f"External memory DMatrix: {dtrain.num_row()} train rows, pages in {cache_dir}")
+    return dtrain, dvalid